@@ -0,0 +1,102 @@
+'''
+ratio_dumper - Ratio iX5M Log Dumper
+
+MIT License
+
+Copyright (c) 2021 Damian Zaremba
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import time
+from collections import deque
+from pathlib import Path
+from typing import Deque, Dict, Optional, Tuple
+
+from ratio_dumper.emulator import DeviceEmulator, EmulatedDive, load_fixture
+
+DATA_PATH = Path(__file__).parent.parent / 'tests' / 'data'
+
+
+def fixture_dives(name: str) -> Dict[int, EmulatedDive]:
+    '''Load the dive of a recorded fixture in tests/data.'''
+    return load_fixture(DATA_PATH / name)
+
+
+class EmulatedLink:
+    '''In-process transport answering requests like DeviceEmulator, over a simulated link.
+
+    Each request reaches the device after `latency` seconds, the device answers one
+    request at a time and every reply byte costs 10 bits on the wire at `baudrate`.
+    Without a baudrate every reply is available as soon as it is requested.
+    '''
+    _emulator: DeviceEmulator
+    _latency: float
+    _byte_time: float
+    _pending: Deque[Tuple[float, bytes]]
+    _buffer: bytearray
+    _device_free_at: float
+
+    def __init__(self,
+                 dives: Dict[int, EmulatedDive],
+                 latency: float = 0.0,
+                 baudrate: Optional[int] = None) -> None:
+        self._emulator = DeviceEmulator(dives, baudrate=None)
+        self._latency = latency
+        self._byte_time = 10.0 / baudrate if baudrate else 0.0
+        self._pending = deque()
+        self._buffer = bytearray()
+        self._device_free_at = 0.0
+
+    @property
+    def in_waiting(self) -> int:
+        self._receive(time.monotonic())
+        return len(self._buffer)
+
+    def write(self, request: bytes) -> None:
+        response = self._emulator.respond(request)
+        if not self._byte_time and not self._latency:
+            self._buffer += response
+            return
+
+        arrived_at = time.monotonic() + len(request) * self._byte_time + self._latency
+        self._device_free_at = (max(arrived_at, self._device_free_at) +
+                                len(response) * self._byte_time)
+        self._pending.append((self._device_free_at + self._latency, response))
+
+    def read(self, size: int = 1) -> bytes:
+        # Wait for replies still on the wire, as a port with a read timeout would
+        while len(self._buffer) < size and self._pending:
+            delay = self._pending[0][0] - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._receive(time.monotonic())
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def reset_input_buffer(self) -> None:
+        self._receive(time.monotonic())
+        self._buffer.clear()
+
+    def close(self) -> None:
+        pass
+
+    def _receive(self, now: float) -> None:
+        while self._pending and self._pending[0][0] <= now:
+            self._buffer += self._pending.popleft()[1]
@@ -0,0 +1,310 @@
+'''
+ratio_dumper - Ratio iX5M Log Dumper
+
+MIT License
+
+Copyright (c) 2021 Damian Zaremba
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass, replace
+from datetime import datetime, timezone
+from io import BytesIO
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import click
+from crcmod.predefined import mkCrcFun
+
+from ratio_dumper import SerialDriver, convert_to_xml
+from ratio_dumper.decoders import (decode_dive_header, decode_dive_sample,
+                                   reference_decode_dive_sample)
+from ratio_dumper.download import DownloadProgress, download_dives
+from ratio_dumper.emulator import EmulatedDive, synthetic_dive
+from ratio_dumper.export import export_samples
+from ratio_dumper.framing import FrameReader
+from ratio_dumper.models import Dive
+from ratio_dumper.utilities import CRC_ENGINE
+
+from benchmarks.fixtures import DATA_PATH, EmulatedLink, fixture_dives
+
+# A case returns the operation to time and the number of items (frames, samples) it handles
+Case = Callable[[], Tuple[Callable[[], object], int]]
+CASES: Dict[str, Case] = {}
+
+
+@dataclass
+class Result:
+    name: str
+    seconds: float
+    items: int
+    items_per_second: float
+    peak_bytes: int
+
+
+def case(name: str) -> Callable[[Case], Case]:
+    def register(function: Case) -> Case:
+        CASES[name] = function
+        return function
+    return register
+
+
+def _sample_frames() -> List[bytes]:
+    with (DATA_PATH / 'dive_4.json').open('r') as fh:
+        responses: Dict[str, str] = json.loads(fh.read())
+    return [bytes.fromhex(response) for response in responses.values()
+            if bytes.fromhex(response)[2] == 122]
+
+
+def _synthetic_dive(sample_count: int) -> Dive:
+    emulated = synthetic_dive(1, sample_count=sample_count)
+    return replace(decode_dive_header(emulated.header),
+                   samples=[decode_dive_sample(record) for record in emulated.records])
+
+
+@case('request.dive_ids')
+def _request_dive_ids() -> Tuple[Callable[[], object], int]:
+    sd = SerialDriver(None, transport=EmulatedLink(fixture_dives('dive_4.json')))
+    return (lambda: [sd.get_dive_ids() for _ in range(1000)]), 1000
+
+
+@case('frame.decode')
+def _frame_decode() -> Tuple[Callable[[], object], int]:
+    frames = _sample_frames()
+    stream = b''.join(frames)
+
+    def run() -> None:
+        reader, serial = FrameReader(), BytesIO(stream)
+        for _ in frames:
+            reader.read_frame(serial)
+    return run, len(frames)
+
+
+@case('frame.crc')
+def _frame_crc() -> Tuple[Callable[[], object], int]:
+    frames = _sample_frames()
+    return (lambda: [CRC_ENGINE.verify(frame) for frame in frames]), len(frames)
+
+
+@case('frame.crc.rebuilt')
+def _frame_crc_rebuilt() -> Tuple[Callable[[], object], int]:
+    # Building the CRC function for every frame, as before the engine was cached
+    frames = _sample_frames()
+    return (lambda: [mkCrcFun('crc-ccitt-false')(frame[:-2]) for frame in frames]), len(frames)
+
+
+@case('sample.decode')
+def _sample_decode() -> Tuple[Callable[[], object], int]:
+    payloads = [frame[3:-3] for frame in _sample_frames()]
+    return (lambda: [decode_dive_sample(payload) for payload in payloads]), len(payloads)
+
+
+@case('sample.decode.reference')
+def _sample_decode_reference() -> Tuple[Callable[[], object], int]:
+    payloads = [frame[3:-3] for frame in _sample_frames()]
+    return ((lambda: [reference_decode_dive_sample(BytesIO(payload)) for payload in payloads]),
+            len(payloads))
+
+
+def _get_dive_case(dives: Dict[int, EmulatedDive],
+                   latency: float = 0.0,
+                   baudrate: Optional[int] = None,
+                   pipeline_window: int = 1) -> Tuple[Callable[[], object], int]:
+    dive_id = min(dives)
+
+    def run() -> None:
+        with SerialDriver(None, pipeline_window=pipeline_window,
+                          transport=EmulatedLink(dives, latency, baudrate)) as sd:
+            assert sd.get_dive(dive_id) is not None
+    return run, len(dives[dive_id].records)
+
+
+@case('get_dive.mock')
+def _get_dive_mock() -> Tuple[Callable[[], object], int]:
+    return _get_dive_case(fixture_dives('dive_4.json'))
+
+
+@case('get_dive.latency')
+def _get_dive_latency() -> Tuple[Callable[[], object], int]:
+    return _get_dive_case(fixture_dives('dive_4.json'), 0.001, 1000000)
+
+
+@case('get_dive.latency.pipelined')
+def _get_dive_latency_pipelined() -> Tuple[Callable[[], object], int]:
+    return _get_dive_case(fixture_dives('dive_4.json'), 0.001, 1000000, 4)
+
+
+# Lock-step and pipelined transfers over a 115200 baud link, with a short dive as these are slow
+for _latency in (1, 8, 16):
+    for _window in (1, 2, 4):
+        def _transfer(latency: int = _latency,
+                      window: int = _window) -> Tuple[Callable[[], object], int]:
+            return _get_dive_case({1: synthetic_dive(1, sample_count=30)},
+                                  latency / 1000, 115200, window)
+        case(f'transfer.{_latency}ms.window{_window}')(_transfer)
+
+
+for _writers in (1, 2):
+    def _download(writers: int = _writers) -> Tuple[Callable[[], object], int]:
+        # Fetching the next dive overlaps with converting and writing the previous ones
+        dives = {dive_id: synthetic_dive(dive_id, sample_count=1000) for dive_id in range(1, 6)}
+        directory = tempfile.TemporaryDirectory()
+        runs = 0
+
+        def run() -> None:
+            nonlocal runs
+            runs += 1
+            target_directory = Path(directory.name) / str(runs)
+            target_directory.mkdir()
+            with SerialDriver(None, pipeline_window=4, transport=EmulatedLink(dives)) as sd:
+                assert download_dives(sd, target_directory, DownloadProgress(lambda _: None),
+                                      writers=writers)
+        return run, sum(len(dive.records) for dive in dives.values())
+    case(f'download.writers{_writers}')(_download)
+
+
+for _sample_count in (30, 1000, 20000):
+    def _convert_to_xml(sample_count: int = _sample_count) -> Tuple[Callable[[], object], int]:
+        dive = _synthetic_dive(sample_count)
+        return (lambda: convert_to_xml(dive)), sample_count
+    case(f'convert_to_xml.{_sample_count}')(_convert_to_xml)
+
+
+@case('export_samples.csv.1000')
+def _export_samples_csv() -> Tuple[Callable[[], object], int]:
+    dive = _synthetic_dive(1000)
+    directory = tempfile.TemporaryDirectory()
+
+    def run() -> None:
+        export_samples([(dive_id, dive) for dive_id in range(10)],
+                       Path(directory.name) / 'samples.csv')
+    return run, 10000
+
+
+@case('import.cli')
+def _import_cli() -> Tuple[Callable[[], object], int]:
+    # A fresh interpreter each time, as started by the ratio-dumper entry point
+    command = [sys.executable, '-c', 'import ratio_dumper.cli']
+    root = Path(__file__).parent.parent
+    return (lambda: subprocess.run(command, cwd=root, check=True)), 1
+
+
+def run_case(name: str, min_time: float, repeat: int) -> Result:
+    '''Time a case as the best of `repeat` rounds of at least `min_time`, then trace its memory.'''
+    operation, items = CASES[name]()
+
+    best = float('inf')
+    for _ in range(repeat):
+        iterations, started = 0, time.perf_counter()
+        while True:
+            operation()
+            iterations += 1
+            elapsed = time.perf_counter() - started
+            if elapsed >= min_time:
+                break
+        best = min(best, elapsed / iterations)
+
+    tracemalloc.start()
+    try:
+        operation()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return Result(name, best, items, items / best, peak_bytes)
+
+
+def _compare(baseline_path: str, current_path: str, threshold: float) -> bool:
+    '''Print the change of every case between two runs, returning False on a regression.'''
+    runs = []
+    for path in (baseline_path, current_path):
+        with Path(path).open('r') as fh:
+            runs.append({result['name']: result for result in json.loads(fh.read())['results']})
+    baseline, current = runs
+
+    regressed = False
+    click.echo(f'{"case":<30} {"baseline":>12} {"current":>12} {"change":>8} {"peak":>8}')
+    for name in sorted(baseline.keys() & current.keys()):
+        change = current[name]['seconds'] / baseline[name]['seconds'] - 1
+        peak_change = (current[name]['peak_bytes'] / baseline[name]['peak_bytes'] - 1
+                       if baseline[name]['peak_bytes'] else 0.0)
+        flag = ' !' if change > threshold else ''
+        regressed = regressed or bool(flag)
+        click.echo(f'{name:<30} {_format_seconds(baseline[name]["seconds"]):>12} '
+                   f'{_format_seconds(current[name]["seconds"]):>12} '
+                   f'{change:>+8.1%} {peak_change:>+8.1%}{flag}')
+    return not regressed
+
+
+def _format_seconds(seconds: float) -> str:
+    for unit, scale in (('s', 1.0), ('ms', 1e3), ('us', 1e6)):
+        if seconds * scale >= 1:
+            return f'{seconds * scale:.2f}{unit}'
+    return f'{seconds * 1e9:.0f}ns'
+
+
+@click.command()
+@click.option('-k', 'selection', help='Only run cases whose name contains this.')
+@click.option('--min-time', default=0.2, type=click.FloatRange(min=0),
+              help='Minimum seconds per timing round.')
+@click.option('--repeat', default=3, type=click.IntRange(min=1), help='Timing rounds per case.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write the results as JSON.')
+@click.option('--compare', nargs=2, type=click.Path(exists=True, dir_okay=False),
+              help='Compare two result files instead of running.')
+@click.option('--threshold', default=0.1, type=float,
+              help='Slowdown counted as a regression when comparing.')
+def main(selection: Optional[str],
+         min_time: float,
+         repeat: int,
+         output: Optional[str],
+         compare: Optional[Tuple[str, str]],
+         threshold: float) -> None:
+    '''Benchmark framing, decoding, transfers, downloads and XML conversion.'''
+    if compare:
+        sys.exit(0 if _compare(compare[0], compare[1], threshold) else 1)
+
+    results = []
+    click.echo(f'{"case":<30} {"time":>12} {"items/s":>12} {"peak":>10}')
+    for name in CASES:
+        if selection and selection not in name:
+            continue
+        result = run_case(name, min_time, repeat)
+        results.append(result)
+        click.echo(f'{name:<30} {_format_seconds(result.seconds):>12} '
+                   f'{result.items_per_second:>12.0f} {result.peak_bytes / 1024:>8.0f}KB')
+
+    if output:
+        with Path(output).open('w') as fh:
+            json.dump({
+                'created': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'results': [asdict(result) for result in results],
+            }, fh, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -23,11 +23,38 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
-from .driver import SerialDriver
-from .utilities import convert_to_xml
+from importlib import import_module
+from typing import TYPE_CHECKING, Any, List
+
+if TYPE_CHECKING:
+    from .async_driver import AsyncSerialDriver
+    from .driver import SerialDriver
+    from .utilities import convert_to_xml, write_xml
 
 __version__ = '0.0.1'
 __all__ = [
+    "AsyncSerialDriver",
     "SerialDriver",
-    "convert_to_xml"
+    "convert_to_xml",
+    "write_xml"
 ]
+
+# Exports are imported on first access, so importing the package (or the CLI) stays cheap
+_EXPORT_MODULES = {
+    "AsyncSerialDriver": ".async_driver",
+    "SerialDriver": ".driver",
+    "convert_to_xml": ".utilities",
+    "write_xml": ".utilities",
+}
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _EXPORT_MODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(_EXPORT_MODULES[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> List[str]:
+    return sorted(set(globals()) | set(__all__))
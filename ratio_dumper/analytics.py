@@ -0,0 +1,205 @@
+'''
+ratio_dumper - Ratio iX5M Log Dumper
+
+MIT License
+
+Copyright (c) 2021 Damian Zaremba
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+from __future__ import annotations
+
+import logging
+from array import array
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+from .columnar import array_typecode
+from .decoders import DIVE_SAMPLE_DECODER
+from .defaults import DEFAULT_DEPTH_TOLERANCE
+from .export import sample_columns
+from .models import Dive
+from .utilities import import_optional
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Lower edges of the time-at-depth bins in meters, the last bin is open ended
+DEFAULT_DEPTH_BINS: Tuple[float, ...] = (0, 3, 6, 10, 15, 20, 30, 40, 50, 60)
+
+TISSUE_GROUP_FIELDS = tuple(f'tissue_group{group}_percent' for group in range(1, 17))
+_FIELDS = ('runtime_seconds', 'depth', 'temperature') + TISSUE_GROUP_FIELDS
+
+
+@dataclass(frozen=True)
+class DiveStatistics:
+    '''Metrics of one dive computed from its samples, depths in meters and rates in m/min.'''
+    dive_id: int
+    sample_count: int
+    duration: int
+    max_depth: float
+    avg_depth: float
+    max_ascent_rate: float
+    max_descent_rate: float
+    min_temperature: float
+    max_temperature: float
+    avg_temperature: float
+    time_at_depth: Tuple[float, ...]
+    tissue_group_maxima: Tuple[int, ...]
+    header_depth_max: float
+    header_avg_depth: float
+
+    @property
+    def max_tissue_loading(self) -> int:
+        return max(self.tissue_group_maxima, default=0)
+
+    def header_consistent(self, tolerance: float = DEFAULT_DEPTH_TOLERANCE) -> bool:
+        '''Check that the header depth_max and avg_depth agree with the samples.'''
+        if not self.sample_count:
+            return True
+        return (abs(self.header_depth_max - self.max_depth) <= tolerance and
+                abs(self.header_avg_depth - self.avg_depth) <= tolerance)
+
+
+def _collect(dives: Iterable[Tuple[int, Dive]]) -> Tuple[List[Tuple[int, Dive, int]],
+                                                         Dict[str, array[int]]]:
+    '''Concatenate the raw sample columns used by the analytics across many dives.'''
+    formats = dict(zip(DIVE_SAMPLE_DECODER.names, DIVE_SAMPLE_DECODER.formats))
+    columns = {name: array(array_typecode(formats[name])) for name in _FIELDS}
+    collected = []
+    for dive_id, dive in dives:
+        samples = sample_columns(dive)
+        collected.append((dive_id, dive, len(samples)))
+        for name in _FIELDS:
+            columns[name].extend(samples.column(name))
+    return collected, columns
+
+
+def analyse_dives(dives: Iterable[Tuple[int, Dive]],
+                  depth_bins: Sequence[float] = DEFAULT_DEPTH_BINS) -> List[DiveStatistics]:
+    '''Compute the statistics of many dives at once, over their concatenated sample arrays.
+
+    Each sample stands for the time since the previous one (or since the dive
+    started), averages and the time at depth are weighted by it.
+    '''
+    numpy = import_optional('numpy', 'numpy')
+    collected, columns = _collect(dives)
+    raw = {name: numpy.frombuffer(column, dtype=column.typecode)
+           for name, column in columns.items()}
+
+    lengths = numpy.array([sample_count for _, _, sample_count in collected], dtype=numpy.int64)
+    starts = numpy.cumsum(lengths) - lengths
+    # reduceat needs strictly increasing offsets, dives without samples are filled in afterwards
+    segments = starts[lengths > 0]
+
+    runtime = raw['runtime_seconds'].astype(numpy.float64)
+    depth = raw['depth'] / DIVE_SAMPLE_DECODER.divisor('depth')
+    temperature = raw['temperature'] / DIVE_SAMPLE_DECODER.divisor('temperature')
+
+    previous_runtime = numpy.concatenate(([0.0], runtime[:-1]))
+    previous_runtime[segments] = 0.0
+    interval = numpy.clip(runtime - previous_runtime, 0.0, None)
+
+    previous_depth = numpy.concatenate(([0.0], depth[:-1]))
+    previous_depth[segments] = depth[segments]
+    rate = numpy.divide((previous_depth - depth) * 60.0, interval,
+                        out=numpy.zeros_like(depth), where=interval > 0)
+
+    tissues = [raw[name] for name in TISSUE_GROUP_FIELDS]
+    time_at_depth = _time_at_depth(numpy, depth, interval, lengths, depth_bins)
+
+    # Plain Python lists convert to the dataclass fields much faster than numpy scalars
+    metrics = {name: metric.tolist()
+               for name, metric in _segment_metrics(numpy, segments, interval, runtime, depth,
+                                                    temperature, rate, tissues).items()}
+    time_at_depth_rows = time_at_depth.astype(numpy.float64).tolist()
+
+    statistics = []
+    index = 0
+    for position, (dive_id, dive, sample_count) in enumerate(collected):
+        values: Dict[str, Any] = {}
+        if sample_count:
+            values = {name: metric[index] for name, metric in metrics.items()}
+            index += 1
+        statistics.append(DiveStatistics(
+            dive_id=dive_id,
+            sample_count=sample_count,
+            duration=int(values.get('duration', 0)),
+            max_depth=values.get('max_depth', 0.0),
+            avg_depth=values.get('avg_depth', 0.0),
+            max_ascent_rate=values.get('max_ascent_rate', 0.0),
+            max_descent_rate=values.get('max_descent_rate', 0.0),
+            min_temperature=values.get('min_temperature', 0.0),
+            max_temperature=values.get('max_temperature', 0.0),
+            avg_temperature=values.get('avg_temperature', 0.0),
+            time_at_depth=tuple(time_at_depth_rows[position]),
+            tissue_group_maxima=tuple(values.get('tissue_group_maxima',
+                                                 (0,) * len(TISSUE_GROUP_FIELDS))),
+            header_depth_max=dive.depth_max,
+            header_avg_depth=dive.avg_depth,
+        ))
+    return statistics
+
+
+def _segment_metrics(numpy: Any,
+                     segments: Any,
+                     interval: Any,
+                     runtime: Any,
+                     depth: Any,
+                     temperature: Any,
+                     rate: Any,
+                     tissues: Any) -> Dict[str, Any]:
+    '''Reduce the sample arrays to one value per dive with samples.'''
+    if not len(segments):
+        return {}
+
+    weights = numpy.add.reduceat(interval, segments)
+    weights = numpy.where(weights > 0, weights, 1.0)
+    return {
+        'duration': numpy.maximum.reduceat(runtime, segments),
+        'max_depth': numpy.maximum.reduceat(depth, segments),
+        'avg_depth': numpy.add.reduceat(depth * interval, segments) / weights,
+        # A dive that never ascends (or descends) has a rate of 0, never a negative one
+        'max_ascent_rate': numpy.clip(numpy.maximum.reduceat(rate, segments), 0.0, None),
+        'max_descent_rate': numpy.clip(numpy.maximum.reduceat(0.0 - rate, segments), 0.0, None),
+        'min_temperature': numpy.minimum.reduceat(temperature, segments),
+        'max_temperature': numpy.maximum.reduceat(temperature, segments),
+        'avg_temperature': numpy.add.reduceat(temperature * interval, segments) / weights,
+        'tissue_group_maxima': numpy.stack([numpy.maximum.reduceat(tissue, segments)
+                                            for tissue in tissues], axis=1),
+    }
+
+
+def _time_at_depth(numpy: Any,
+                   depth: Any,
+                   interval: Any,
+                   lengths: Any,
+                   depth_bins: Sequence[float]) -> Any:
+    '''Seconds spent in each depth bin, as one row per dive.'''
+    bins = len(depth_bins)
+    bin_index = numpy.clip(numpy.searchsorted(depth_bins, depth, side='right') - 1, 0, bins - 1)
+    dive_index = numpy.repeat(numpy.arange(len(lengths)), lengths)
+    return numpy.bincount(dive_index * bins + bin_index, weights=interval,
+                          minlength=len(lengths) * bins).reshape(len(lengths), bins)
+
+
+def analyse_dive(dive: Dive,
+                 dive_id: int = 0,
+                 depth_bins: Sequence[float] = DEFAULT_DEPTH_BINS) -> DiveStatistics:
+    '''Compute the statistics of a single dive.'''
+    return analyse_dives([(dive_id, dive)], depth_bins)[0]
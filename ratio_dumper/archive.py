@@ -0,0 +1,301 @@
+'''
+ratio_dumper - Ratio iX5M Log Dumper
+
+MIT License
+
+Copyright (c) 2021 Damian Zaremba
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+from __future__ import annotations
+
+import logging
+import mmap
+import struct
+import zlib
+from array import array
+from dataclasses import dataclass, replace
+from datetime import datetime
+from itertools import accumulate
+from pathlib import Path
+from types import TracebackType
+from typing import (BinaryIO, Iterable, Iterator, List, Optional, Set, Tuple, Type,
+                    Union)
+
+from .columnar import ColumnarSamples, array_typecode
+from .decoders import (DIVE_HEADER_DECODER,
+                       DIVE_SAMPLE_DECODER,
+                       decode_dive_header,
+                       dive_header_to_values)
+from .models import Dive, device_time_to_datetime
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Bytes per sample in each column, and the offset of each column within a record's sample block
+_COLUMN_SIZES = tuple(struct.calcsize(fmt) for fmt in DIVE_SAMPLE_DECODER.formats)
+_COLUMN_STARTS = (0,) + tuple(accumulate(_COLUMN_SIZES))[:-1]
+_SAMPLE_SIZE = sum(_COLUMN_SIZES)
+
+
+@dataclass(frozen=True)
+class ArchiveEntry:
+    dive_id: int
+    monotonic_time: int
+    utc_starting_time: int
+    sample_count: int
+    offset: int
+
+    @property
+    def starting_time(self) -> datetime:
+        return device_time_to_datetime(self.utc_starting_time)
+
+
+class DiveArchive:
+    '''Append-only file of many dives, read through mmap with an offset index.
+
+    Each dive is stored as a record holding the raw header payload followed by
+    its samples in columns, in DIVE_SAMPLE_LAYOUT order, so a single dive or a
+    single field across all dives is read without touching unrelated data. The
+    index of record offsets follows the last record and is replaced on every
+    append. An archive whose index is missing or damaged, e.g. after an
+    interrupted append, is recovered by walking the record headers.
+
+    File layout:
+     4 bytes, magic
+     1 byte, format version
+     records, each:
+      4 bytes, record magic
+      4 bytes, dive id
+      4 bytes, sample count
+      <..> header, as a command 121 payload
+      <..> sample columns, little-endian
+     index, one entry per record:
+      4 bytes, dive id
+      4 bytes, monotonic time
+      4 bytes, UTC starting time
+      4 bytes, sample count
+      8 bytes, record offset
+     footer:
+      8 bytes, index offset
+      4 bytes, entry count
+      4 bytes, CRC-32 of the index
+      4 bytes, index magic
+    '''
+    MAGIC = b'RDAR'
+    VERSION = 1
+    RECORD_MAGIC = b'DIVE'
+    INDEX_MAGIC = b'RDIX'
+    _preamble = struct.Struct('<4sB')
+    _record = struct.Struct('<4sII')
+    _index_entry = struct.Struct('<IIIIQ')
+    _footer = struct.Struct('<QII4s')
+
+    path: Path
+    entries: List[ArchiveEntry]
+    _file: BinaryIO
+    _map: Optional[mmap.mmap]
+    _data_end: int
+    _identities: Set[Tuple[int, int]]
+
+    def __init__(self, path: Union[str, Path], readonly: bool = False) -> None:
+        self.path = Path(path)
+        if readonly:
+            self._file = self.path.open('rb')
+        elif self.path.exists():
+            self._file = self.path.open('r+b')
+        else:
+            self._file = self.path.open('w+b')
+            self._file.write(self._preamble.pack(self.MAGIC, self.VERSION))
+            self._file.flush()
+
+        self._map = None
+        try:
+            self._open_map()
+            self.entries, self._data_end = self._load_index()
+        except Exception:
+            self.close()
+            raise
+        self._identities = {(entry.monotonic_time, entry.utc_starting_time)
+                            for entry in self.entries}
+
+    def __enter__(self) -> DiveArchive:
+        return self
+
+    def __exit__(self,
+                 exc_type: Optional[Type[BaseException]],
+                 exc_val: Optional[BaseException],
+                 exc_tb: Optional[TracebackType]) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._close_map()
+        self._file.close()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __iter__(self) -> Iterator[ArchiveEntry]:
+        return iter(self.entries)
+
+    def __contains__(self, dive: object) -> bool:
+        '''Check whether a dive (or just its header) is archived, by its identity.'''
+        if not isinstance(dive, Dive):
+            return False
+        return (dive.monotonic_time, dive.utc_starting_time) in self._identities
+
+    def _open_map(self) -> None:
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = self._preamble.unpack_from(self._map)
+        if magic != self.MAGIC:
+            raise ValueError(f'{self.path} is not a dive archive')
+        if version != self.VERSION:
+            raise ValueError(f'{self.path} is not a version {self.VERSION} dive archive')
+
+    def _record_size(self, sample_count: int) -> int:
+        return self._record.size + DIVE_HEADER_DECODER.size + sample_count * _SAMPLE_SIZE
+
+    def _load_index(self) -> Tuple[List[ArchiveEntry], int]:
+        '''Read the index from the footer, falling back to walking the records.'''
+        assert self._map is not None
+        data = self._map
+        index_end = len(data) - self._footer.size
+        if index_end >= self._preamble.size:
+            index_offset, count, checksum, magic = self._footer.unpack_from(data, index_end)
+            index = data[index_offset:index_end]
+            if (magic == self.INDEX_MAGIC and index_offset >= self._preamble.size and
+                    len(index) == count * self._index_entry.size and
+                    zlib.crc32(index) == checksum):
+                return ([ArchiveEntry(*fields) for fields in self._index_entry.iter_unpack(index)],
+                        index_offset)
+
+        if len(data) > self._preamble.size:
+            logger.warning(f'Rebuilding the index of {self.path}')
+        entries = []
+        offset = self._preamble.size
+        while offset + self._record.size <= len(data):
+            magic, dive_id, sample_count = self._record.unpack_from(data, offset)
+            record_end = offset + self._record_size(sample_count)
+            if magic != self.RECORD_MAGIC or record_end > len(data):
+                break
+            header_offset = offset + self._record.size
+            monotonic_time, utc_starting_time = DIVE_HEADER_DECODER.unpack_raw(
+                data, header_offset)[2:4]
+            entries.append(ArchiveEntry(dive_id, monotonic_time, utc_starting_time,
+                                        sample_count, offset))
+            offset = record_end
+        return entries, offset
+
+    def _pack_record(self, dive_id: int, dive: Dive) -> bytes:
+        samples = (dive.samples if isinstance(dive.samples, ColumnarSamples)
+                   else ColumnarSamples(dive.samples))
+        sample_count = len(samples)
+        return b''.join([
+            self._record.pack(self.RECORD_MAGIC, dive_id, sample_count),
+            DIVE_HEADER_DECODER.pack(dive_header_to_values(dive)),
+            *(struct.pack(f'<{sample_count}{fmt}', *samples.column(name))
+              for name, fmt in zip(DIVE_SAMPLE_DECODER.names, DIVE_SAMPLE_DECODER.formats)),
+        ])
+
+    def append(self, dive_id: int, dive: Dive) -> bool:
+        '''Append a dive, returning False if it is already archived.'''
+        return self.extend([(dive_id, dive)]) == 1
+
+    def extend(self, dives: Iterable[Tuple[int, Dive]]) -> int:
+        '''Append dives that are not archived yet and rewrite the index once.
+
+        Returns the number of dives appended.
+        '''
+        appended = 0
+        for dive_id, dive in dives:
+            identity = (dive.monotonic_time, dive.utc_starting_time)
+            if identity in self._identities:
+                continue
+
+            if not appended:
+                # Records are written over the old index, which is rewritten after them
+                self._close_map()
+                self._file.seek(self._data_end)
+                self._file.truncate()
+
+            self._file.write(self._pack_record(dive_id, dive))
+            self.entries.append(ArchiveEntry(dive_id, dive.monotonic_time,
+                                             dive.utc_starting_time, len(dive.samples),
+                                             self._data_end))
+            self._identities.add(identity)
+            self._data_end = self._file.tell()
+            appended += 1
+
+        if appended:
+            self._write_index()
+            self._open_map()
+        return appended
+
+    def _close_map(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _write_index(self) -> None:
+        index = b''.join(self._index_entry.pack(entry.dive_id,
+                                                entry.monotonic_time,
+                                                entry.utc_starting_time,
+                                                entry.sample_count,
+                                                entry.offset)
+                         for entry in self.entries)
+        self._file.write(index)
+        self._file.write(self._footer.pack(self._data_end, len(self.entries),
+                                           zlib.crc32(index), self.INDEX_MAGIC))
+        self._file.flush()
+
+    def find(self, dive_id: int) -> Optional[ArchiveEntry]:
+        '''Find the most recently archived dive with a device dive id.'''
+        for entry in reversed(self.entries):
+            if entry.dive_id == dive_id:
+                return entry
+        return None
+
+    def header(self, entry: ArchiveEntry) -> Dive:
+        '''Decode the header of an archived dive, without its samples.'''
+        assert self._map is not None
+        return decode_dive_header(self._map, entry.offset + self._record.size)
+
+    def column(self, entry: ArchiveEntry, name: str) -> array[int]:
+        '''Read the raw (unscaled) DIVE_SAMPLE_LAYOUT column of an archived dive.'''
+        assert self._map is not None
+        index = DIVE_SAMPLE_DECODER.names.index(name)
+        fmt = DIVE_SAMPLE_DECODER.formats[index]
+        offset = (entry.offset + self._record.size + DIVE_HEADER_DECODER.size +
+                  entry.sample_count * _COLUMN_STARTS[index])
+        return array(array_typecode(fmt),
+                     struct.unpack_from(f'<{entry.sample_count}{fmt}', self._map, offset))
+
+    def iter_column(self, name: str) -> Iterator[Tuple[ArchiveEntry, array[int]]]:
+        '''Read one raw column of every archived dive, in archive order.'''
+        for entry in self.entries:
+            yield entry, self.column(entry, name)
+
+    def dive(self, entry: ArchiveEntry) -> Dive:
+        '''Decode an archived dive, with its samples as ColumnarSamples.'''
+        columns = tuple(self.column(entry, name) for name in DIVE_SAMPLE_DECODER.names)
+        return replace(self.header(entry), samples=ColumnarSamples.from_columns(columns))
+
+    def get(self, dive_id: int) -> Optional[Dive]:
+        '''Decode the most recently archived dive with a device dive id.'''
+        entry = self.find(dive_id)
+        return self.dive(entry) if entry else None
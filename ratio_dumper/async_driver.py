@@ -0,0 +1,232 @@
+'''
+ratio_dumper - Ratio iX5M Log Dumper
+
+MIT License
+
+Copyright (c) 2021 Damian Zaremba
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from types import TracebackType
+from typing import (AsyncGenerator, AsyncIterator, Callable, Deque, Generator, Optional,
+                    Sequence, Set, Type, TypeVar)
+
+from .cache import FrameCache
+from .driver import SerialDriver
+from .metrics import EventKind, MetricsSink, TransferEvent
+from .models import Dive, DiveSample
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class _PendingRequests:
+    '''Sink tracking when each request still waiting on its reply was sent.'''
+    _sent_at: Deque[float]
+    _lock: threading.Lock
+
+    def __init__(self) -> None:
+        self._sent_at = deque()
+        self._lock = threading.Lock()
+
+    def record(self, event: TransferEvent) -> None:
+        with self._lock:
+            if event.kind is EventKind.REQUEST:
+                self._sent_at.append(event.timestamp)
+            elif event.kind is not EventKind.RETRY and self._sent_at:
+                # Replies arrive in request order, whatever their outcome
+                self._sent_at.popleft()
+
+    def close(self) -> None:
+        pass
+
+    def clear(self) -> None:
+        '''Forget requests whose replies were dropped with the input buffer.'''
+        with self._lock:
+            self._sent_at.clear()
+
+    def oldest(self) -> Optional[float]:
+        '''The time.perf_counter() the oldest unanswered request was sent at.'''
+        with self._lock:
+            return self._sent_at[0] if self._sent_at else None
+
+
+class AsyncSerialDriver:
+    '''asyncio front end for SerialDriver.
+
+    Every blocking serial step runs on a single worker thread owned by this
+    driver, so requests to one device stay ordered while other devices and the
+    event loop carry on. Each reply must arrive within `timeout` seconds of its
+    request, retry backoff and cache reads are not counted. On a timeout or
+    cancellation the pending read is interrupted and the input buffer is flushed
+    before the next request. Samples are transferred by the SerialDriver's own
+    transfer loop, stepped one sample at a time, so the frame cache, retries and
+    checkpoints behave as they do for SerialDriver.
+    '''
+    _driver: SerialDriver
+    _executor: ThreadPoolExecutor
+    _timeout: Optional[float]
+    _pending: _PendingRequests
+    _needs_resync: bool
+
+    def __init__(self,
+                 serial_path: Optional[str],
+                 timeout: Optional[float] = 5.0,
+                 pipeline_window: int = 1,
+                 frame_cache: Optional[FrameCache] = None,
+                 sample_retries: int = 0,
+                 retry_delay: float = 0.25,
+                 metrics_sinks: Sequence[MetricsSink] = ()) -> None:
+        self._driver = SerialDriver(serial_path,
+                                    pipeline_window=pipeline_window,
+                                    frame_cache=frame_cache,
+                                    sample_retries=sample_retries,
+                                    retry_delay=retry_delay,
+                                    metrics_sinks=metrics_sinks)
+        self._executor = ThreadPoolExecutor(max_workers=1,
+                                            thread_name_prefix=f'ratio-dumper-{serial_path}')
+        self._timeout = timeout
+        self._pending = _PendingRequests()
+        self._driver.add_metrics_sink(self._pending)
+        self._needs_resync = False
+
+    async def __aenter__(self) -> AsyncSerialDriver:
+        return self
+
+    async def __aexit__(self,
+                        exc_type: Optional[Type[BaseException]],
+                        exc_value: Optional[BaseException],
+                        traceback: Optional[TracebackType]) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        '''Close the serial port once any running request has finished.'''
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._driver.close)
+        self._executor.shutdown(wait=False)
+
+    def _resync(self) -> None:
+        '''Drop any reply left over from an interrupted request.'''
+        self._driver.reset_input()
+        self._pending.clear()
+
+    def _interrupt(self) -> None:
+        '''Unblock a pending read after a timeout or cancellation.'''
+        self._needs_resync = True
+        self._driver.cancel_read()
+
+    async def _run(self, function: Callable[..., T], *args: object) -> T:
+        '''Run a blocking driver call on the worker thread, bounding the wait for each reply.'''
+        loop = asyncio.get_running_loop()
+        if self._needs_resync:
+            self._needs_resync = False
+            await loop.run_in_executor(self._executor, self._resync)
+
+        future = loop.run_in_executor(self._executor, function, *args)
+        try:
+            while not future.done():
+                # With no request outstanding, wake up in time for the deadline of the next
+                sent_at = self._pending.oldest()
+                wait = (self._timeout if sent_at is None or self._timeout is None
+                        else sent_at + self._timeout - time.perf_counter())
+                if wait is not None and wait <= 0:
+                    raise asyncio.TimeoutError()
+                await asyncio.wait((future,), timeout=wait)
+            return future.result()
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            future.cancel()
+            self._interrupt()
+            raise
+
+    async def get_dive_ids(self) -> Optional[Set[int]]:
+        '''Query a device for all dives.'''
+        return await self._run(self._driver.get_dive_ids)
+
+    async def get_dive_header(self, dive_id: int) -> Optional[Dive]:
+        '''Query a device for the header of a specific dive, without any samples.'''
+        return await self._run(self._driver.get_dive_header, dive_id)
+
+    async def iter_dive_samples(self, dive_id: int) -> AsyncIterator[DiveSample]:
+        '''Query a device for the samples of a specific dive, yielding each as it is decoded.
+
+        Raises IOError if the transfer fails.
+        '''
+        dive = await self.get_dive_header(dive_id)
+        if dive is None:
+            raise IOError(f'Failed to read dive {dive_id}')
+
+        # As SerialDriver.iter_dive_samples, frames are only kept to store them in the cache
+        samples = self._iter_samples(dive_id, dive,
+                                     keep_frames=self._driver.frame_cache is not None)
+        try:
+            async for sample in samples:
+                yield sample
+        finally:
+            await samples.aclose()
+
+    def _close_samples(self, samples: Generator[DiveSample, None, None]) -> None:
+        samples.close()
+        # An unfinished transfer resets the input, requests still in flight are not answered
+        self._pending.clear()
+
+    async def _iter_samples(self,
+                            dive_id: int,
+                            dive: Dive,
+                            keep_frames: bool) -> AsyncGenerator[DiveSample, None]:
+        # Step the driver's transfer loop, one sample at a time, on the worker thread
+        samples = self._driver.iter_dive_samples(dive_id, dive, keep_frames)
+        try:
+            while True:
+                sample = await self._run(next, samples, None)
+                if sample is None:
+                    return
+                yield sample
+        finally:
+            # The loop cleans up (checkpoint, input reset) on the worker thread, after any
+            # step still running there
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._executor, self._close_samples, samples)
+
+    async def get_dive(self, dive_id: int) -> Optional[Dive]:
+        '''Query a device for a specific dive, resuming any earlier failed transfer of it.'''
+        dive = await self.get_dive_header(dive_id)
+        if dive is None:
+            return None
+
+        samples = self._iter_samples(dive_id, dive, keep_frames=True)
+        try:
+            async for sample in samples:
+                dive.samples.append(sample)
+        except asyncio.TimeoutError:
+            # An OSError since Python 3.11, a timeout raises as it does for the header
+            raise
+        except IOError:
+            return None
+        finally:
+            await samples.aclose()
+        return dive
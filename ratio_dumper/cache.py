@@ -0,0 +1,171 @@
+'''
+ratio_dumper - Ratio iX5M Log Dumper
+
+MIT License
+
+Copyright (c) 2021 Damian Zaremba
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import hashlib
+import logging
+import os
+import struct
+import threading
+from pathlib import Path
+from typing import List, Optional, Sequence, Union
+
+from .utilities import CRC_ENGINE
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class FrameCache:
+    '''On-disk cache of the raw, CRC verified reply frames for each dive.
+
+    Every dive is stored as a single file holding the command 121 header frame
+    followed by the command 122 sample frames, keyed by the dive id and the
+    header identity (monotonic and UTC starting time). A transfer that failed part
+    way through is kept as a partial entry, holding the header frame and the first
+    samples, so it can be resumed later.
+
+    File layout:
+     4 bytes, magic
+     1 byte, format version
+     4 bytes, frame count
+     <..> frames, as received from the device
+     32 bytes, SHA-256 of everything before it
+    '''
+    MAGIC = b'RDFC'
+    VERSION = 1
+    _preamble = struct.Struct('<4sBI')
+
+    directory: Path
+    max_bytes: int
+
+    def __init__(self, directory: Union[str, Path], max_bytes: int = 256 * 1024 * 1024) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    def _path(self,
+              dive_id: int,
+              monotonic_time: int,
+              utc_starting_time: int,
+              partial: bool = False) -> Path:
+        suffix = '.partial.frames' if partial else '.frames'
+        return self.directory / f'dive-{dive_id}-{utc_starting_time}-{monotonic_time}{suffix}'
+
+    def load(self,
+             dive_id: int,
+             monotonic_time: int,
+             utc_starting_time: int,
+             partial: bool = False) -> Optional[List[bytes]]:
+        '''Load the frames for a dive, returning None on a miss or a failed integrity check.'''
+        path = self._path(dive_id, monotonic_time, utc_starting_time, partial)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+        frames = self._unpack(data)
+        if frames is None:
+            logger.warning(f'Discarding corrupt frame cache entry {path}')
+            path.unlink(missing_ok=True)
+            return None
+
+        # Mark the entry as recently used for eviction, which may have just removed it
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return frames
+
+    def store(self,
+              dive_id: int,
+              monotonic_time: int,
+              utc_starting_time: int,
+              frames: Sequence[bytes],
+              partial: bool = False) -> None:
+        '''Store the frames for a dive, then evict the least recently used entries.'''
+        path = self._path(dive_id, monotonic_time, utc_starting_time, partial)
+        data = self._preamble.pack(self.MAGIC, self.VERSION, len(frames)) + b''.join(frames)
+        data += hashlib.sha256(data).digest()
+
+        temporary_path = path.with_name(f'.{path.name}.{os.getpid()}-{threading.get_ident()}.tmp')
+        temporary_path.write_bytes(data)
+        os.replace(temporary_path, path)
+
+        # A complete entry supersedes any partial transfer of the same dive
+        if not partial:
+            self.discard(dive_id, monotonic_time, utc_starting_time, partial=True)
+        self.evict(keep=path)
+
+    def discard(self,
+                dive_id: int,
+                monotonic_time: int,
+                utc_starting_time: int,
+                partial: bool = False) -> None:
+        '''Remove the entry for a dive, if there is one.'''
+        self._path(dive_id, monotonic_time, utc_starting_time, partial).unlink(missing_ok=True)
+
+    def evict(self, keep: Optional[Path] = None) -> None:
+        '''Remove the least recently used entries until the cache fits in max_bytes.'''
+        entries = []
+        for path in self.directory.glob('dive-*.frames'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            path.unlink(missing_ok=True)
+            total_size -= size
+
+    def _unpack(self, data: bytes) -> Optional[List[bytes]]:
+        '''Split a cache entry into frames, verifying the checksum and every frame CRC.'''
+        if len(data) < self._preamble.size + 32:
+            return None
+
+        body, digest = data[:-32], data[-32:]
+        if hashlib.sha256(body).digest() != digest:
+            return None
+
+        magic, version, frame_count = self._preamble.unpack_from(body)
+        if magic != self.MAGIC or version != self.VERSION:
+            return None
+
+        frames: List[bytes] = []
+        offset = self._preamble.size
+        while offset + 2 <= len(body):
+            frame_size = body[offset + 1] + 4
+            frames.append(body[offset:offset + frame_size])
+            offset += frame_size
+
+        if offset != len(body) or len(frames) != frame_count:
+            return None
+        if not all(CRC_ENGINE.verify_frames(frames)):
+            return None
+        return frames
@@ -0,0 +1,225 @@
+'''
+ratio_dumper - Ratio iX5M Log Dumper
+
+MIT License
+
+Copyright (c) 2021 Damian Zaremba
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+from __future__ import annotations
+
+import logging
+import struct
+import time
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, BinaryIO, Deque, Iterator, Optional, Tuple, Union
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+SENT = 0
+RECEIVED = 1
+
+
+@dataclass(frozen=True)
+class CaptureRecord:
+    direction: int
+    timestamp: float
+    data: bytes
+
+
+class CaptureWriter:
+    '''Append-only binary log of the raw bytes sent to and received from a device.
+
+    File layout:
+     4 bytes, magic
+     1 byte, format version
+     8 bytes, capture start as a UNIX timestamp (double)
+     records, each:
+      1 byte, direction (0 sent, 1 received)
+      8 bytes, seconds since the capture started (double)
+      2 bytes, data length
+      <..> data
+    '''
+    MAGIC = b'RDCP'
+    VERSION = 1
+    _preamble = struct.Struct('<4sBd')
+    _record = struct.Struct('<BdH')
+
+    _fh: BinaryIO
+    _started: float
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self._fh = Path(path).open('ab')
+        self._started = time.monotonic()
+        if self._fh.tell() == 0:
+            self._fh.write(self._preamble.pack(self.MAGIC, self.VERSION, time.time()))
+        else:
+            # Appending another session, keep the timestamps increasing after the last record
+            records = list(read_capture(path))
+            if records:
+                self._started -= records[-1].timestamp
+
+    def record(self, direction: int, data: bytes) -> None:
+        timestamp = time.monotonic() - self._started
+        for offset in range(0, len(data), 65535):
+            chunk = data[offset:offset + 65535]
+            self._fh.write(self._record.pack(direction, timestamp, len(chunk)) + chunk)
+
+        # Requests are a natural boundary, anything before one is kept if the process dies
+        if direction == SENT:
+            self._fh.flush()
+
+    def close(self) -> None:
+        self._fh.close()
+
+
+def read_capture(path: Union[str, Path]) -> Iterator[CaptureRecord]:
+    '''Read the records of a capture, ignoring a record cut short at the end.'''
+    data = Path(path).read_bytes()
+    preamble, record = CaptureWriter._preamble, CaptureWriter._record
+    if len(data) < preamble.size:
+        raise ValueError(f'{path} is not a capture')
+
+    magic, version, _ = preamble.unpack_from(data)
+    if magic != CaptureWriter.MAGIC or version != CaptureWriter.VERSION:
+        raise ValueError(f'{path} is not a version {CaptureWriter.VERSION} capture')
+
+    offset = preamble.size
+    while offset + record.size <= len(data):
+        direction, timestamp, length = record.unpack_from(data, offset)
+        offset += record.size
+        if offset + length > len(data):
+            break
+        yield CaptureRecord(direction, timestamp, data[offset:offset + length])
+        offset += length
+
+    if offset != len(data):
+        logger.warning(f'Ignoring a truncated record at the end of {path}')
+
+
+class CaptureSerial:
+    '''Serial transport wrapper recording everything written and read to a capture.'''
+    _serial: Any
+    _writer: CaptureWriter
+
+    def __init__(self, serial: Any, writer: CaptureWriter) -> None:
+        self._serial = serial
+        self._writer = writer
+
+    def write(self, data: bytes) -> None:
+        self._writer.record(SENT, data)
+        self._serial.write(data)
+
+    def read(self, size: int = 1) -> bytes:
+        data: bytes = self._serial.read(size)
+        if data:
+            self._writer.record(RECEIVED, data)
+        return data
+
+    def close(self) -> None:
+        self._writer.close()
+        self._serial.close()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._serial, name)
+
+
+class ReplaySerialIO:
+    '''Serial transport replaying the received bytes of a capture.
+
+    At full speed every read is answered immediately. With `realtime` each received
+    chunk is held back by its original delay after the request before it. A chunk is
+    never released before the request it followed in the capture has been replayed.
+    '''
+    _sent: Deque[CaptureRecord]
+    _received: Deque[Tuple[int, CaptureRecord]]
+    _requests: int
+    _buffer: bytearray
+    _realtime: bool
+    _anchor: Optional[float]
+    port: Optional[str]
+
+    def __init__(self, path: Union[str, Path], realtime: bool = False) -> None:
+        self._sent = deque()
+        self._received = deque()
+        for record in read_capture(path):
+            if record.direction == SENT:
+                self._sent.append(record)
+            else:
+                # Numbered by the requests sent before it
+                self._received.append((len(self._sent), record))
+        self._requests = 0
+        self._buffer = bytearray()
+        self._realtime = realtime
+        self._anchor = None
+        self.port = str(path)
+
+    @property
+    def in_waiting(self) -> int:
+        self._release(block=False)
+        return len(self._buffer)
+
+    def write(self, data: bytes) -> None:
+        if not self._sent:
+            logger.warning(f'Replay has no more requests, got {data.hex()}')
+            return
+
+        record = self._sent.popleft()
+        self._requests += 1
+        if record.data != data:
+            logger.warning(f'Replay expected request {record.data.hex()}, got {data.hex()}')
+
+        # Received chunks are timed relative to the request that preceded them
+        self._anchor = time.monotonic() - record.timestamp
+
+    def read(self, size: int = 1) -> bytes:
+        while len(self._buffer) < size and self._release(block=True):
+            pass
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def reset_input_buffer(self) -> None:
+        self._buffer.clear()
+
+    def close(self) -> None:
+        pass
+
+    def _release(self, block: bool) -> bool:
+        '''Move the next received chunk into the buffer, once it is due.'''
+        if not self._received:
+            return False
+
+        # Bytes received after a request not replayed yet would answer the wrong request
+        requests, record = self._received[0]
+        if requests > self._requests:
+            return False
+
+        if self._realtime and self._anchor is not None:
+            delay = self._anchor + record.timestamp - time.monotonic()
+            if delay > 0:
+                if not block:
+                    return False
+                time.sleep(delay)
+
+        self._buffer += self._received.popleft()[1].data
+        return True
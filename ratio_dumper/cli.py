@@ -23,14 +23,31 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
+from __future__ import annotations
+
+import glob
 import logging
+import os
 import sys
+from datetime import datetime, timezone
 from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
 
 import click
 
-from .driver import SerialDriver
-from .utilities import convert_to_xml
+from .defaults import DEFAULT_DEPTH_TOLERANCE, EXPORT_FORMATS
+from .models import DiveMode, WaterType
+
+# Everything else is imported by the commands using it, so --help and commands that never
+# open a port stay cheap to start (e.g. pyserial, asyncio, sqlite3)
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+
+    from .download import DownloadProgress
+    from .driver import SerialDriver
+    from .export import SampleStream
+    from .logbook import DiveLogbook
+    from .models import Dive
 
 logger: logging.Logger = logging.getLogger(__name__)
 
@@ -38,73 +55,448 @@ logger: logging.Logger = logging.getLogger(__name__)
 @click.group()
 @click.pass_context
 @click.option('--debug', is_flag=True)
-@click.option('--serial', default='/dev/tty.usbserial-D309VENO')
-def cli(ctx: click.Context, debug: bool, serial: str) -> None:
+@click.option('--serial', multiple=True, default=['/dev/tty.usbserial-D309VENO'],
+              help='Serial port to use, may be repeated or a glob (download only).')
+@click.option('--pipeline-window', default=1, type=click.IntRange(min=1),
+              help='Number of sample requests kept in flight.')
+@click.option('--cache-dir', type=click.Path(file_okay=False),
+              default=lambda: str(_default_cache_dir()),
+              show_default='$XDG_CACHE_HOME/ratio-dumper',
+              help='Directory to cache raw dive frames and transfer checkpoints in.')
+@click.option('--no-cache', is_flag=True,
+              help='Do not cache frames, checkpoints or the dive index on disk.')
+@click.option('--cache-size', default=256, type=click.IntRange(min=1),
+              help='Maximum size of the frame cache in MiB.')
+@click.option('--retries', default=3, type=click.IntRange(min=0),
+              help='Number of times a failed dive sample is requested again.')
+@click.option('--metrics-file', type=click.Path(dir_okay=False),
+              help='Write transfer metrics to this Prometheus textfile.')
+@click.option('--capture', type=click.Path(dir_okay=False),
+              help='Append every byte sent and received to this capture file.')
+@click.option('--replay', type=click.Path(exists=True, dir_okay=False),
+              help='Replay a capture file instead of talking to a device.')
+@click.option('--realtime', is_flag=True, help='Replay with the original timing.')
+def cli(ctx: click.Context,
+        debug: bool,
+        serial: Tuple[str, ...],
+        pipeline_window: int,
+        cache_dir: Optional[str],
+        no_cache: bool,
+        cache_size: int,
+        retries: int,
+        metrics_file: Optional[str],
+        capture: Optional[str],
+        replay: Optional[str],
+        realtime: bool) -> None:
     '''ratio-dumper - Ratio ix5M dumper.'''
+    from .cache import FrameCache
+    from .metrics import PrometheusTextfileSink
+
+    if no_cache:
+        cache_dir = None
+
+    # One sink is shared by every device, it is written once all of them are done
+    metrics_sinks = [PrometheusTextfileSink(metrics_file)] if metrics_file else []
+    for sink in metrics_sinks:
+        ctx.call_on_close(sink.close)
+
     logging.basicConfig(stream=sys.stderr,
                         level=(logging.DEBUG if debug else logging.INFO),
                         format='%(asctime)-15s %(levelname)s:%(name)s:%(message)s')
-    ctx.obj = {'serial_path': serial}
+    ctx.obj = {
+        'serial_paths': _expand_serial_paths(serial),
+        'pipeline_window': pipeline_window,
+        'retries': retries,
+        'metrics_sinks': metrics_sinks,
+        'capture': capture,
+        'replay': replay,
+        'realtime': realtime,
+        'cache_dir': cache_dir,
+        'frame_cache': (FrameCache(cache_dir, max_bytes=cache_size * 1024 * 1024)
+                        if cache_dir else None),
+    }
+
+
+def _default_cache_dir() -> Path:
+    '''The user cache directory, as in the XDG base directory specification.'''
+    cache_home = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(cache_home) / 'ratio-dumper'
+
+
+def _expand_serial_paths(patterns: Tuple[str, ...]) -> List[str]:
+    '''Expand any globs in the --serial options, keeping the given order.'''
+    serial_paths: List[str] = []
+    for pattern in patterns:
+        if not glob.has_magic(pattern):
+            serial_paths.append(pattern)
+            continue
+
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            raise click.BadParameter(f'No serial ports match {pattern}',
+                                     param_hint="'--serial'")
+        serial_paths.extend(matches)
+
+    return sorted(set(serial_paths), key=serial_paths.index)
+
+
+def _single_serial_path(ctx: click.Context) -> str:
+    serial_paths: List[str] = ctx.obj['serial_paths']
+    if len(serial_paths) != 1:
+        raise click.UsageError(f'{ctx.info_name} requires exactly one serial port')
+    return serial_paths[0]
+
+
+def _open_driver(ctx: click.Context, serial_path: Optional[str] = None) -> SerialDriver:
+    '''Open a driver using the global options.'''
+    from .capture import ReplaySerialIO
+    from .driver import SerialDriver
+
+    serial_path = serial_path or _single_serial_path(ctx)
+    driver = SerialDriver(serial_path,
+                          pipeline_window=ctx.obj['pipeline_window'],
+                          frame_cache=ctx.obj['frame_cache'],
+                          sample_retries=ctx.obj['retries'],
+                          metrics_sinks=ctx.obj['metrics_sinks'],
+                          transport=(ReplaySerialIO(ctx.obj['replay'], ctx.obj['realtime'])
+                                     if ctx.obj['replay'] else None))
+
+    if ctx.obj['capture']:
+        # Keep one capture per device when downloading from several at once
+        capture_path = Path(ctx.obj['capture'])
+        if len(ctx.obj['serial_paths']) > 1:
+            capture_path = capture_path.with_name(
+                f'{capture_path.stem}-{Path(serial_path).name}{capture_path.suffix}')
+        driver.start_capture(capture_path)
+    return driver
+
+
+def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    return value.replace(tzinfo=timezone.utc) if value else None
 
 
 @cli.command()
 @click.pass_context
-def list(ctx: click.Context) -> None:
-    '''List all stored dive ids.'''
-    with SerialDriver(ctx.obj['serial_path']) as dc:
+@click.option('--since', type=click.DateTime(), help='Only list dives starting after (UTC).')
+@click.option('--until', type=click.DateTime(), help='Only list dives starting before (UTC).')
+@click.option('--min-depth', type=float, help='Only list dives at least this deep (m).')
+@click.option('--max-depth', type=float, help='Only list dives at most this deep (m).')
+def list(ctx: click.Context,
+         since: Optional[datetime],
+         until: Optional[datetime],
+         min_depth: Optional[float],
+         max_depth: Optional[float]) -> None:
+    '''List all stored dives.'''
+    from .index import DiveIndex
+
+    index_path = Path(ctx.obj['cache_dir']) / 'index.json' if ctx.obj['cache_dir'] else None
+    index = DiveIndex.load(index_path) if index_path else DiveIndex()
+
+    with _open_driver(ctx) as dc:
         dive_ids = dc.get_dive_ids()
+        if dive_ids and not index.refresh(dc, dive_ids):
+            click.echo("Failed to read dive headers")
+            sys.exit(1)
 
     if not dive_ids:
         click.echo('No dive logs found')
         return
 
+    if index_path:
+        index.save(index_path)
+
     click.echo('Available dive logs:')
-    for dive_id in dive_ids:
-        click.echo(f' - {dive_id}')
+    for entry in index.select(_as_utc(since), _as_utc(until), min_depth, max_depth):
+        click.echo(f' - {entry.dive_id}: {entry.starting_time:%Y-%m-%d %H:%M} '
+                   f'max {entry.depth_max:.1f}m avg {entry.avg_depth:.1f}m '
+                   f'{entry.dive_sample_count} samples (v{entry.software_release})')
 
 
 @cli.command()
 @click.pass_context
 @click.argument('dive_id', type=int)
 def export(ctx: click.Context, dive_id: int) -> None:
-    with SerialDriver(ctx.obj['serial_path']) as dc:
-        dive = dc.get_dive(dive_id)
+    from .utilities import write_xml
+
+    with _open_driver(ctx) as dc:
+        dive = dc.get_dive_header(dive_id)
         if dive is None:
             click.echo("Failed to read dive")
             sys.exit(1)
 
-    click.echo(convert_to_xml(dive))
+        # Samples are written as they arrive rather than after the whole dive
+        try:
+            write_xml(dive, click.get_text_stream('stdout'),
+                      samples=dc.iter_dive_samples(dive_id, dive))
+        except IOError:
+            click.echo()
+            click.echo("Failed to read dive", err=True)
+            sys.exit(1)
+    click.echo()
 
 
 @cli.command()
 @click.pass_context
-@click.argument('target_directory', type=click.Path(exists=True))
-def download(ctx: click.Context, target_directory: str) -> None:
-    with SerialDriver(ctx.obj['serial_path']) as dc:
+@click.argument('archive_path', type=click.Path(dir_okay=False))
+def archive(ctx: click.Context, archive_path: str) -> None:
+    '''Append the dives not archived yet to a dive archive.'''
+    from .archive import DiveArchive
+
+    with DiveArchive(archive_path) as dive_archive, _open_driver(ctx) as dc:
         dive_ids = dc.get_dive_ids()
         if dive_ids is None:
-            click.echo("Failed to read dive logs")
+            click.echo("Failed to read dive ids")
             sys.exit(1)
 
-        if len(dive_ids) == 0:
-            click.echo('No dive logs to download')
-            sys.exit(0)
-
-        click.echo('Exporting....')
-        for dive_id in dive_ids:
-            target_file = Path(target_directory) / f'{dive_id}.xml'
-            if target_file.is_file():
-                click.echo(f' - {dive_id} [skipping]')
+        for dive_id in sorted(dive_ids):
+            header = dc.get_dive_header(dive_id)
+            if header is None:
+                click.echo(f"Failed to read dive {dive_id}")
+                sys.exit(1)
+            if header in dive_archive:
                 continue
 
-            click.echo(f' - {dive_id}')
             dive = dc.get_dive(dive_id)
             if dive is None:
-                click.echo("Failed to read dive")
+                click.echo(f"Failed to read dive {dive_id}")
                 sys.exit(1)
+            dive_archive.append(dive_id, dive)
+            click.echo(f'Archived dive {dive_id} ({len(dive.samples)} samples)')
+
+        click.echo(f'{len(dive_archive)} dives in {archive_path}')
+
+
+def _all_dive_ids(dc: SerialDriver) -> List[int]:
+    dive_ids = dc.get_dive_ids()
+    if dive_ids is None:
+        raise click.ClickException('Failed to read dive ids')
+    return sorted(dive_ids)
+
+
+def _device_dives(ctx: click.Context, dive_ids: Tuple[int, ...]) -> Iterator[Tuple[int, Dive]]:
+    '''Read dives from the device, all of them unless dive ids are given.'''
+    with _open_driver(ctx) as dc:
+        for dive_id in dive_ids or _all_dive_ids(dc):
+            dive = dc.get_dive(dive_id)
+            if dive is None:
+                raise click.ClickException(f'Failed to read dive {dive_id}')
+            yield dive_id, dive
+
+
+def _device_sample_streams(ctx: click.Context,
+                           dive_ids: Tuple[int, ...]) -> Iterator[SampleStream]:
+    '''Stream the samples of dives on the device, all of them unless dive ids are given.'''
+    with _open_driver(ctx) as dc:
+        for dive_id in dive_ids or _all_dive_ids(dc):
+            dive = dc.get_dive_header(dive_id)
+            if dive is None:
+                raise click.ClickException(f'Failed to read dive {dive_id}')
+            yield dive_id, dive, dc.iter_dive_samples(dive_id, dive)
+
+
+def _archived_dives(archive_path: str, dive_ids: Tuple[int, ...]) -> Iterator[Tuple[int, Dive]]:
+    '''Read dives from an archive, all of them unless dive ids are given.'''
+    from .archive import DiveArchive
+
+    with DiveArchive(archive_path, readonly=True) as dive_archive:
+        for entry in dive_archive:
+            if not dive_ids or entry.dive_id in dive_ids:
+                yield entry.dive_id, dive_archive.dive(entry)
+
+
+@cli.command('export-samples')
+@click.pass_context
+@click.argument('target_file', type=click.Path(dir_okay=False))
+@click.argument('dive_ids', type=int, nargs=-1)
+@click.option('--format', 'export_format', type=click.Choice(EXPORT_FORMATS),
+              help='Output format, taken from the file suffix by default.')
+@click.option('--archive', 'archive_path', type=click.Path(exists=True, dir_okay=False),
+              help='Read the dives from this archive instead of the device.')
+def export_samples_command(ctx: click.Context,
+                           target_file: str,
+                           dive_ids: Tuple[int, ...],
+                           export_format: Optional[str],
+                           archive_path: Optional[str]) -> None:
+    '''Export the samples of many dives as columns (CSV, NumPy, Arrow or Parquet).'''
+    from .export import export_sample_streams
+
+    streams = (((dive_id, dive, dive.samples)
+                for dive_id, dive in _archived_dives(archive_path, dive_ids))
+               if archive_path else _device_sample_streams(ctx, dive_ids))
+    try:
+        rows = export_sample_streams(streams, target_file, export_format)
+    except (ImportError, IOError, ValueError) as e:
+        raise click.ClickException(str(e)) from e
+    click.echo(f'Exported {rows} samples to {target_file}')
+
+
+@cli.command()
+@click.pass_context
+@click.argument('dive_ids', type=int, nargs=-1)
+@click.option('--archive', 'archive_path', type=click.Path(exists=True, dir_okay=False),
+              help='Read the dives from this archive instead of the device.')
+@click.option('--tolerance', default=DEFAULT_DEPTH_TOLERANCE, type=float,
+              help='Allowed difference (m) between the header and sample depths.')
+def stats(ctx: click.Context,
+          dive_ids: Tuple[int, ...],
+          archive_path: Optional[str],
+          tolerance: float) -> None:
+    '''Summarise dives from their samples and check their headers.'''
+    from .analytics import analyse_dives
+
+    dives = (_archived_dives(archive_path, dive_ids) if archive_path else
+             _device_dives(ctx, dive_ids))
+    try:
+        statistics = analyse_dives(dives)
+    except ImportError as e:
+        raise click.ClickException(str(e)) from e
+
+    for dive in statistics:
+        click.echo(f' - {dive.dive_id}: {dive.duration // 60} min '
+                   f'max {dive.max_depth:.1f}m avg {dive.avg_depth:.1f}m '
+                   f'ascent {dive.max_ascent_rate:.1f}m/min '
+                   f'{dive.min_temperature:.1f}-{dive.max_temperature:.1f}C '
+                   f'tissues {dive.max_tissue_loading}%')
+        if not dive.header_consistent(tolerance):
+            click.echo(f'   header max {dive.header_depth_max:.2f}m avg '
+                       f'{dive.header_avg_depth:.2f}m does not match the samples')
+
+
+@cli.group()
+def logbook() -> None:
+    '''Keep dives in a SQLite logbook and query them by their headers.'''
+
+
+def _new_device_dives(ctx: click.Context,
+                      dive_logbook: DiveLogbook) -> Iterator[Tuple[int, Dive]]:
+    '''Read the dives on the device that are not in the logbook yet.'''
+    from dataclasses import replace
+
+    from .columnar import ColumnarSamples
+
+    with _open_driver(ctx) as dc:
+        for dive_id in _all_dive_ids(dc):
+            header = dc.get_dive_header(dive_id)
+            if header is None:
+                raise click.ClickException(f'Failed to read dive {dive_id}')
+            if header in dive_logbook:
+                continue
+
+            # Samples follow the header already read, it is not requested again
+            try:
+                samples = ColumnarSamples(dc.iter_dive_samples(dive_id, header))
+            except IOError as e:
+                raise click.ClickException(f'Failed to read dive {dive_id}') from e
+            click.echo(f'Read dive {dive_id} ({len(samples)} samples)')
+            yield dive_id, replace(header, samples=samples)
+
+
+@logbook.command('ingest')
+@click.pass_context
+@click.argument('logbook_path', type=click.Path(dir_okay=False))
+@click.option('--archive', 'archive_path', type=click.Path(exists=True, dir_okay=False),
+              help='Read the dives from this archive instead of the device.')
+def logbook_ingest(ctx: click.Context, logbook_path: str, archive_path: Optional[str]) -> None:
+    '''Add the dives not in the logbook yet.'''
+    from .logbook import DiveLogbook
+
+    with DiveLogbook(logbook_path) as dive_logbook:
+        # Each dive is committed once read, a failed read keeps the dives before it
+        dive_count = len(dive_logbook)
+        try:
+            dive_logbook.ingest(_archived_dives(archive_path, ()) if archive_path else
+                                _new_device_dives(ctx, dive_logbook))
+        finally:
+            click.echo(f'Added {len(dive_logbook) - dive_count} dives, '
+                       f'{len(dive_logbook)} dives in {logbook_path}')
+
+
+@logbook.command('query')
+@click.argument('logbook_path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--since', type=click.DateTime(), help='Only list dives starting after (UTC).')
+@click.option('--until', type=click.DateTime(), help='Only list dives starting before (UTC).')
+@click.option('--min-depth', type=float, help='Only list dives at least this deep (m).')
+@click.option('--max-depth', type=float, help='Only list dives at most this deep (m).')
+@click.option('--mode', type=click.Choice([mode.name for mode in DiveMode],
+                                          case_sensitive=False),
+              help='Only list dives in this mode.')
+@click.option('--water', type=click.Choice([water.name for water in WaterType],
+                                           case_sensitive=False),
+              help='Only list dives in this water type.')
+def logbook_query(logbook_path: str,
+                  since: Optional[datetime],
+                  until: Optional[datetime],
+                  min_depth: Optional[float],
+                  max_depth: Optional[float],
+                  mode: Optional[str],
+                  water: Optional[str]) -> None:
+    '''List the dives in a logbook, filtered by their headers.'''
+    from .logbook import DiveLogbook
+
+    with DiveLogbook(logbook_path) as dive_logbook:
+        entries = dive_logbook.select(_as_utc(since), _as_utc(until), min_depth, max_depth,
+                                      DiveMode[mode] if mode else None,
+                                      WaterType[water] if water else None)
+
+    for entry in entries:
+        click.echo(f' - {entry.dive_id}: {entry.starting_time:%Y-%m-%d %H:%M} '
+                   f'max {entry.depth_max:.1f}m avg {entry.avg_depth:.1f}m '
+                   f'{entry.dive_mode.name} {entry.water.name} {entry.sample_count} samples')
+
+
+def _download_device(ctx: click.Context,
+                     serial_path: str,
+                     target_directory: Path,
+                     progress: DownloadProgress,
+                     device: str,
+                     writers: int) -> bool:
+    '''Download a single device, reporting rather than raising any failure.'''
+    from .download import download_dives
+
+    try:
+        with _open_driver(ctx, serial_path) as dc:
+            return download_dives(dc, target_directory, progress, device, writers)
+    except Exception as e:  # pylint: disable=broad-except
+        logger.exception(f'Download from {serial_path} failed')
+        progress.report(device, f'Failed to download: {e}')
+        return False
+
+
+@cli.command()
+@click.pass_context
+@click.argument('target_directory', type=click.Path(exists=True, file_okay=False))
+@click.option('--writers', default=2, type=click.IntRange(min=1),
+              help='Number of threads converting and writing dives per device.')
+def download(ctx: click.Context, target_directory: str, writers: int) -> None:
+    from concurrent.futures import ThreadPoolExecutor
+
+    from .download import DownloadProgress
+
+    serial_paths: List[str] = ctx.obj['serial_paths']
+    if len(serial_paths) == 1:
+        progress = DownloadProgress(click.echo)
+        if not _download_device(ctx, serial_paths[0], Path(target_directory), progress, '',
+                                writers):
+            sys.exit(1)
+        return
+
+    # One worker per device, each device's dives kept in their own directory
+    progress = DownloadProgress(click.echo, show_totals=True)
+    with ThreadPoolExecutor(max_workers=len(serial_paths)) as executor:
+        results: Dict[str, Future[bool]] = {}
+        for serial_path in serial_paths:
+            device = Path(serial_path).name
+            device_directory = Path(target_directory) / device
+            device_directory.mkdir(exist_ok=True)
+            results[device] = executor.submit(_download_device, ctx, serial_path,
+                                              device_directory, progress, device, writers)
 
-            with open(target_file.as_posix(), 'w') as fh:
-                fh.write(convert_to_xml(dive))
+    failed = [device for device, result in results.items() if not result.result()]
+    click.echo(f'Downloaded {progress.completed} dives from '
+               f'{len(serial_paths) - len(failed)}/{len(serial_paths)} devices')
+    if failed:
+        click.echo(f'Failed devices: {", ".join(failed)}')
+        sys.exit(1)
 
 
 if __name__ == '__main__':
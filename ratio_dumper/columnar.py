@@ -0,0 +1,150 @@
+'''
+ratio_dumper - Ratio iX5M Log Dumper
+
+MIT License
+
+Copyright (c) 2021 Damian Zaremba
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+from __future__ import annotations
+
+from array import array
+from typing import Iterable, Iterator, MutableSequence, Sequence, Tuple, Union, overload
+
+from .decoders import (Buffer,
+                       DIVE_SAMPLE_DECODER,
+                       dive_sample_from_values,
+                       dive_sample_to_values)
+from .models import DiveSample
+
+
+def array_typecode(struct_format: str) -> str:
+    '''Map a struct format to an array typecode of at least the same width.'''
+    if struct_format == 'I' and array('I').itemsize < 4:
+        return 'L'
+    return struct_format
+
+
+class ColumnarSamples(MutableSequence[DiveSample]):
+    '''Dive samples stored as one array per field, DiveSample views are built on access.
+
+    Columns hold the raw integers from the wire in DIVE_SAMPLE_LAYOUT order,
+    divisors are only applied when a DiveSample is built. Columns support the
+    buffer protocol, e.g. `numpy.frombuffer(samples.column('depth'), dtype='H')`.
+    '''
+    _columns: Tuple[array[int], ...]
+
+    def __init__(self, samples: Iterable[DiveSample] = ()) -> None:
+        self._columns = tuple(array(array_typecode(fmt))
+                              for fmt in DIVE_SAMPLE_DECODER.formats)
+        self.extend(samples)
+
+    @classmethod
+    def from_columns(cls, columns: Tuple[array[int], ...]) -> ColumnarSamples:
+        '''Wrap raw columns in DIVE_SAMPLE_LAYOUT order, without copying them.'''
+        samples = cls()
+        samples._columns = columns
+        return samples
+
+    def _sample_from_raw(self, raw_values: Sequence[int]) -> DiveSample:
+        return dive_sample_from_values(DIVE_SAMPLE_DECODER.scale(raw_values))
+
+    def __len__(self) -> int:
+        return len(self._columns[0])
+
+    def __iter__(self) -> Iterator[DiveSample]:
+        for raw_values in zip(*self._columns):
+            yield self._sample_from_raw(raw_values)
+
+    @overload
+    def __getitem__(self, index: int) -> DiveSample:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> ColumnarSamples:
+        ...
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[DiveSample, ColumnarSamples]:
+        if isinstance(index, slice):
+            return self.from_columns(tuple(column[index] for column in self._columns))
+        return self._sample_from_raw([column[index] for column in self._columns])
+
+    @overload
+    def __setitem__(self, index: int, value: DiveSample) -> None:
+        ...
+
+    @overload
+    def __setitem__(self, index: slice, value: Iterable[DiveSample]) -> None:
+        ...
+
+    def __setitem__(self,
+                    index: Union[int, slice],
+                    value: Union[DiveSample, Iterable[DiveSample]]) -> None:
+        if isinstance(index, slice):
+            assert not isinstance(value, DiveSample)
+            replacement = value if isinstance(value, ColumnarSamples) else ColumnarSamples(value)
+            for column, replacement_column in zip(self._columns, replacement._columns):
+                column[index] = replacement_column
+            return
+
+        assert isinstance(value, DiveSample)
+        raw_values = DIVE_SAMPLE_DECODER.unscale(dive_sample_to_values(value))
+        for column, raw_value in zip(self._columns, raw_values):
+            column[index] = raw_value
+
+    def __delitem__(self, index: Union[int, slice]) -> None:
+        for column in self._columns:
+            del column[index]
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, ColumnarSamples):
+            return self._columns == other._columns
+        if isinstance(other, Sequence):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    __hash__ = None  # type: ignore
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}(<{len(self)} samples>)'
+
+    def insert(self, index: int, value: DiveSample) -> None:
+        raw_values = DIVE_SAMPLE_DECODER.unscale(dive_sample_to_values(value))
+        for column, raw_value in zip(self._columns, raw_values):
+            column.insert(index, raw_value)
+
+    def append(self, value: DiveSample) -> None:
+        raw_values = DIVE_SAMPLE_DECODER.unscale(dive_sample_to_values(value))
+        for column, raw_value in zip(self._columns, raw_values):
+            column.append(raw_value)
+
+    def append_raw(self, buffer: Buffer, offset: int = 0) -> None:
+        '''Append a sample straight from a command 122 payload, without building a DiveSample.'''
+        for column, raw_value in zip(self._columns, DIVE_SAMPLE_DECODER.unpack_raw(buffer, offset)):
+            column.append(raw_value)
+
+    def column(self, name: str) -> array[int]:
+        '''Return the raw (unscaled) column for a DIVE_SAMPLE_LAYOUT field.'''
+        return self._columns[DIVE_SAMPLE_DECODER.names.index(name)]
+
+    @property
+    def nbytes(self) -> int:
+        '''Bytes used by the column data.'''
+        return sum(column.itemsize * len(column) for column in self._columns)
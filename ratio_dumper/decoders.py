@@ -0,0 +1,556 @@
+'''
+ratio_dumper - Ratio iX5M Log Dumper
+
+MIT License
+
+Copyright (c) 2021 Damian Zaremba
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import mmap
+import struct
+from functools import lru_cache
+from io import BytesIO
+from typing import Any, List, Optional, Sequence, Tuple, Union
+
+from .models import (Dive,
+                     DiveSample,
+                     DiveMode,
+                     WaterType,
+                     SoftwareVersion,
+                     DecompressionAlgorithm,
+                     DecompressionAlgorithmSettings,
+                     GasMix,
+                     DiveDecompressionSettings,
+                     DecompressionAlgorithmBuhlmannSettings,
+                     DecompressionAlgorithmVpmSettings)
+from .utilities import ByteConverter
+
+# Buffer types accepted by struct.unpack_from
+Buffer = Union[bytes, bytearray, memoryview, mmap.mmap]
+
+# Field layouts are (name, struct format, divisor) in wire order, all values are little-endian.
+# The `to_intXX` ByteConverter helpers do not sign extend, so those fields are unsigned here too.
+Layout = Sequence[Tuple[str, str, Optional[float]]]
+
+DIVE_HEADER_LAYOUT: Layout = (
+    ('active_user', 'B', None),
+    ('dive_sample_count', 'H', None),
+    ('monotonic_time', 'I', None),
+    ('utc_starting_time', 'I', None),
+    ('surface_pressure', 'H', None),
+    ('last_surface_time', 'I', None),
+    ('desaturation_time', 'I', None),
+    ('depth_max', 'H', 100.0),
+    ('decostop_depth_1', 'H', 100.0),
+    ('decostop_depth_2', 'H', 100.0),
+    ('decostop_step_1', 'B', None),
+    ('decostop_step_2', 'B', None),
+    ('decostop_step_3', 'B', None),
+    ('deep_stop_algorithm', 'B', None),
+    ('safety_stop_depth', 'B', 100.0),
+    ('safety_stop_time', 'B', None),
+    ('dive_mode', 'B', None),
+    ('water', 'B', None),
+    ('alarms_general', 'B', None),
+    ('alarm_time', 'H', None),
+    ('alarm_depth', 'H', 100.0),
+    ('backlight_level', 'B', None),
+    ('backlight_mode', 'B', None),
+    ('software_version', 'I', None),
+    ('alert_flag', 'B', None),
+    ('free_user_settings', 'B', None),
+    ('timezone_id', 'B', None),
+    ('avg_depth', 'H', 100.0),
+    ('dum_6', 'B', None),
+    ('dum_7', 'B', None),
+    ('dum_8', 'B', None),
+)
+
+DIVE_SAMPLE_LAYOUT: Layout = (
+    ('battery_voltage', 'H', 100.0),
+    ('runtime_seconds', 'I', None),
+    ('depth', 'H', 10.0),
+    ('temperature', 'H', 10.0),
+    ('active_mix_o2_percentage', 'B', None),
+    ('active_mix_he_percentage', 'B', None),
+    ('suggested_mix_o2_percentage', 'B', None),
+    ('suggested_mix_he_percentage', 'B', None),
+    ('active_algorithm', 'B', None),
+    ('gradient_factor_high', 'B', None),
+    ('gradient_factor_low', 'B', None),
+    ('vpm_r0', 'B', None),
+    ('mode_oc_scr_ccr_gauge', 'B', None),
+    ('max_ppo2_or_setpoint', 'H', 1000.0),
+    ('first_stop_depth', 'H', 10.0),
+    ('first_stop_time', 'H', None),
+    ('ndl_or_tts', 'H', None),
+    ('otu', 'H', None),
+    ('cns', 'H', None),
+    ('tissue_group1_percent', 'B', None),
+    ('tissue_group2_percent', 'B', None),
+    ('tissue_group3_percent', 'B', None),
+    ('tissue_group4_percent', 'B', None),
+    ('tissue_group5_percent', 'B', None),
+    ('tissue_group6_percent', 'B', None),
+    ('tissue_group7_percent', 'B', None),
+    ('tissue_group8_percent', 'B', None),
+    ('tissue_group9_percent', 'B', None),
+    ('tissue_group10_percent', 'B', None),
+    ('tissue_group11_percent', 'B', None),
+    ('tissue_group12_percent', 'B', None),
+    ('tissue_group13_percent', 'B', None),
+    ('tissue_group14_percent', 'B', None),
+    ('tissue_group15_percent', 'B', None),
+    ('tissue_group16_percent', 'B', None),
+    ('enabled_mix_sensors', 'B', None),
+    ('set_point_mode', 'B', None),
+    ('tank_pressure', 'B', None),
+    ('compass_log', 'H', None),
+    ('reserved_2', 'H', None),
+)
+
+
+class StructDecoder:
+    '''A field layout compiled into a single struct.Struct.'''
+    _struct: struct.Struct
+    _names: Tuple[str, ...]
+    _formats: Tuple[str, ...]
+    _divisors: Tuple[Tuple[int, float], ...]
+
+    def __init__(self, layout: Layout) -> None:
+        self._struct = struct.Struct('<' + ''.join(fmt for _, fmt, _ in layout))
+        self._names = tuple(name for name, _, _ in layout)
+        self._formats = tuple(fmt for _, fmt, _ in layout)
+        self._divisors = tuple((index, divisor)
+                               for index, (_, _, divisor) in enumerate(layout)
+                               if divisor is not None)
+
+    @property
+    def size(self) -> int:
+        return self._struct.size
+
+    @property
+    def names(self) -> Tuple[str, ...]:
+        return self._names
+
+    @property
+    def formats(self) -> Tuple[str, ...]:
+        return self._formats
+
+    def divisor(self, name: str) -> float:
+        '''The divisor scaling a raw field, 1 for fields that are not scaled.'''
+        index = self._names.index(name)
+        return dict(self._divisors).get(index, 1.0)
+
+    def unpack_raw(self, buffer: Buffer, offset: int = 0) -> Tuple[int, ...]:
+        '''Unpack all fields from a buffer as raw integers, in layout order.'''
+        return tuple(self._struct.unpack_from(buffer, offset))
+
+    def scale(self, raw_values: Sequence[int]) -> List[Any]:
+        '''Apply the layout divisors to raw integer values.'''
+        values: List[Any] = list(raw_values)
+        for index, divisor in self._divisors:
+            values[index] = values[index] / divisor
+        return values
+
+    def unscale(self, values: Sequence[Any]) -> List[int]:
+        '''Reverse the layout divisors, returning raw integer values.'''
+        raw_values = list(values)
+        for index, divisor in self._divisors:
+            raw_values[index] = round(values[index] * divisor)
+        return raw_values
+
+    def unpack(self, buffer: Buffer, offset: int = 0) -> List[Any]:
+        '''Unpack all fields from a buffer, in layout order.'''
+        return self.scale(self._struct.unpack_from(buffer, offset))
+
+    def pack(self, values: Sequence[Any]) -> bytes:
+        '''Pack scaled values, in layout order, into their wire form.'''
+        return self._struct.pack(*self.unscale(values))
+
+
+DIVE_HEADER_DECODER = StructDecoder(DIVE_HEADER_LAYOUT)
+DIVE_SAMPLE_DECODER = StructDecoder(DIVE_SAMPLE_LAYOUT)
+
+
+def decode_dive_header(buffer: Buffer, offset: int = 0) -> Dive:
+    '''Decode a dive header (segmentHeader) from a command 121 payload.'''
+    (
+        active_user,
+        dive_sample_count,
+        monotonic_time,
+        utc_starting_time,
+        surface_pressure,
+        last_surface_time,
+        desaturation_time,
+        depth_max,
+        decostop_depth_1,
+        decostop_depth_2,
+        decostop_step_1,
+        decostop_step_2,
+        decostop_step_3,
+        deep_stop_algorithm,
+        safety_stop_depth,
+        safety_stop_time,
+        dive_mode,
+        water,
+        alarms_general,
+        alarm_time,
+        alarm_depth,
+        backlight_level,
+        backlight_mode,
+        software_version,
+        alert_flag,
+        free_user_settings,
+        timezone_id,
+        avg_depth,
+        dum_6,
+        dum_7,
+        dum_8,
+    ) = DIVE_HEADER_DECODER.unpack(buffer, offset)
+    return Dive(
+        active_user=active_user,
+        dive_sample_count=dive_sample_count,
+        monotonic_time=monotonic_time,
+        utc_starting_time=utc_starting_time,
+        surface_pressure=surface_pressure,
+        last_surface_time=last_surface_time,
+        desaturation_time=desaturation_time,
+        depth_max=depth_max,
+        decompression_settings=DiveDecompressionSettings(
+            decostop_depth_1=decostop_depth_1,
+            decostop_depth_2=decostop_depth_2,
+            decostop_step_1=decostop_step_1,
+            decostop_step_2=decostop_step_2,
+            decostop_step_3=decostop_step_3,
+        ),
+        deep_stop_algorithm=deep_stop_algorithm,
+        safety_stop_depth=safety_stop_depth,
+        safety_stop_time=safety_stop_time,
+        dive_mode=DiveMode(dive_mode),
+        water=WaterType(water),
+        alarms_general=alarms_general,
+        alarm_time=alarm_time,
+        alarm_depth=alarm_depth,
+        backlight_level=backlight_level,
+        backlight_mode=backlight_mode,
+        software_version=SoftwareVersion(software_version),
+        alert_flag=alert_flag,
+        free_user_settings=free_user_settings,
+        timezone_id=timezone_id,
+        avg_depth=avg_depth,
+        dum_6=dum_6,
+        dum_7=dum_7,
+        dum_8=dum_8,
+        samples=[],
+    )
+
+
+def dive_header_to_values(dive: Dive) -> List[Any]:
+    '''Flatten a dive header into scaled values in DIVE_HEADER_LAYOUT order.'''
+    return [
+        dive.active_user,
+        dive.dive_sample_count,
+        dive.monotonic_time,
+        dive.utc_starting_time,
+        dive.surface_pressure,
+        dive.last_surface_time,
+        dive.desaturation_time,
+        dive.depth_max,
+        dive.decompression_settings.decostop_depth_1,
+        dive.decompression_settings.decostop_depth_2,
+        dive.decompression_settings.decostop_step_1,
+        dive.decompression_settings.decostop_step_2,
+        dive.decompression_settings.decostop_step_3,
+        dive.deep_stop_algorithm,
+        dive.safety_stop_depth,
+        dive.safety_stop_time,
+        dive.dive_mode.value,
+        dive.water.value,
+        dive.alarms_general,
+        dive.alarm_time,
+        dive.alarm_depth,
+        dive.backlight_level,
+        dive.backlight_mode,
+        dive.software_version.as_numeric,
+        dive.alert_flag,
+        dive.free_user_settings,
+        dive.timezone_id,
+        dive.avg_depth,
+        dive.dum_6,
+        dive.dum_7,
+        dive.dum_8,
+    ]
+
+
+def decode_dive_sample(buffer: Buffer, offset: int = 0) -> DiveSample:
+    '''Decode a dive sample from a command 122 payload.'''
+    return dive_sample_from_values(DIVE_SAMPLE_DECODER.unpack(buffer, offset))
+
+
+# Nearly every sample of a dive repeats the same few mixes and decompression settings,
+# samples share the instances built for the most recent distinct values
+INTERN_CACHE_SIZE = 64
+
+
+@lru_cache(maxsize=INTERN_CACHE_SIZE)
+def _gas_mix(o2_percentage: int, he_percentage: int) -> GasMix:
+    return GasMix(o2_percentage, he_percentage)
+
+
+@lru_cache(maxsize=INTERN_CACHE_SIZE)
+def _algorithm_settings(gradient_factor_high: int,
+                        gradient_factor_low: int,
+                        r0: int) -> DecompressionAlgorithmSettings:
+    return DecompressionAlgorithmSettings(
+        buhlmann=DecompressionAlgorithmBuhlmannSettings(
+            gradient_factor_high=gradient_factor_high,
+            gradient_factor_low=gradient_factor_low,
+        ),
+        vpm=DecompressionAlgorithmVpmSettings(
+            r0=r0,
+        ),
+    )
+
+
+def dive_sample_from_values(values: Sequence[Any]) -> DiveSample:
+    '''Build a dive sample from scaled values in DIVE_SAMPLE_LAYOUT order.'''
+    (
+        battery_voltage,
+        runtime_seconds,
+        depth,
+        temperature,
+        active_mix_o2_percentage,
+        active_mix_he_percentage,
+        suggested_mix_o2_percentage,
+        suggested_mix_he_percentage,
+        active_algorithm,
+        gradient_factor_high,
+        gradient_factor_low,
+        vpm_r0,
+        mode_oc_scr_ccr_gauge,
+        max_ppo2_or_setpoint,
+        first_stop_depth,
+        first_stop_time,
+        ndl_or_tts,
+        otu,
+        cns,
+        tissue_group1_percent,
+        tissue_group2_percent,
+        tissue_group3_percent,
+        tissue_group4_percent,
+        tissue_group5_percent,
+        tissue_group6_percent,
+        tissue_group7_percent,
+        tissue_group8_percent,
+        tissue_group9_percent,
+        tissue_group10_percent,
+        tissue_group11_percent,
+        tissue_group12_percent,
+        tissue_group13_percent,
+        tissue_group14_percent,
+        tissue_group15_percent,
+        tissue_group16_percent,
+        enabled_mix_sensors,
+        set_point_mode,
+        tank_pressure,
+        compass_log,
+        reserved_2,
+    ) = values
+    return DiveSample(
+        battery_voltage=battery_voltage,
+        runtime_seconds=runtime_seconds,
+        depth=depth,
+        temperature=temperature,
+        active_mix=_gas_mix(active_mix_o2_percentage, active_mix_he_percentage),
+        suggested_mix=_gas_mix(suggested_mix_o2_percentage, suggested_mix_he_percentage),
+        active_algorithm=DecompressionAlgorithm(active_algorithm),
+        algorithm_settings=_algorithm_settings(gradient_factor_high, gradient_factor_low, vpm_r0),
+        mode_oc_scr_ccr_gauge=mode_oc_scr_ccr_gauge,
+        max_ppo2_or_setpoint=max_ppo2_or_setpoint,
+        first_stop_depth=first_stop_depth,
+        first_stop_time=first_stop_time,
+        ndl_or_tts=ndl_or_tts,
+        otu=otu,
+        cns=cns,
+        tissue_group1_percent=tissue_group1_percent,
+        tissue_group2_percent=tissue_group2_percent,
+        tissue_group3_percent=tissue_group3_percent,
+        tissue_group4_percent=tissue_group4_percent,
+        tissue_group5_percent=tissue_group5_percent,
+        tissue_group6_percent=tissue_group6_percent,
+        tissue_group7_percent=tissue_group7_percent,
+        tissue_group8_percent=tissue_group8_percent,
+        tissue_group9_percent=tissue_group9_percent,
+        tissue_group10_percent=tissue_group10_percent,
+        tissue_group11_percent=tissue_group11_percent,
+        tissue_group12_percent=tissue_group12_percent,
+        tissue_group13_percent=tissue_group13_percent,
+        tissue_group14_percent=tissue_group14_percent,
+        tissue_group15_percent=tissue_group15_percent,
+        tissue_group16_percent=tissue_group16_percent,
+        enabled_mix_sensors=enabled_mix_sensors,
+        set_point_mode=set_point_mode,
+        tank_pressure=tank_pressure,
+        compass_log=compass_log,
+        reserved_2=reserved_2,
+    )
+
+
+def dive_sample_to_values(sample: DiveSample) -> List[Any]:
+    '''Flatten a dive sample into scaled values in DIVE_SAMPLE_LAYOUT order.'''
+    return [
+        sample.battery_voltage,
+        sample.runtime_seconds,
+        sample.depth,
+        sample.temperature,
+        sample.active_mix.o2_percentage,
+        sample.active_mix.he_percentage,
+        sample.suggested_mix.o2_percentage,
+        sample.suggested_mix.he_percentage,
+        sample.active_algorithm.value,
+        sample.algorithm_settings.buhlmann.gradient_factor_high,
+        sample.algorithm_settings.buhlmann.gradient_factor_low,
+        sample.algorithm_settings.vpm.r0,
+        sample.mode_oc_scr_ccr_gauge,
+        sample.max_ppo2_or_setpoint,
+        sample.first_stop_depth,
+        sample.first_stop_time,
+        sample.ndl_or_tts,
+        sample.otu,
+        sample.cns,
+        sample.tissue_group1_percent,
+        sample.tissue_group2_percent,
+        sample.tissue_group3_percent,
+        sample.tissue_group4_percent,
+        sample.tissue_group5_percent,
+        sample.tissue_group6_percent,
+        sample.tissue_group7_percent,
+        sample.tissue_group8_percent,
+        sample.tissue_group9_percent,
+        sample.tissue_group10_percent,
+        sample.tissue_group11_percent,
+        sample.tissue_group12_percent,
+        sample.tissue_group13_percent,
+        sample.tissue_group14_percent,
+        sample.tissue_group15_percent,
+        sample.tissue_group16_percent,
+        sample.enabled_mix_sensors,
+        sample.set_point_mode,
+        sample.tank_pressure,
+        sample.compass_log,
+        sample.reserved_2,
+    ]
+
+
+def reference_decode_dive_header(payload: BytesIO) -> Dive:
+    '''Decode a dive header field by field, kept as a reference for decode_dive_header.'''
+    return Dive(
+        active_user=ByteConverter.to_uint8(payload.read(1)),
+        dive_sample_count=ByteConverter.to_uint16(payload.read(2)),
+        monotonic_time=ByteConverter.to_uint32(payload.read(4)),
+        utc_starting_time=ByteConverter.to_uint32(payload.read(4)),
+        surface_pressure=ByteConverter.to_uint16(payload.read(2)),
+        last_surface_time=ByteConverter.to_int32(payload.read(4)),
+        desaturation_time=ByteConverter.to_int32(payload.read(4)),
+        depth_max=ByteConverter.to_uint16(payload.read(2)) / 100.0,
+        decompression_settings=DiveDecompressionSettings(
+            decostop_depth_1=ByteConverter.to_uint16(payload.read(2)) / 100.0,
+            decostop_depth_2=ByteConverter.to_uint16(payload.read(2)) / 100.0,
+            decostop_step_1=ByteConverter.to_uint8(payload.read(1)),
+            decostop_step_2=ByteConverter.to_uint8(payload.read(1)),
+            decostop_step_3=ByteConverter.to_uint8(payload.read(1)),
+        ),
+        deep_stop_algorithm=ByteConverter.to_uint8(payload.read(1)),
+        safety_stop_depth=ByteConverter.to_uint8(payload.read(1)) / 100.0,
+        safety_stop_time=ByteConverter.to_uint8(payload.read(1)),
+        dive_mode=DiveMode(ByteConverter.to_uint8(payload.read(1))),
+        water=WaterType(ByteConverter.to_uint8(payload.read(1))),
+        alarms_general=ByteConverter.to_uint8(payload.read(1)),
+        alarm_time=ByteConverter.to_uint16(payload.read(2)),
+        alarm_depth=ByteConverter.to_uint16(payload.read(2)) / 100.0,
+        backlight_level=ByteConverter.to_uint8(payload.read(1)),
+        backlight_mode=ByteConverter.to_uint8(payload.read(1)),
+        software_version=SoftwareVersion(ByteConverter.to_uint32(payload.read(4))),
+        alert_flag=ByteConverter.to_uint8(payload.read(1)),
+        free_user_settings=ByteConverter.to_uint8(payload.read(1)),
+        timezone_id=ByteConverter.to_uint8(payload.read(1)),
+        avg_depth=ByteConverter.to_uint16(payload.read(2)) / 100.0,
+        dum_6=ByteConverter.to_uint8(payload.read(1)),
+        dum_7=ByteConverter.to_uint8(payload.read(1)),
+        dum_8=ByteConverter.to_uint8(payload.read(1)),
+        samples=[],
+    )
+
+
+def reference_decode_dive_sample(payload: BytesIO) -> DiveSample:
+    '''Decode a dive sample field by field, kept as a reference for decode_dive_sample.'''
+    return DiveSample(
+        battery_voltage=(ByteConverter.to_uint16(payload.read(2)) / 100.0),
+        runtime_seconds=ByteConverter.to_uint32(payload.read(4)),
+        depth=ByteConverter.to_uint16(payload.read(2)) / 10.0,
+        temperature=ByteConverter.to_uint16(payload.read(2)) / 10.0,
+        active_mix=GasMix(
+            ByteConverter.to_uint8(payload.read(1)),
+            ByteConverter.to_uint8(payload.read(1)),
+        ),
+        suggested_mix=GasMix(
+            ByteConverter.to_uint8(payload.read(1)),
+            ByteConverter.to_uint8(payload.read(1)),
+        ),
+        active_algorithm=DecompressionAlgorithm(ByteConverter.to_uint8(payload.read(1))),
+        algorithm_settings=DecompressionAlgorithmSettings(
+            buhlmann=DecompressionAlgorithmBuhlmannSettings(
+                gradient_factor_high=ByteConverter.to_uint8(payload.read(1)),
+                gradient_factor_low=ByteConverter.to_uint8(payload.read(1)),
+            ),
+            vpm=DecompressionAlgorithmVpmSettings(
+                r0=ByteConverter.to_uint8(payload.read(1)),
+            ),
+        ),
+        mode_oc_scr_ccr_gauge=ByteConverter.to_uint8(payload.read(1)),
+        max_ppo2_or_setpoint=(ByteConverter.to_uint16(payload.read(2)) / 1000.0),
+        first_stop_depth=ByteConverter.to_uint16(payload.read(2)) / 10.0,
+        first_stop_time=ByteConverter.to_uint16(payload.read(2)),
+        ndl_or_tts=ByteConverter.to_uint16(payload.read(2)),
+        otu=ByteConverter.to_uint16(payload.read(2)),
+        cns=ByteConverter.to_uint16(payload.read(2)),
+        tissue_group1_percent=ByteConverter.to_uint8(payload.read(1)),
+        tissue_group2_percent=ByteConverter.to_uint8(payload.read(1)),
+        tissue_group3_percent=ByteConverter.to_uint8(payload.read(1)),
+        tissue_group4_percent=ByteConverter.to_uint8(payload.read(1)),
+        tissue_group5_percent=ByteConverter.to_uint8(payload.read(1)),
+        tissue_group6_percent=ByteConverter.to_uint8(payload.read(1)),
+        tissue_group7_percent=ByteConverter.to_uint8(payload.read(1)),
+        tissue_group8_percent=ByteConverter.to_uint8(payload.read(1)),
+        tissue_group9_percent=ByteConverter.to_uint8(payload.read(1)),
+        tissue_group10_percent=ByteConverter.to_uint8(payload.read(1)),
+        tissue_group11_percent=ByteConverter.to_uint8(payload.read(1)),
+        tissue_group12_percent=ByteConverter.to_uint8(payload.read(1)),
+        tissue_group13_percent=ByteConverter.to_uint8(payload.read(1)),
+        tissue_group14_percent=ByteConverter.to_uint8(payload.read(1)),
+        tissue_group15_percent=ByteConverter.to_uint8(payload.read(1)),
+        tissue_group16_percent=ByteConverter.to_uint8(payload.read(1)),
+        enabled_mix_sensors=ByteConverter.to_uint8(payload.read(1)),
+        set_point_mode=ByteConverter.to_uint8(payload.read(1)),
+        tank_pressure=ByteConverter.to_uint8(payload.read(1)),
+        compass_log=ByteConverter.to_int16(payload.read(2)),
+        reserved_2=ByteConverter.to_int16(payload.read(2)),
+    )
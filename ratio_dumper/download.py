@@ -0,0 +1,214 @@
+'''
+ratio_dumper - Ratio iX5M Log Dumper
+
+MIT License
+
+Copyright (c) 2021 Damian Zaremba
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+from __future__ import annotations
+
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Deque, Optional, Tuple
+
+from .driver import SerialDriver
+from .manifest import SyncManifest
+from .models import Dive
+from .utilities import write_xml
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class DownloadProgress:
+    '''Thread safe progress output, aggregated across every device being downloaded.'''
+    _echo: Callable[[str], None]
+    _lock: threading.Lock
+    _show_totals: bool
+    planned: int
+    completed: int
+
+    def __init__(self, echo: Callable[[str], None], show_totals: bool = False) -> None:
+        self._echo = echo
+        self._lock = threading.Lock()
+        self._show_totals = show_totals
+        self.planned = 0
+        self.completed = 0
+
+    def plan(self, count: int) -> None:
+        with self._lock:
+            self.planned += count
+
+    def report(self, device: str, message: str, completed: bool = False) -> None:
+        with self._lock:
+            if completed:
+                self.completed += 1
+
+            prefix = f'[{device}] ' if device else ''
+            totals = f' ({self.completed}/{self.planned})' if self._show_totals else ''
+            self._echo(f'{prefix}{message}{totals}')
+
+
+def _write_dive(dive: Dive, target_file: Path) -> None:
+    '''Write a dive as XML, only replacing the target once it is complete.'''
+    temporary_file = target_file.with_name(f'.{target_file.name}.tmp')
+    try:
+        with open(temporary_file.as_posix(), 'w') as fh:
+            write_xml(dive, fh)
+        temporary_file.replace(target_file)
+    finally:
+        temporary_file.unlink(missing_ok=True)
+
+
+class _WritePipeline:
+    '''Converts and writes fetched dives on worker threads, reporting them in dive order.
+
+    At most twice as many dives as writers are held before submitting blocks on the
+    oldest write. The manifest is only ever updated from the submitting thread.
+    '''
+    _manifest: SyncManifest
+    _progress: DownloadProgress
+    _device: str
+    _executor: ThreadPoolExecutor
+    _pending: Deque[Tuple[int, Optional[Dive], Optional[Future[None]]]]
+    _max_pending: int
+    failed: bool
+
+    def __init__(self,
+                 manifest: SyncManifest,
+                 progress: DownloadProgress,
+                 device: str,
+                 writers: int) -> None:
+        self._manifest = manifest
+        self._progress = progress
+        self._device = device
+        self._executor = ThreadPoolExecutor(max_workers=writers,
+                                            thread_name_prefix='ratio-dumper-writer')
+        self._pending = deque()
+        self._max_pending = writers * 2
+        self.failed = False
+
+    def skip(self, dive_id: int) -> None:
+        self._pending.append((dive_id, None, None))
+        self._collect()
+
+    def submit(self, dive_id: int, dive: Dive) -> None:
+        target_file = self._manifest.start(dive_id, dive)
+        self._pending.append((dive_id, dive, self._executor.submit(_write_dive, dive, target_file)))
+        self._collect()
+
+    def drain(self) -> None:
+        '''Wait for every submitted write, recording those that completed.'''
+        while self._pending:
+            self._finish_oldest()
+
+    def close(self) -> None:
+        '''Cancel writes that have not started and wait for the rest.'''
+        for _, _, write in self._pending:
+            if write is not None:
+                write.cancel()
+        self._executor.shutdown(wait=True)
+
+    def _collect(self) -> None:
+        '''Report finished dives in order, waiting on the oldest write when full.'''
+        while self._pending:
+            write = self._pending[0][2]
+            if len(self._pending) < self._max_pending and write is not None and not write.done():
+                break
+            self._finish_oldest()
+
+    def _finish_oldest(self) -> None:
+        dive_id, dive, write = self._pending.popleft()
+        if dive is None or write is None:
+            self._progress.report(self._device, f' - {dive_id} [skipping]')
+            return
+
+        try:
+            write.result()
+        except OSError as e:
+            logger.error(f'Failed to write dive {dive_id}: {e}')
+            self._progress.report(self._device, f' - {dive_id} [failed]')
+            self._progress.report(self._device, "Failed to write dive")
+            self.failed = True
+            return
+
+        self._manifest.complete(dive)
+        self._progress.report(self._device, f' - {dive_id}', completed=True)
+
+
+def download_dives(driver: SerialDriver,
+                   target_directory: Path,
+                   progress: DownloadProgress,
+                   device: str = '',
+                   writers: int = 2) -> bool:
+    '''Download every new or changed dive from a device into a directory.
+
+    Dives are fetched on the calling thread while `writers` threads convert and write
+    the previous ones, keeping the serial port busy for the whole sync.
+    '''
+    dive_ids = driver.get_dive_ids()
+    if dive_ids is None:
+        progress.report(device, "Failed to read dive logs")
+        return False
+
+    if len(dive_ids) == 0:
+        progress.report(device, 'No dive logs to download')
+        return True
+
+    manifest = SyncManifest.load(target_directory)
+    pending_dive_ids = manifest.plan(driver, dive_ids)
+    if pending_dive_ids is None:
+        progress.report(device, "Failed to read dive headers")
+        return False
+
+    progress.plan(len(pending_dive_ids))
+    progress.report(device, 'Exporting....')
+
+    pipeline = _WritePipeline(manifest, progress, device, writers)
+    try:
+        for dive_id in sorted(dive_ids):
+            if pipeline.failed:
+                break
+
+            if dive_id not in pending_dive_ids:
+                pipeline.skip(dive_id)
+                continue
+
+            dive = driver.get_dive(dive_id)
+            if dive is None:
+                pipeline.drain()
+                progress.report(device, f' - {dive_id} [failed]')
+                progress.report(device, "Failed to read dive")
+                return False
+
+            pipeline.submit(dive_id, dive)
+
+        # Everything handed over is still written, so completed dives are recorded
+        pipeline.drain()
+        if pipeline.failed:
+            return False
+    finally:
+        pipeline.close()
+
+    manifest.finish(dive_ids)
+    return True
@@ -26,33 +26,84 @@ SOFTWARE.
 from __future__ import annotations
 
 import logging
-from io import BytesIO
+import struct
+import time
+from collections import deque
+from dataclasses import replace
 from types import TracebackType
-from typing import Tuple, Set, List, Optional, Type
-
-from serial import Serial  # type: ignore
-
-from .models import (Dive,
-                     DiveSample,
-                     DiveMode,
-                     WaterType,
-                     SoftwareVersion,
-                     DecompressionAlgorithm,
-                     DecompressionAlgorithmSettings,
-                     GasMix,
-                     DiveDecompressionSettings,
-                     DecompressionAlgorithmBuhlmannSettings,
-                     DecompressionAlgorithmVpmSettings)
-from .utilities import ByteConverter, CrcHelper
+from pathlib import Path
+from typing import (TYPE_CHECKING, Any, Deque, Dict, Generator, Iterator, Tuple, Set, List,
+                    Optional, Sequence, Type, Union)
+
+from .cache import FrameCache
+from .capture import CaptureSerial, CaptureWriter
+from .columnar import ColumnarSamples
+from .decoders import DIVE_SAMPLE_DECODER, decode_dive_header, decode_dive_sample
+from .framing import FrameReader
+from .metrics import EventKind, MetricsSink, TransferEvent
+from .models import Dive, DiveSample
+from .utilities import CRC_ENGINE
+
+if TYPE_CHECKING:
+    from serial import Serial  # type: ignore
 
 logger: logging.Logger = logging.getLogger(__name__)
 
+# Upper bound on the delay between retries of a failed sample, in seconds
+MAX_RETRY_DELAY = 4.0
+
+# Returned in place of a payload for a failed request
+_EMPTY_PAYLOAD = memoryview(b'')
+_uint16_pair = struct.Struct('<HH')
+_uint16 = struct.Struct('<H')
+
 
 class SerialDriver:
     _serial: Serial
-
-    def __init__(self, serial_path: Optional[str]) -> None:
-        self._serial = Serial(port=serial_path, baudrate=115200, timeout=1)
+    _pipeline_window: int
+    _columnar: bool
+    _frame_cache: Optional[FrameCache]
+    _frame_log: Optional[List[bytes]]
+    _last_frame: Optional[bytes]
+    _header_frame: Optional[Tuple[Tuple[int, int, int], bytes]]
+    _sample_retries: int
+    _retry_delay: float
+    _checkpoints: Dict[Tuple[int, int, int], List[bytes]]
+    _frame_reader: FrameReader
+    _metrics_sinks: List[MetricsSink]
+    _sent_at: Deque[float]
+
+    def __init__(self,
+                 serial_path: Optional[str],
+                 pipeline_window: int = 1,
+                 columnar: bool = False,
+                 frame_cache: Optional[FrameCache] = None,
+                 sample_retries: int = 0,
+                 retry_delay: float = 0.25,
+                 metrics_sinks: Sequence[MetricsSink] = (),
+                 transport: Optional[Any] = None) -> None:
+        if pipeline_window < 1:
+            raise ValueError(f"pipeline_window must be at least 1 ({pipeline_window})")
+        if sample_retries < 0:
+            raise ValueError(f"sample_retries must not be negative ({sample_retries})")
+        # Anything with the pyserial read/write interface, e.g. a ReplaySerialIO
+        if transport is None:
+            # pyserial is only imported once a port is opened
+            from serial import Serial
+            transport = Serial(port=serial_path, baudrate=115200, timeout=1)
+        self._serial = transport
+        self._pipeline_window = pipeline_window
+        self._columnar = columnar
+        self._frame_cache = frame_cache
+        self._frame_log = None
+        self._last_frame = None
+        self._header_frame = None
+        self._sample_retries = sample_retries
+        self._retry_delay = retry_delay
+        self._checkpoints = {}
+        self._frame_reader = FrameReader()
+        self._metrics_sinks = list(metrics_sinks)
+        self._sent_at = deque()
 
     def __enter__(self) -> SerialDriver:
         return self
@@ -61,196 +112,432 @@ class SerialDriver:
                  exc_type: Optional[Type[BaseException]],
                  exc_value: Optional[BaseException],
                  traceback: Optional[TracebackType]) -> None:
+        reader = self._frame_reader
+        if reader.resyncs or reader.crc_errors:
+            logger.warning(f'{getattr(self._serial, "port", None)}: resynchronised '
+                           f'{reader.resyncs} times skipping {reader.skipped_bytes} bytes, '
+                           f'{reader.crc_errors} CRC errors, check the cable')
+        self.close()
+
+    def close(self) -> None:
+        '''Close the serial port.'''
+        # Sinks may outlive the driver, or be shared with others, whoever created them closes them
         self._serial.close()
 
+    def cancel_read(self) -> None:
+        '''Unblock a read pending on another thread, where the transport supports it.'''
+        cancel_read = getattr(self._serial, 'cancel_read', None)
+        if cancel_read is not None:
+            cancel_read()
+
+    def start_capture(self, path: Union[str, Path]) -> None:
+        '''Record every byte sent to and received from the device into a capture file.'''
+        self._serial = CaptureSerial(self._serial, CaptureWriter(path))
+
+    def add_metrics_sink(self, sink: MetricsSink) -> None:
+        '''Send transfer events to a sink, such as TransferMetrics or a callback.'''
+        self._metrics_sinks.append(sink)
+
+    def _record(self,
+                kind: EventKind,
+                command: int,
+                size: int = 0,
+                latency: Optional[float] = None,
+                timestamp: Optional[float] = None) -> None:
+        event = TransferEvent(kind, command, size, latency,
+                              time.perf_counter() if timestamp is None else timestamp)
+        for sink in self._metrics_sinks:
+            sink.record(event)
+
+    def _write_request(self, request: bytes) -> None:
+        '''Send a request frame to the device.'''
+        self._serial.write(request)
+        if self._metrics_sinks:
+            now = time.perf_counter()
+            self._sent_at.append(now)
+            self._record(EventKind.REQUEST, request[2], len(request), timestamp=now)
+
+    def _record_reply(self, command: int, frame: Optional[bytes], crc_errors: int) -> None:
+        '''Record the outcome of reading a reply, timed from its request.'''
+        now = time.perf_counter()
+        latency = now - self._sent_at.popleft() if self._sent_at else None
+        if frame is None:
+            kind = (EventKind.CRC_ERROR if self._frame_reader.crc_errors > crc_errors
+                    else EventKind.TIMEOUT)
+        else:
+            kind = EventKind.NAK if frame[-3] == 21 else EventKind.REPLY
+        self._record(kind, command, len(frame or b''), latency, now)
+
+    @property
+    def frame_cache(self) -> Optional[FrameCache]:
+        '''The frame cache transfers are decoded from and stored in, if any.'''
+        return self._frame_cache
+
+    @property
+    def frame_reader(self) -> FrameReader:
+        '''The frame reader, holding the resync and CRC error counts of this connection.'''
+        return self._frame_reader
+
     def _encode_payload(self, command: int, options: List[int]) -> bytes:
         '''Encode a set of commands with a CRC.'''
         # Packet layout:
         #  85 = byte, START marker
+        #  <variable> = byte, length of the command and options
         #  <variable> = byte, command
         #  <..> = byte, variable length options
         #  <variable> = 2 bytes, CRC of the payload
-        payload = f'{85:02x}{len(options) + 1:02x}{command:02x}'
-        for option in options:
-            payload += f'{option:02x}'
-        payload += CrcHelper.encode(CrcHelper.calculate(bytes.fromhex(payload)))
-
-        logger.debug(f'Encoded payload: {payload}')
-        return bytes.fromhex(payload)
-
-    def _decode_payload(self, command: int) -> Tuple[BytesIO, Optional[int]]:
+        packet = bytearray(len(options) + 5)
+        packet[0] = 85
+        packet[1] = len(options) + 1
+        packet[2] = command
+        packet[3:-2] = bytes(options)
+        with memoryview(packet) as view:
+            crc = CRC_ENGINE.calculate(view[:-2])
+        packet[-2] = crc >> 8
+        packet[-1] = crc & 255
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f'Encoded payload: {packet.hex()}')
+        return bytes(packet)
+
+    def _decode_payload(self, command: int) -> Tuple[memoryview, Optional[int]]:
         '''Decode a response payload.'''
         # Response layout:
         #  85 = byte, START marker
-        #  <variable> = byte, command
         #  <variable> = byte, length of payload
+        #  <variable> = byte, command
         #  <..> = byte, variable length payload
         #  <variable> = byte, ACK or NAK marker
         #  <variable> = 2 bytes, CRC of the payload
-        packet_header = self._serial.read(1)
-        if not packet_header:
-            return BytesIO(), -1
-
-        assert packet_header[0] == 85
-
-        packet_length = self._serial.read(1)
-        read_size = int(packet_length.hex(), 16)
-        assert read_size > 2 and read_size < 255
-
-        packet_body = self._serial.read(read_size + 2)
-        assert len(packet_body) == read_size + 2
-        logger.debug(f'Decoded payload: {(packet_header + packet_length + packet_body).hex()}')
-
-        payload, crc = packet_body[:read_size], packet_body[read_size:]
-        expected_crc = CrcHelper.calculate(packet_header + packet_length + payload)
-
-        assert expected_crc == CrcHelper.decode(crc[0], crc[1])
-        assert payload[0] == command
+        crc_errors = self._frame_reader.crc_errors
+        frame = self._frame_reader.read_frame(self._serial)
+        if self._metrics_sinks:
+            self._record_reply(command, frame, crc_errors)
+        if frame is None:
+            return _EMPTY_PAYLOAD, -1
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f'Decoded payload: {frame.hex()}')
+
+        self._last_frame = frame
+        if self._frame_log is not None and frame[-3] == 6:
+            self._frame_log.append(frame)
+
+        return self._parse_payload(command, frame)
+
+    @staticmethod
+    def _parse_payload(command: int, frame: bytes) -> Tuple[memoryview, Optional[int]]:
+        '''Parse a CRC verified response frame, returning a view of its payload.'''
+        # Views share the frame's memory, the payload is never copied
+        payload = memoryview(frame)[2:-2]
+        if payload[0] != command:
+            logger.critical(f'Expected a response to {command}, got {bytes(payload)!r}')
+            return _EMPTY_PAYLOAD, -1
 
         # ACK indicates a success
         # Return all data without the command and ack byte
         if payload[-1] == 6:
-            return BytesIO(payload[1:-1]), None
+            return payload[1:-1], None
 
         # NAK indicates an error
         # Return the first byte as the error code
         elif payload[-1] == 21:
             error_code = (payload[1] & 255)
             logger.warning(f'Hit NAK marker: {error_code}')
-            return BytesIO(), error_code
+            return _EMPTY_PAYLOAD, error_code
 
         # Unknown response
         else:
-            logger.critical(f'Unknown response: {payload}')
-            return BytesIO(), -1
+            logger.critical(f'Unknown response: {bytes(payload)!r}')
+            return _EMPTY_PAYLOAD, -1
 
     def get_dive_ids(self) -> Optional[Set[int]]:
         '''Query a device for all dives.'''
-        self._serial.write(self._encode_payload(120, [141]))
+        self._write_request(self._encode_payload(120, [141]))
         payload, error_code = self._decode_payload(120)
         if error_code is not None:
             logger.critical(f'get_dive_ids got {error_code}')
             return None
 
-        first_dive = ByteConverter.to_uint16(payload.read(2))
-        last_dive = ByteConverter.to_uint16(payload.read(2))
+        first_dive, last_dive = _uint16_pair.unpack_from(payload)
         return set(range(first_dive, last_dive + 1))
 
-    def _get_dive_sample(self, sample_id: int) -> Optional[DiveSample]:
-        """Query a device for a specific dive sample."""
-        self._serial.write(self._encode_payload(122, [sample_id & 255, (sample_id >> 8) & 255]))
+    def _encode_sample_request(self, sample_id: int) -> bytes:
+        '''Encode a request for a specific dive sample.'''
+        return self._encode_payload(122, [sample_id & 255, (sample_id >> 8) & 255])
+
+    def _get_dive_sample_payload(self, sample_id: int) -> Optional[memoryview]:
+        '''Query a device for a specific dive sample payload.'''
+        self._write_request(self._encode_sample_request(sample_id))
         payload, error_code = self._decode_payload(122)
         if error_code is not None:
-            logger.critical(f'get_dive_sample got {error_code}')
+            logger.critical(f'get_dive_sample {sample_id} got {error_code}')
             return None
+        return payload
 
-        sample = DiveSample(
-            battery_voltage=(ByteConverter.to_uint16(payload.read(2)) / 100.0),
-            runtime_seconds=ByteConverter.to_uint32(payload.read(4)),
-            depth=ByteConverter.to_uint16(payload.read(2)) / 10.0,
-            temperature=ByteConverter.to_uint16(payload.read(2)) / 10.0,
-            active_mix=GasMix(
-                ByteConverter.to_uint8(payload.read(1)),
-                ByteConverter.to_uint8(payload.read(1)),
-            ),
-            suggested_mix=GasMix(
-                ByteConverter.to_uint8(payload.read(1)),
-                ByteConverter.to_uint8(payload.read(1)),
-            ),
-            active_algorithm=DecompressionAlgorithm(ByteConverter.to_uint8(payload.read(1))),
-            algorithm_settings=DecompressionAlgorithmSettings(
-                buhlmann=DecompressionAlgorithmBuhlmannSettings(
-                    gradient_factor_high=ByteConverter.to_uint8(payload.read(1)),
-                    gradient_factor_low=ByteConverter.to_uint8(payload.read(1)),
-                ),
-                vpm=DecompressionAlgorithmVpmSettings(
-                    r0=ByteConverter.to_uint8(payload.read(1)),
-                ),
-            ),
-            mode_oc_scr_ccr_gauge=ByteConverter.to_uint8(payload.read(1)),
-            max_ppo2_or_setpoint=(ByteConverter.to_uint16(payload.read(2)) / 1000.0),
-            first_stop_depth=ByteConverter.to_uint16(payload.read(2)) / 10.0,
-            first_stop_time=ByteConverter.to_uint16(payload.read(2)),
-            ndl_or_tts=ByteConverter.to_uint16(payload.read(2)),
-            otu=ByteConverter.to_uint16(payload.read(2)),
-            cns=ByteConverter.to_uint16(payload.read(2)),
-            tissue_group1_percent=ByteConverter.to_uint8(payload.read(1)),
-            tissue_group2_percent=ByteConverter.to_uint8(payload.read(1)),
-            tissue_group3_percent=ByteConverter.to_uint8(payload.read(1)),
-            tissue_group4_percent=ByteConverter.to_uint8(payload.read(1)),
-            tissue_group5_percent=ByteConverter.to_uint8(payload.read(1)),
-            tissue_group6_percent=ByteConverter.to_uint8(payload.read(1)),
-            tissue_group7_percent=ByteConverter.to_uint8(payload.read(1)),
-            tissue_group8_percent=ByteConverter.to_uint8(payload.read(1)),
-            tissue_group9_percent=ByteConverter.to_uint8(payload.read(1)),
-            tissue_group10_percent=ByteConverter.to_uint8(payload.read(1)),
-            tissue_group11_percent=ByteConverter.to_uint8(payload.read(1)),
-            tissue_group12_percent=ByteConverter.to_uint8(payload.read(1)),
-            tissue_group13_percent=ByteConverter.to_uint8(payload.read(1)),
-            tissue_group14_percent=ByteConverter.to_uint8(payload.read(1)),
-            tissue_group15_percent=ByteConverter.to_uint8(payload.read(1)),
-            tissue_group16_percent=ByteConverter.to_uint8(payload.read(1)),
-            enabled_mix_sensors=ByteConverter.to_uint8(payload.read(1)),
-            set_point_mode=ByteConverter.to_uint8(payload.read(1)),
-            tank_pressure=ByteConverter.to_uint8(payload.read(1)),
-            compass_log=ByteConverter.to_int16(payload.read(2)),
-            reserved_2=ByteConverter.to_int16(payload.read(2)),
-        )
-        logger.debug(f"Decoded dive sample: {sample}")
+    def _get_dive_sample(self, sample_id: int) -> Optional[DiveSample]:
+        """Query a device for a specific dive sample."""
+        payload = self._get_dive_sample_payload(sample_id)
+        if payload is None:
+            return None
+        return self._decode_dive_sample(payload)
+
+    def _iter_sample_payloads(self,
+                              sample_count: int,
+                              first_sample_id: int = 1) -> Iterator[Optional[memoryview]]:
+        '''Query a device for all sample payloads, yielding None and stopping on failure.'''
+        if self._pipeline_window > 1:
+            yield from self._iter_sample_payloads_pipelined(sample_count, first_sample_id)
+            return
+
+        for sample_id in range(first_sample_id, sample_count + 1):
+            payload = self._get_dive_sample_payload(sample_id)
+            yield payload
+            if payload is None:
+                return
+
+    def _iter_sample_payloads_pipelined(self,
+                                        sample_count: int,
+                                        first_sample_id: int = 1) -> Iterator[Optional[memoryview]]:
+        '''Query a device for all sample payloads, keeping several requests in flight.'''
+        in_flight: Deque[int] = deque()
+        next_sample_id, failed = first_sample_id, False
+
+        while in_flight or (not failed and next_sample_id <= sample_count):
+            # Top up the window, unless we are draining replies after a failure
+            while (not failed and
+                   next_sample_id <= sample_count and
+                   len(in_flight) < self._pipeline_window):
+                self._write_request(self._encode_sample_request(next_sample_id))
+                in_flight.append(next_sample_id)
+                next_sample_id += 1
+
+            # Replies arrive in request order, so the next frame belongs to the oldest request
+            sample_id = in_flight.popleft()
+            payload, error_code = self._decode_payload(122)
+            if failed:
+                continue
+
+            if error_code is not None:
+                logger.critical(f'get_dive_sample {sample_id} got {error_code}')
+                failed = True
+                continue
+
+            reply_sample_id = self._decode_sample_id(payload)
+            if reply_sample_id is not None and reply_sample_id != sample_id:
+                logger.critical(f'get_dive_sample {sample_id} got reply for {reply_sample_id}')
+                failed = True
+
+                # Replies before this one were lost, there is no point waiting for them
+                if reply_sample_id in in_flight:
+                    while in_flight.popleft() != reply_sample_id:
+                        pass
+                continue
+
+            yield payload
+
+        # Only signal the failure once every in-flight reply has been drained
+        if failed:
+            yield None
+
+    @staticmethod
+    def _decode_sample_id(payload: memoryview) -> Optional[int]:
+        '''Decode the sample id echoed back in a sample payload.'''
+        # Sample records are 64 bytes, the sample id directly follows the decoded fields
+        offset = DIVE_SAMPLE_DECODER.size
+        if len(payload) < offset + _uint16.size:
+            return None
+        sample_id: int = _uint16.unpack_from(payload, offset)[0]
+        return sample_id
+
+    @staticmethod
+    def _decode_dive_sample(payload: memoryview) -> DiveSample:
+        '''Decode a dive sample from a response payload.'''
+        sample = decode_dive_sample(payload)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Decoded dive sample: {sample}")
         return sample
 
-    def get_dive(self, dive_id: int) -> Optional[Dive]:
-        '''Query a device for a specific dive.'''
-        self._serial.write(self._encode_payload(121, [dive_id & 255, (dive_id >> 8) & 255]))
+    def get_dive_header(self, dive_id: int) -> Optional[Dive]:
+        '''Query a device for the header of a specific dive, without any samples.'''
+        self._write_request(self._encode_payload(121, [dive_id & 255, (dive_id >> 8) & 255]))
         payload, error_code = self._decode_payload(121)
         if error_code is not None:
             logger.critical(f'get_dive got {error_code}')
             return None
 
         # Decode the segmentHeader
-        dive = Dive(
-            active_user=ByteConverter.to_uint8(payload.read(1)),
-            dive_sample_count=ByteConverter.to_uint16(payload.read(2)),
-            monotonic_time=ByteConverter.to_uint32(payload.read(4)),
-            utc_starting_time=ByteConverter.to_uint32(payload.read(4)),
-            surface_pressure=ByteConverter.to_uint16(payload.read(2)),
-            last_surface_time=ByteConverter.to_int32(payload.read(4)),
-            desaturation_time=ByteConverter.to_int32(payload.read(4)),
-            depth_max=ByteConverter.to_uint16(payload.read(2)) / 100.0,
-            decompression_settings=DiveDecompressionSettings(
-                decostop_depth_1=ByteConverter.to_uint16(payload.read(2)) / 100.0,
-                decostop_depth_2=ByteConverter.to_uint16(payload.read(2)) / 100.0,
-                decostop_step_1=ByteConverter.to_uint8(payload.read(1)),
-                decostop_step_2=ByteConverter.to_uint8(payload.read(1)),
-                decostop_step_3=ByteConverter.to_uint8(payload.read(1)),
-            ),
-            deep_stop_algorithm=ByteConverter.to_uint8(payload.read(1)),
-            safety_stop_depth=ByteConverter.to_uint8(payload.read(1)) / 100.0,
-            safety_stop_time=ByteConverter.to_uint8(payload.read(1)),
-            dive_mode=DiveMode(ByteConverter.to_uint8(payload.read(1))),
-            water=WaterType(ByteConverter.to_uint8(payload.read(1))),
-            alarms_general=ByteConverter.to_uint8(payload.read(1)),
-            alarm_time=ByteConverter.to_uint16(payload.read(2)),
-            alarm_depth=ByteConverter.to_uint16(payload.read(2)) / 100.0,
-            backlight_level=ByteConverter.to_uint8(payload.read(1)),
-            backlight_mode=ByteConverter.to_uint8(payload.read(1)),
-            software_version=SoftwareVersion(ByteConverter.to_uint32(payload.read(4))),
-            alert_flag=ByteConverter.to_uint8(payload.read(1)),
-            free_user_settings=ByteConverter.to_uint8(payload.read(1)),
-            timezone_id=ByteConverter.to_uint8(payload.read(1)),
-            avg_depth=ByteConverter.to_uint16(payload.read(2)) / 100.0,
-            dum_6=ByteConverter.to_uint8(payload.read(1)),
-            dum_7=ByteConverter.to_uint8(payload.read(1)),
-            dum_8=ByteConverter.to_uint8(payload.read(1)),
-            samples=[],
-        )
-        logger.debug(f"Decoded dive header: {dive}")
-
-        # Decode the samples
-        for sample_id in range(1, dive.dive_sample_count + 1):
-            sample = self._get_dive_sample(sample_id)
-            if sample is None:
-                return None
-            dive.samples.append(sample)
+        dive = decode_dive_header(payload)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Decoded dive header: {dive}")
+
+        # Keep the frame, it starts the frame log if the samples of this dive are fetched next
+        assert self._last_frame is not None
+        self._header_frame = ((dive_id, dive.monotonic_time, dive.utc_starting_time),
+                              self._last_frame)
+        return dive
 
+    def get_dive(self, dive_id: int) -> Optional[Dive]:
+        '''Query a device for a specific dive, resuming any earlier failed transfer of it.'''
+        dive = self.get_dive_header(dive_id)
+        if dive is None:
+            return None
+
+        if self._columnar:
+            dive = replace(dive, samples=ColumnarSamples())
+
+        try:
+            for sample_payload in self._iter_dive_payloads(dive_id, dive):
+                self._append_sample(dive, sample_payload)
+        except IOError:
+            return None
         return dive
+
+    def iter_dive_samples(self,
+                          dive_id: int,
+                          dive: Optional[Dive] = None,
+                          keep_frames: Optional[bool] = None) -> Generator[DiveSample, None, None]:
+        '''Query a device for the samples of a specific dive, yielding each as it is decoded.
+
+        Samples are not kept, so memory does not grow with the length of the dive;
+        by default frames are only kept when there is a frame cache to store them in,
+        keep_frames also keeps them to checkpoint an unfinished transfer. Pass the
+        header from get_dive_header to avoid requesting it again. Samples are read as
+        they are consumed, so the transfer can be stepped one sample at a time.
+        Raises IOError if the transfer fails.
+        '''
+        if dive is None:
+            dive = self.get_dive_header(dive_id)
+            if dive is None:
+                raise IOError(f'Failed to read dive {dive_id}')
+
+        if keep_frames is None:
+            keep_frames = self._frame_cache is not None
+        for sample_payload in self._iter_dive_payloads(dive_id, dive, keep_frames):
+            yield self._decode_dive_sample(sample_payload)
+
+    def _iter_dive_payloads(self,
+                            dive_id: int,
+                            dive: Dive,
+                            keep_frames: bool = True) -> Generator[memoryview, None, None]:
+        '''Yield the sample payloads of a dive from the cache or a checkpoint, then the device.
+
+        Raises IOError once a sample can not be fetched. With keep_frames every
+        verified frame is kept, so the dive can be cached, or checkpointed if the
+        transfer fails or is abandoned part way through.
+        '''
+        key = (dive_id, dive.monotonic_time, dive.utc_starting_time)
+        frame_log: Optional[List[bytes]] = None
+        if keep_frames and self._header_frame is not None and self._header_frame[0] == key:
+            frame_log = [self._header_frame[1]]
+
+        sample_count = 0
+        complete = False
+        try:
+            # Decode the samples we already have, from the cache or a checkpoint
+            cached_frames = self._load_cached_frames(dive_id, dive)
+            fully_cached = (cached_frames is not None and
+                            len(cached_frames) == dive.dive_sample_count + 1)
+            if cached_frames is not None:
+                if fully_cached:
+                    logger.info(f'Decoding dive {dive_id} from the frame cache')
+                else:
+                    logger.info(f'Resuming dive {dive_id} at sample {len(cached_frames)}')
+                if frame_log is not None:
+                    frame_log[1:] = cached_frames[1:]
+                for frame in cached_frames[1:]:
+                    sample_count += 1
+                    yield self._parse_payload(122, frame)[0]
+
+            self._frame_log = frame_log
+            for sample_payload in self._fetch_sample_payloads(dive.dive_sample_count,
+                                                              sample_count + 1):
+                # Counted before yielding, a consumer may stop at any sample it was given
+                sample_count += 1
+                yield sample_payload
+
+            if self._frame_cache is not None and frame_log is not None and not fully_cached:
+                self._frame_cache.store(*key, frame_log)
+            complete = True
+        finally:
+            self._frame_log = None
+            if not complete:
+                # The transfer failed or was abandoned, requests may still be in flight
+                self.reset_input()
+            if frame_log is not None:
+                self._checkpoint(key, frame_log[:1 + sample_count], complete)
+
+    def _fetch_sample_payloads(self,
+                               sample_count: int,
+                               first_sample_id: int) -> Iterator[memoryview]:
+        '''Fetch the samples a dive is missing, retrying a failed sample with a bounded backoff.'''
+        next_sample_id, attempt = first_sample_id, 0
+        while next_sample_id <= sample_count:
+            for sample_payload in self._iter_sample_payloads(sample_count, next_sample_id):
+                if sample_payload is None:
+                    break
+                yield sample_payload
+                next_sample_id += 1
+                attempt = 0
+            else:
+                continue
+
+            # Drop any replies drained after the failure, the log has to match the samples
+            if self._frame_log is not None:
+                del self._frame_log[next_sample_id:]
+            if attempt >= self._sample_retries:
+                raise IOError(f'Failed to read dive sample {next_sample_id}')
+
+            attempt += 1
+            delay = min(self._retry_delay * 2 ** (attempt - 1), MAX_RETRY_DELAY)
+            logger.warning(f'Retrying dive sample {next_sample_id} in {delay:.2f}s '
+                           f'({attempt}/{self._sample_retries})')
+            if self._metrics_sinks:
+                self._record(EventKind.RETRY, 122)
+            time.sleep(delay)
+            self.reset_input()
+
+    def _append_sample(self, dive: Dive, payload: memoryview) -> None:
+        if isinstance(dive.samples, ColumnarSamples):
+            dive.samples.append_raw(payload)
+        else:
+            dive.samples.append(self._decode_dive_sample(payload))
+
+    def reset_input(self) -> None:
+        '''Drop any reply left over from a failed or interrupted request.'''
+        reset_input_buffer = getattr(self._serial, 'reset_input_buffer', None)
+        if reset_input_buffer is not None:
+            reset_input_buffer()
+        self._frame_reader.clear()
+        self._sent_at.clear()
+
+    def _checkpoint(self,
+                    key: Tuple[int, int, int],
+                    frames: List[bytes],
+                    complete: bool) -> None:
+        '''Keep the frames of an unfinished transfer, or drop the checkpoint once complete.'''
+        if complete:
+            # Storing the complete dive in the frame cache already replaced its partial entry
+            self._checkpoints.pop(key, None)
+            return
+
+        if len(frames) < 2:
+            return
+
+        logger.info(f'Checkpointing dive {key[0]} at sample {len(frames) - 1}')
+        self._checkpoints[key] = frames
+        if self._frame_cache is not None:
+            self._frame_cache.store(*key, frames, partial=True)
+
+    def _load_cached_frames(self, dive_id: int, dive: Dive) -> Optional[List[bytes]]:
+        '''Load the cached frames for a dive, or those of an earlier partial transfer.'''
+        key = (dive_id, dive.monotonic_time, dive.utc_starting_time)
+        frames = self._checkpoints.get(key)
+        if self._frame_cache is not None:
+            frames = (self._frame_cache.load(*key) or
+                      self._frame_cache.load(*key, partial=True) or
+                      frames)
+
+        if frames is None or len(frames) > dive.dive_sample_count + 1:
+            return None
+        return frames
@@ -0,0 +1,376 @@
+'''
+ratio_dumper - Ratio iX5M Log Dumper
+
+MIT License
+
+Copyright (c) 2021 Damian Zaremba
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+from __future__ import annotations
+
+import json
+import logging
+import os
+import random
+import select
+import struct
+import threading
+import time
+import tty
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from types import TracebackType
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple, Type, Union
+
+import click
+
+from .decoders import DIVE_HEADER_DECODER, DIVE_SAMPLE_DECODER
+from .utilities import CRC_ENGINE
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Sample replies hold 3 consecutive 64 byte records, padded with 0xff past the last sample
+SAMPLE_RECORD_SIZE = 64
+SAMPLES_PER_REPLY = 3
+SAMPLE_RECORD_MARKER = bytes.fromhex('33cccc33')
+
+# Paced replies are written a few bytes at a time, as they come off the wire
+PACING_CHUNK_SIZE = 8
+_sample_record_trailer = struct.Struct('<HH4s')
+
+
+@dataclass
+class EmulatedDive:
+    '''The raw header payload and sample records a device serves for one dive.'''
+    header: bytes
+    records: List[bytes]
+
+
+@dataclass
+class EmulatorStats:
+    requests: int = 0
+    naks: int = 0
+    corrupted_bytes: int = 0
+
+
+def load_fixture(path: Union[str, Path]) -> Dict[int, EmulatedDive]:
+    '''Load the dives in a JSON fixture of request and response frames.'''
+    with Path(path).open('r') as fh:
+        responses = {bytes.fromhex(request): bytes.fromhex(response)
+                     for request, response in json.loads(fh.read()).items()}
+
+    headers: Dict[int, bytes] = {}
+    records: Dict[int, bytes] = {}
+    for request, response in responses.items():
+        command, options, payload = request[2], request[3:-2], response[3:-3]
+        if command == 121:
+            headers[options[0] | (options[1] << 8)] = payload
+        elif command == 122:
+            sample_id = options[0] | (options[1] << 8)
+            for index in range(0, len(payload), SAMPLE_RECORD_SIZE):
+                records.setdefault(sample_id + index // SAMPLE_RECORD_SIZE,
+                                   payload[index:index + SAMPLE_RECORD_SIZE])
+
+    # Fixtures hold a single dive, every sample record belongs to it
+    dives = {}
+    for dive_id, header in headers.items():
+        sample_count = DIVE_HEADER_DECODER.unpack_raw(header)[1]
+        dives[dive_id] = EmulatedDive(header, [records[sample_id]
+                                               for sample_id in range(1, sample_count + 1)])
+    return dives
+
+
+def synthetic_dive(dive_id: int,
+                   sample_count: int = 360,
+                   max_depth: float = 30.0,
+                   sample_interval: int = 10,
+                   seed: Optional[int] = None) -> EmulatedDive:
+    '''Generate a plausible square profile dive with the given number of samples.'''
+    rng = random.Random(dive_id if seed is None else seed)
+    descent_end, ascent_start = sample_count // 10, (sample_count * 7) // 10
+
+    records, depths = [], []
+    for index in range(sample_count):
+        if index < descent_end:
+            depth = max_depth * (index + 1) / descent_end
+        elif index < ascent_start:
+            depth = max_depth - rng.uniform(0.0, 1.5)
+        else:
+            depth = max_depth * (sample_count - index - 1) / (sample_count - ascent_start)
+        depth = round(max(depth, 0.0), 1)
+        depths.append(depth)
+
+        tissue_loading = min(100, int(depth * 2 + index * 0.05))
+        values: List[Any] = [
+            3.62, (index + 1) * sample_interval, depth, round(max(12.0 - depth * 0.15, 4.0), 1),
+            21, 0, 21, 0, 2, 80, 30, 50, 0, 1.4, 0.0, 0, 32767, 0, 0,
+            *([tissue_loading] * 16),
+            128, 1, 0, 0, 0,
+        ]
+        records.append(_sample_record(values, index + 1, dive_id))
+
+    header_values: List[Any] = [
+        0, sample_count, dive_id * 3600, 700000000 + dive_id * 86400, 1013, 4294967295, 0,
+        max(depths), 0.6, 0.9, 60, 30, 30, 0, 0.5, 3, 0, 0, 14, 0, 0.0, 15, 1, 40126016, 64, 1,
+        32, round(sum(depths) / len(depths), 2), 0, 0, 0,
+    ]
+    return EmulatedDive(DIVE_HEADER_DECODER.pack(header_values), records)
+
+
+def _sample_record(values: List[Any], sample_id: int, dive_id: int) -> bytes:
+    '''Pack a sample record, which ends in the CRC of everything before it.'''
+    record = DIVE_SAMPLE_DECODER.pack(values)
+    record += _sample_record_trailer.pack(sample_id, dive_id, SAMPLE_RECORD_MARKER)
+    return record + CRC_ENGINE.calculate(record).to_bytes(2, 'big')
+
+
+def _frame(command: int, payload: bytes, marker: int) -> bytes:
+    body = bytes([command]) + payload + bytes([marker])
+    frame = bytes([0x55, len(body)]) + body
+    return frame + CRC_ENGINE.calculate(frame).to_bytes(2, 'big')
+
+
+class DeviceEmulator:
+    '''An emulated iX5M on a pseudo-terminal, answering commands 120, 121 and 122.
+
+    Replies are sent one request at a time, each after `latency` plus up to `jitter`
+    seconds and paced at 10 bits per byte at `baudrate`, in chunks of PACING_CHUNK_SIZE
+    bytes, so a reader sees partial frames as it would on a real port. A reply is swapped for a NAK
+    with probability `nak_rate` and each reply byte has a bit flipped with probability
+    `corruption_rate`. Point a SerialDriver at `port` once started.
+    '''
+    dives: Dict[int, EmulatedDive]
+    stats: EmulatorStats
+    _byte_time: float
+    _latency: float
+    _jitter: float
+    _nak_rate: float
+    _corruption_rate: float
+    _random: random.Random
+    _selected_dive: Optional[EmulatedDive]
+    _port: Optional[str]
+    _fds: Tuple[int, int]
+    _stopping: threading.Event
+    _thread: Optional[threading.Thread]
+
+    def __init__(self,
+                 dives: Dict[int, EmulatedDive],
+                 baudrate: Optional[int] = 115200,
+                 latency: float = 0.0,
+                 jitter: float = 0.0,
+                 nak_rate: float = 0.0,
+                 corruption_rate: float = 0.0,
+                 seed: Optional[int] = None) -> None:
+        if not dives:
+            raise ValueError('At least one dive is required')
+        self.dives = dives
+        self.stats = EmulatorStats()
+        self._byte_time = 10.0 / baudrate if baudrate else 0.0
+        self._latency = latency
+        self._jitter = jitter
+        self._nak_rate = nak_rate
+        self._corruption_rate = corruption_rate
+        self._random = random.Random(seed)
+        self._selected_dive = None
+        self._port = None
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def __enter__(self) -> DeviceEmulator:
+        self.start()
+        return self
+
+    def __exit__(self,
+                 exc_type: Optional[Type[BaseException]],
+                 exc_value: Optional[BaseException],
+                 traceback: Optional[TracebackType]) -> None:
+        self.stop()
+
+    @property
+    def port(self) -> str:
+        if self._port is None:
+            raise RuntimeError('The emulator has not been started')
+        return self._port
+
+    def start(self) -> str:
+        '''Open the pseudo-terminal and serve requests on a background thread.'''
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        self._fds = (master, slave)
+        self._port = os.ttyname(slave)
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._serve,
+                                        name=f'ratio-dumper-emulator-{self._port}',
+                                        daemon=True)
+        self._thread.start()
+        logger.info(f'Emulating a device with {len(self.dives)} dives on {self._port}')
+        return self._port
+
+    def stop(self) -> None:
+        '''Stop serving and close the pseudo-terminal.'''
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+        for fd in self._fds:
+            os.close(fd)
+        self._port = None
+
+    def respond(self, request: bytes) -> bytes:
+        '''Build the reply frame to a CRC verified request frame.'''
+        command, options = request[2], request[3:-2]
+        if command == 120:
+            return _frame(command, struct.pack('<HH', min(self.dives), max(self.dives)), 6)
+
+        if command == 121 and len(options) == 2:
+            self._selected_dive = self.dives.get(options[0] | (options[1] << 8))
+            if self._selected_dive is not None:
+                return _frame(command, self._selected_dive.header, 6)
+
+        if command == 122 and len(options) == 2 and self._selected_dive is not None:
+            records = self._selected_dive.records
+            sample_id = options[0] | (options[1] << 8)
+            if 1 <= sample_id <= len(records):
+                payload = b''.join(records[sample_id - 1:sample_id - 1 + SAMPLES_PER_REPLY])
+                payload += b'\xff' * (SAMPLE_RECORD_SIZE * SAMPLES_PER_REPLY - len(payload))
+                return _frame(command, payload, 6)
+
+        return _frame(command, b'\x01', 21)
+
+    def _inject_faults(self, request: bytes, response: bytes) -> bytes:
+        if self._nak_rate and self._random.random() < self._nak_rate:
+            self.stats.naks += 1
+            response = _frame(request[2], b'\x01', 21)
+
+        if self._corruption_rate:
+            corrupted = bytearray(response)
+            for index in range(len(corrupted)):
+                if self._random.random() < self._corruption_rate:
+                    corrupted[index] ^= 1 << self._random.randrange(8)
+                    self.stats.corrupted_bytes += 1
+            response = bytes(corrupted)
+        return response
+
+    def _serve(self) -> None:
+        master = self._fds[0]
+        buffer = bytearray()
+        pending: Deque[Tuple[float, bytes]] = deque()
+        device_free_at = 0.0
+
+        while not self._stopping.is_set():
+            timeout = 0.05
+            if pending:
+                timeout = min(timeout, max(0.0, pending[0][0] - time.monotonic()))
+
+            readable, _, _ = select.select([master], [], [], timeout)
+            if readable:
+                buffer += os.read(master, 4096)
+                for request in self._split_requests(buffer):
+                    self.stats.requests += 1
+                    response = self._inject_faults(request, self.respond(request))
+
+                    # Requests queue up on the device, which answers them one at a time
+                    arrived_at = (time.monotonic() + self._latency +
+                                  self._random.uniform(0.0, self._jitter))
+                    sending_at = max(arrived_at, device_free_at)
+                    chunk_size = PACING_CHUNK_SIZE if self._byte_time else len(response)
+                    for offset in range(0, len(response), chunk_size):
+                        chunk = response[offset:offset + chunk_size]
+                        pending.append((sending_at + (offset + len(chunk)) * self._byte_time,
+                                        chunk))
+                    device_free_at = sending_at + len(response) * self._byte_time
+
+            now = time.monotonic()
+            while pending and pending[0][0] <= now:
+                os.write(master, pending.popleft()[1])
+
+    @staticmethod
+    def _split_requests(buffer: bytearray) -> Iterator[bytes]:
+        '''Take every complete, CRC verified request frame off the front of the buffer.'''
+        while True:
+            start = buffer.find(0x55)
+            del buffer[:len(buffer) if start == -1 else start]
+            if len(buffer) < 2 or len(buffer) < buffer[1] + 4:
+                return
+
+            request = bytes(buffer[:buffer[1] + 4])
+            if CRC_ENGINE.verify(request):
+                del buffer[:len(request)]
+                yield request
+            else:
+                logger.warning(f'Ignoring request with a bad CRC: {request.hex()}')
+                del buffer[:1]
+
+
+@click.command()
+@click.option('--debug', is_flag=True)
+@click.option('--fixture', 'fixtures', multiple=True, type=click.Path(exists=True, dir_okay=False),
+              help='JSON fixture of recorded frames to serve, may be repeated.')
+@click.option('--synthetic', default=0, type=click.IntRange(min=0),
+              help='Number of synthetic dives to serve.')
+@click.option('--samples', default=360, type=click.IntRange(min=1),
+              help='Number of samples in each synthetic dive.')
+@click.option('--baudrate', default=115200, type=click.IntRange(min=0),
+              help='Baud rate to pace replies at, 0 to send them immediately.')
+@click.option('--latency', default=0.0, type=click.FloatRange(min=0), help='Seconds per reply.')
+@click.option('--jitter', default=0.0, type=click.FloatRange(min=0),
+              help='Maximum extra seconds of random latency per reply.')
+@click.option('--nak-rate', default=0.0, type=click.FloatRange(0, 1),
+              help='Probability of answering a request with a NAK.')
+@click.option('--corruption-rate', default=0.0, type=click.FloatRange(0, 1),
+              help='Probability of flipping a bit in each reply byte.')
+@click.option('--seed', type=int, help='Seed for the fault injection.')
+def main(debug: bool,
+         fixtures: Tuple[str, ...],
+         synthetic: int,
+         samples: int,
+         baudrate: int,
+         latency: float,
+         jitter: float,
+         nak_rate: float,
+         corruption_rate: float,
+         seed: Optional[int]) -> None:
+    '''ratio-dumper-emulator - Emulated Ratio iX5M on a pseudo-terminal.'''
+    logging.basicConfig(level=(logging.DEBUG if debug else logging.INFO),
+                        format='%(asctime)-15s %(levelname)s:%(name)s:%(message)s')
+    dives: Dict[int, EmulatedDive] = {}
+    for fixture in fixtures:
+        dives.update(load_fixture(fixture))
+    first_synthetic_id = max(dives, default=0) + 1
+    for dive_id in range(first_synthetic_id, first_synthetic_id + synthetic):
+        dives[dive_id] = synthetic_dive(dive_id, sample_count=samples)
+    if not dives:
+        raise click.UsageError('Nothing to serve, pass --fixture and/or --synthetic')
+
+    with DeviceEmulator(dives, baudrate, latency, jitter, nak_rate, corruption_rate,
+                        seed) as emulator:
+        click.echo(f'Serving {len(dives)} dives on {emulator.port}, press Ctrl-C to stop')
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        click.echo(f'{emulator.stats}')
+
+
+if __name__ == '__main__':
+    main()
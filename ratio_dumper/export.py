@@ -0,0 +1,164 @@
+'''
+ratio_dumper - Ratio iX5M Log Dumper
+
+MIT License
+
+Copyright (c) 2021 Damian Zaremba
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+from __future__ import annotations
+
+import csv
+import logging
+from array import array
+from itertools import repeat
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+from .columnar import ColumnarSamples, array_typecode
+from .decoders import DIVE_SAMPLE_DECODER, dive_sample_to_values
+from .defaults import EXPORT_FORMATS
+from .models import Dive, DiveSample
+from .utilities import SAMPLE_XML_FIELDS, import_optional
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Every sample row starts with the dive it belongs to
+DIVE_COLUMNS: Tuple[Tuple[str, str], ...] = (
+    ('diveId', 'I'),
+    ('UTCStartingTimeS', 'I'),
+)
+
+# The XML tag of each DIVE_SAMPLE_LAYOUT field, the raw wire integers are the XML units
+SAMPLE_COLUMNS: Tuple[Tuple[str, str, str], ...] = tuple(
+    (tag, name, fmt)
+    for (tag, _), name, fmt in zip(SAMPLE_XML_FIELDS,
+                                   DIVE_SAMPLE_DECODER.names,
+                                   DIVE_SAMPLE_DECODER.formats)
+)
+
+
+def sample_columns(dive: Dive) -> ColumnarSamples:
+    '''Return the samples of a dive as columns, converting them if needed.'''
+    if isinstance(dive.samples, ColumnarSamples):
+        return dive.samples
+    return ColumnarSamples(dive.samples)
+
+
+def _export_format(path: Path, export_format: Optional[str]) -> str:
+    export_format = export_format or path.suffix.lstrip('.').lower()
+    if export_format == 'feather':
+        export_format = 'arrow'
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f'Unknown export format {export_format!r}, '
+                         f'expected one of {", ".join(EXPORT_FORMATS)}')
+    return export_format
+
+
+# A dive header with the samples to export for it, e.g. from SerialDriver.iter_dive_samples
+SampleStream = Tuple[int, Dive, Iterable[DiveSample]]
+
+
+def export_samples(dives: Iterable[Tuple[int, Dive]],
+                   path: Union[str, Path],
+                   export_format: Optional[str] = None) -> int:
+    '''Write the samples of many dives as typed columns, one row per sample.
+
+    The format is taken from the file suffix unless given. Returns the number of
+    rows written.
+    '''
+    return export_sample_streams(((dive_id, dive, dive.samples) for dive_id, dive in dives),
+                                 path, export_format)
+
+
+def export_sample_streams(streams: Iterable[SampleStream],
+                          path: Union[str, Path],
+                          export_format: Optional[str] = None) -> int:
+    '''Write the samples of many dives as typed columns, consuming each stream once.
+
+    CSV rows are written as the samples arrive, so memory does not grow with the
+    export. The other formats collect every column, as raw integers, first.
+    '''
+    path = Path(path)
+    export_format = _export_format(path, export_format)
+    if export_format == 'csv':
+        return _write_csv(streams, path)
+
+    columns = _collect_columns(streams)
+    if export_format == 'npz':
+        _write_npz(columns, path)
+    else:
+        _write_arrow(columns, path, export_format)
+    return len(columns[DIVE_COLUMNS[0][0]])
+
+
+def _collect_columns(streams: Iterable[SampleStream]) -> Dict[str, array[int]]:
+    '''Concatenate the sample columns of many dives, keyed by XML tag.'''
+    columns: Dict[str, array[int]] = {
+        tag: array(array_typecode(fmt))
+        for tag, fmt in DIVE_COLUMNS + tuple((tag, fmt) for tag, _, fmt in SAMPLE_COLUMNS)
+    }
+    for dive_id, dive, samples in streams:
+        dive_columns = samples if isinstance(samples, ColumnarSamples) else ColumnarSamples(samples)
+        columns['diveId'].extend(repeat(dive_id, len(dive_columns)))
+        columns['UTCStartingTimeS'].extend(repeat(dive.utc_starting_time, len(dive_columns)))
+        for tag, name, _ in SAMPLE_COLUMNS:
+            columns[tag].extend(dive_columns.column(name))
+    return columns
+
+
+def _write_csv(streams: Iterable[SampleStream], path: Path) -> int:
+    rows = 0
+    with path.open('w', newline='') as fh:
+        writer = csv.writer(fh)
+        writer.writerow([tag for tag, _ in DIVE_COLUMNS] + [tag for tag, _, _ in SAMPLE_COLUMNS])
+        for dive_id, dive, samples in streams:
+            if isinstance(samples, ColumnarSamples):
+                writer.writerows(zip(repeat(dive_id), repeat(dive.utc_starting_time),
+                                     *(samples.column(name) for _, name, _ in SAMPLE_COLUMNS)))
+                rows += len(samples)
+                continue
+
+            for sample in samples:
+                writer.writerow([dive_id, dive.utc_starting_time,
+                                 *DIVE_SAMPLE_DECODER.unscale(dive_sample_to_values(sample))])
+                rows += 1
+    return rows
+
+
+def _write_npz(columns: Dict[str, array[int]], path: Path) -> None:
+    numpy = import_optional('numpy', 'numpy')
+    numpy.savez_compressed(path, **{tag: numpy.frombuffer(column, dtype=column.typecode)
+                                    for tag, column in columns.items()})
+
+
+def _write_arrow(columns: Dict[str, array[int]], path: Path, export_format: str) -> None:
+    pyarrow = import_optional('pyarrow', 'arrow')
+    types = {1: pyarrow.uint8(), 2: pyarrow.uint16(), 4: pyarrow.uint32(), 8: pyarrow.uint64()}
+    table = pyarrow.Table.from_arrays(
+        [pyarrow.Array.from_buffers(types[column.itemsize], len(column),
+                                    [None, pyarrow.py_buffer(column)])
+         for column in columns.values()],
+        names=list(columns))
+
+    if export_format == 'parquet':
+        import_optional('pyarrow.parquet', 'arrow').write_table(table, path)
+    else:
+        import_optional('pyarrow.feather', 'arrow').write_feather(table, path)
@@ -0,0 +1,182 @@
+'''
+ratio_dumper - Ratio iX5M Log Dumper
+
+MIT License
+
+Copyright (c) 2021 Damian Zaremba
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import logging
+from typing import Optional, Protocol
+
+from .utilities import CRC_ENGINE
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+START_MARKER = 0x55
+
+
+def _valid_body_size(body_size: int) -> bool:
+    return 2 < body_size < 255
+
+
+class ReadableStream(Protocol):
+    def read(self, size: int = 1) -> bytes:
+        ...
+
+
+class FrameReader:
+    '''Buffered reader splitting a byte stream into CRC verified frames.
+
+    Everything already waiting on the port is read in one call and frames are parsed
+    from the buffer. Bytes that do not start a valid frame are skipped until the next
+    start marker followed by a frame with a valid CRC, rather than losing the session.
+
+    Frame layout:
+     85 = byte, START marker
+     <variable> = byte, length of the body
+     <..> = body, command, payload and ACK or NAK marker
+     <variable> = 2 bytes, CRC of everything before it
+    '''
+    _buffer: bytearray
+    _unsynchronised_bytes: int
+    resyncs: int
+    skipped_bytes: int
+    crc_errors: int
+
+    def __init__(self) -> None:
+        self._buffer = bytearray()
+        self._unsynchronised_bytes = 0
+        self.resyncs = 0
+        self.skipped_bytes = 0
+        self.crc_errors = 0
+
+    def clear(self) -> None:
+        '''Drop anything buffered, after the port input has been reset.'''
+        self._buffer.clear()
+
+    def read_frame(self, stream: ReadableStream) -> Optional[bytes]:
+        '''Read the next valid frame, returning None on a timeout or an unrecoverable CRC error.'''
+        frame = self._read_frame(stream)
+        if frame is not None and self._unsynchronised_bytes:
+            logger.warning(f'Resynchronised after skipping {self._unsynchronised_bytes} bytes')
+            self._unsynchronised_bytes = 0
+        return frame
+
+    def _read_frame(self, stream: ReadableStream) -> Optional[bytes]:
+        buffer = self._buffer
+        while True:
+            self._skip_to(buffer.find(START_MARKER))
+            if not self._fill(stream, 2):
+                return self._recover()
+
+            # Refilling an empty buffer may have read stray bytes ahead of the frame
+            if buffer[0] != START_MARKER:
+                continue
+
+            body_size = buffer[1]
+            if not _valid_body_size(body_size):
+                self._skip_to(1)
+                continue
+
+            frame_size = body_size + 4
+            if not self._fill(stream, frame_size):
+                return self._recover()
+
+            frame = bytes(buffer[:frame_size])
+            if CRC_ENGINE.verify(frame):
+                del buffer[:frame_size]
+                return frame
+
+            # Either garbage that looked like a frame, or a frame damaged in transit
+            resynced_frame = self._scan(1, stream, frame_size)
+            if resynced_frame is not None:
+                return resynced_frame
+
+            # Drop the whole damaged frame, so the following frame is still aligned
+            self.crc_errors += 1
+            logger.error(f'CRC mismatch on frame: {buffer[:frame_size].hex()}')
+            del buffer[:frame_size]
+            return None
+
+    def _fill(self, stream: ReadableStream, size: int) -> bool:
+        '''Read until at least size bytes are buffered, taking everything already waiting.'''
+        missing = size - len(self._buffer)
+        if missing <= 0:
+            return True
+
+        waiting = getattr(stream, 'in_waiting', 0)
+        data = stream.read(max(missing, waiting))
+        self._buffer += data
+        return len(data) >= missing
+
+    def _scan(self,
+              offset: int,
+              stream: Optional[ReadableStream] = None,
+              read_before: int = 0) -> Optional[bytes]:
+        '''Find a complete valid frame in the buffer, skipping everything before it.
+
+        Candidates starting before read_before are completed from the stream, until a
+        read times out; later candidates are only checked against the bytes buffered.
+        '''
+        buffer = self._buffer
+        start = buffer.find(START_MARKER, offset)
+        while start != -1:
+            # Stop reading once the stream runs dry, later candidates are checked as buffered
+            if stream is not None and start < read_before:
+                if not (self._fill(stream, start + 2) and
+                        (not _valid_body_size(buffer[start + 1]) or
+                         self._fill(stream, start + buffer[start + 1] + 4))):
+                    stream = None
+            if start + 2 > len(buffer):
+                break
+
+            frame_size = buffer[start + 1] + 4
+            if (_valid_body_size(buffer[start + 1]) and start + frame_size <= len(buffer) and
+                    CRC_ENGINE.verify(memoryview(buffer)[start:start + frame_size])):
+                self._skip_to(start)
+                frame = bytes(buffer[:frame_size])
+                del buffer[:frame_size]
+                return frame
+            start = buffer.find(START_MARKER, start + 1)
+        return None
+
+    def _recover(self) -> Optional[bytes]:
+        '''Salvage a frame after a read timeout, dropping a partial frame that cannot complete.'''
+        frame = self._scan(1)
+        if frame is None and self._buffer:
+            self._skip_to(len(self._buffer))
+        return frame
+
+    def _skip_to(self, offset: int) -> None:
+        '''Discard buffered bytes up to offset, or everything when offset is -1.'''
+        if offset == -1:
+            offset = len(self._buffer)
+        if offset == 0:
+            return
+
+        # Count every run of bytes skipped between two valid frames as a single resync
+        if not self._unsynchronised_bytes:
+            self.resyncs += 1
+        self._unsynchronised_bytes += offset
+        self.skipped_bytes += offset
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f'Skipping {offset} bytes: {self._buffer[:offset].hex()}')
+        del self._buffer[:offset]
@@ -0,0 +1,146 @@
+'''
+ratio_dumper - Ratio iX5M Log Dumper
+
+MIT License
+
+Copyright (c) 2021 Damian Zaremba
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+from __future__ import annotations
+
+import json
+import logging
+import os
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Union
+
+from .driver import SerialDriver
+from .models import Dive, SoftwareVersion, device_time_to_datetime
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class DiveIndexEntry:
+    dive_id: int
+    utc_starting_time: int
+    monotonic_time: int
+    depth_max: float
+    avg_depth: float
+    dive_sample_count: int
+    software_version: int
+
+    @classmethod
+    def from_dive(cls, dive_id: int, dive: Dive) -> DiveIndexEntry:
+        return cls(
+            dive_id=dive_id,
+            utc_starting_time=dive.utc_starting_time,
+            monotonic_time=dive.monotonic_time,
+            depth_max=dive.depth_max,
+            avg_depth=dive.avg_depth,
+            dive_sample_count=dive.dive_sample_count,
+            software_version=dive.software_version.as_numeric,
+        )
+
+    @property
+    def starting_time(self) -> datetime:
+        return device_time_to_datetime(self.utc_starting_time)
+
+    @property
+    def software_release(self) -> str:
+        return SoftwareVersion(self.software_version).as_release
+
+
+class DiveIndex:
+    '''Compact index of dive headers, built with header-only (command 121) requests.'''
+    entries: Dict[int, DiveIndexEntry]
+
+    def __init__(self, entries: Optional[Dict[int, DiveIndexEntry]] = None) -> None:
+        self.entries = entries or {}
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> DiveIndex:
+        '''Load a cached index, starting an empty one if none exists.'''
+        path = Path(path)
+        if not path.is_file():
+            return cls()
+
+        with path.open('r') as fh:
+            return cls({entry['dive_id']: DiveIndexEntry(**entry) for entry in json.load(fh)})
+
+    def save(self, path: Union[str, Path]) -> None:
+        '''Atomically write the index.'''
+        path = Path(path)
+        temporary_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+        with temporary_path.open('w') as fh:
+            json.dump([asdict(entry) for entry in self], fh, indent=2)
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def build(cls, driver: SerialDriver) -> Optional[DiveIndex]:
+        '''Build an index of every dive on a device.'''
+        index = cls()
+        dive_ids = driver.get_dive_ids()
+        if dive_ids is None or not index.refresh(driver, dive_ids):
+            return None
+        return index
+
+    def refresh(self, driver: SerialDriver, dive_ids: Set[int]) -> bool:
+        '''Bring the index in line with the device, fetching only headers not yet indexed.'''
+        self.entries = {dive_id: entry
+                        for dive_id, entry in self.entries.items()
+                        if dive_id in dive_ids}
+
+        # If the highest indexed dive changed, the device renumbered its dives
+        if self.entries:
+            anchor_id = max(self.entries)
+            header = driver.get_dive_header(anchor_id)
+            if header is None:
+                return False
+            if DiveIndexEntry.from_dive(anchor_id, header) != self.entries[anchor_id]:
+                logger.warning('Device dive numbering changed, rebuilding the dive index')
+                self.entries = {}
+
+        for dive_id in sorted(dive_ids - self.entries.keys()):
+            header = driver.get_dive_header(dive_id)
+            if header is None:
+                return False
+            self.entries[dive_id] = DiveIndexEntry.from_dive(dive_id, header)
+        return True
+
+    def __iter__(self) -> Iterator[DiveIndexEntry]:
+        return iter(sorted(self.entries.values(), key=lambda entry: entry.dive_id))
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def select(self,
+               since: Optional[datetime] = None,
+               until: Optional[datetime] = None,
+               min_depth: Optional[float] = None,
+               max_depth: Optional[float] = None) -> List[DiveIndexEntry]:
+        '''Select dives by starting time and maximum depth (in meters).'''
+        return [entry for entry in self
+                if (since is None or entry.starting_time >= since) and
+                (until is None or entry.starting_time < until) and
+                (min_depth is None or entry.depth_max >= min_depth) and
+                (max_depth is None or entry.depth_max <= max_depth)]
@@ -0,0 +1,261 @@
+'''
+ratio_dumper - Ratio iX5M Log Dumper
+
+MIT License
+
+Copyright (c) 2021 Damian Zaremba
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+from __future__ import annotations
+
+import logging
+import sqlite3
+import struct
+from array import array
+from dataclasses import dataclass, replace
+from datetime import datetime
+from pathlib import Path
+from types import TracebackType
+from typing import Any, Iterable, Iterator, List, Optional, Tuple, Type, Union
+
+from .columnar import ColumnarSamples, array_typecode
+from .decoders import (DIVE_HEADER_DECODER,
+                       DIVE_SAMPLE_DECODER,
+                       decode_dive_header,
+                       dive_header_to_values)
+from .models import (Dive, DiveMode, WaterType, datetime_to_device_time,
+                     device_time_to_datetime)
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS dives (
+    id INTEGER PRIMARY KEY,
+    dive_id INTEGER NOT NULL,
+    monotonic_time INTEGER NOT NULL,
+    utc_starting_time INTEGER NOT NULL,
+    depth_max REAL NOT NULL,
+    avg_depth REAL NOT NULL,
+    dive_mode INTEGER NOT NULL,
+    water INTEGER NOT NULL,
+    sample_count INTEGER NOT NULL,
+    header BLOB NOT NULL,
+    UNIQUE (monotonic_time, utc_starting_time)
+);
+CREATE INDEX IF NOT EXISTS dives_starting_time ON dives (utc_starting_time);
+CREATE INDEX IF NOT EXISTS dives_depth_max ON dives (depth_max);
+CREATE INDEX IF NOT EXISTS dives_mode_water ON dives (dive_mode, water, utc_starting_time);
+CREATE TABLE IF NOT EXISTS samples (
+    dive INTEGER NOT NULL REFERENCES dives (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (dive, name)
+) WITHOUT ROWID;
+'''
+
+_ENTRY_COLUMNS = ('id, dive_id, monotonic_time, utc_starting_time, depth_max, avg_depth, '
+                  'dive_mode, water, sample_count')
+
+
+@dataclass(frozen=True)
+class LogbookEntry:
+    id: int
+    dive_id: int
+    monotonic_time: int
+    utc_starting_time: int
+    depth_max: float
+    avg_depth: float
+    dive_mode: DiveMode
+    water: WaterType
+    sample_count: int
+
+    @classmethod
+    def _from_row(cls, row: Tuple[Any, ...]) -> LogbookEntry:
+        fields = list(row)
+        fields[6] = DiveMode(fields[6])
+        fields[7] = WaterType(fields[7])
+        return cls(*fields)
+
+    @property
+    def starting_time(self) -> datetime:
+        return device_time_to_datetime(self.utc_starting_time)
+
+
+class DiveLogbook:
+    '''SQLite store of dives, queried by their header fields without decoding any samples.
+
+    Header fields used for selection are held in indexed columns, next to the
+    raw header payload the full Dive is restored from. Samples are stored per
+    dive as one little-endian blob per DIVE_SAMPLE_LAYOUT column, so a single
+    field of a dive is read without the rest. Dives are identified by their
+    monotonic and UTC starting times, as in DiveArchive, so ingesting the same
+    dive again is a no-op.
+    '''
+    SCHEMA_VERSION = 1
+
+    path: Path
+    _connection: sqlite3.Connection
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        self._connection = sqlite3.connect(self.path)
+        try:
+            self._create_schema()
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self) -> DiveLogbook:
+        return self
+
+    def __exit__(self,
+                 exc_type: Optional[Type[BaseException]],
+                 exc_val: Optional[BaseException],
+                 exc_tb: Optional[TracebackType]) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def _create_schema(self) -> None:
+        version: int = self._connection.execute('PRAGMA user_version').fetchone()[0]
+        if version not in (0, self.SCHEMA_VERSION):
+            raise ValueError(f'{self.path} is not a version {self.SCHEMA_VERSION} dive logbook')
+
+        self._connection.execute('PRAGMA foreign_keys = ON')
+        with self._connection:
+            self._connection.executescript(_SCHEMA)
+            self._connection.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+
+    def __len__(self) -> int:
+        count: int = self._connection.execute('SELECT COUNT(*) FROM dives').fetchone()[0]
+        return count
+
+    def __iter__(self) -> Iterator[LogbookEntry]:
+        return iter(self.select())
+
+    def __contains__(self, dive: object) -> bool:
+        '''Check whether a dive (or just its header) is in the logbook, by its identity.'''
+        if not isinstance(dive, Dive):
+            return False
+        return self._connection.execute(
+            'SELECT 1 FROM dives WHERE monotonic_time = ? AND utc_starting_time = ?',
+            (dive.monotonic_time, dive.utc_starting_time)).fetchone() is not None
+
+    def add(self, dive_id: int, dive: Dive) -> bool:
+        '''Add a dive, returning False if it is already in the logbook.'''
+        return self.ingest([(dive_id, dive)]) == 1
+
+    def ingest(self, dives: Iterable[Tuple[int, Dive]]) -> int:
+        '''Add the dives not in the logbook yet, committing each one as it is added.
+
+        Dives are read between transactions, so a failure part way through a
+        download keeps the dives added before it. Returns the number of dives added.
+        '''
+        added = 0
+        cursor = self._connection.cursor()
+        for dive_id, dive in dives:
+            with self._connection:
+                cursor.execute(
+                    'INSERT OR IGNORE INTO dives (dive_id, monotonic_time, utc_starting_time, '
+                    'depth_max, avg_depth, dive_mode, water, sample_count, header) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (dive_id, dive.monotonic_time, dive.utc_starting_time, dive.depth_max,
+                     dive.avg_depth, dive.dive_mode.value, dive.water.value, len(dive.samples),
+                     DIVE_HEADER_DECODER.pack(dive_header_to_values(dive))))
+                if not cursor.rowcount:
+                    continue
+
+                assert cursor.lastrowid is not None
+                cursor.executemany('INSERT INTO samples (dive, name, data) VALUES (?, ?, ?)',
+                                   self._pack_samples(cursor.lastrowid, dive))
+            added += 1
+        return added
+
+    @staticmethod
+    def _pack_samples(row_id: int, dive: Dive) -> Iterator[Tuple[int, str, bytes]]:
+        samples = (dive.samples if isinstance(dive.samples, ColumnarSamples)
+                   else ColumnarSamples(dive.samples))
+        sample_count = len(samples)
+        for name, fmt in zip(DIVE_SAMPLE_DECODER.names, DIVE_SAMPLE_DECODER.formats):
+            yield row_id, name, struct.pack(f'<{sample_count}{fmt}', *samples.column(name))
+
+    def select(self,
+               since: Optional[datetime] = None,
+               until: Optional[datetime] = None,
+               min_depth: Optional[float] = None,
+               max_depth: Optional[float] = None,
+               dive_mode: Optional[DiveMode] = None,
+               water: Optional[WaterType] = None) -> List[LogbookEntry]:
+        '''Select dives by starting time, maximum depth (in meters), mode and water type.'''
+        conditions = []
+        parameters: List[Union[int, float]] = []
+        for condition, value in (('utc_starting_time >= ?',
+                                  datetime_to_device_time(since) if since else None),
+                                 ('utc_starting_time < ?',
+                                  datetime_to_device_time(until) if until else None),
+                                 ('depth_max >= ?', min_depth),
+                                 ('depth_max <= ?', max_depth),
+                                 ('dive_mode = ?', dive_mode.value if dive_mode else None),
+                                 ('water = ?', water.value if water else None)):
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+
+        where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+        rows = self._connection.execute(
+            f'SELECT {_ENTRY_COLUMNS} FROM dives{where} ORDER BY utc_starting_time, id',
+            parameters)
+        return [LogbookEntry._from_row(row) for row in rows]
+
+    def find(self, dive_id: int) -> Optional[LogbookEntry]:
+        '''Find the most recently added dive with a device dive id.'''
+        row = self._connection.execute(
+            f'SELECT {_ENTRY_COLUMNS} FROM dives WHERE dive_id = ? ORDER BY id DESC LIMIT 1',
+            (dive_id,)).fetchone()
+        return LogbookEntry._from_row(row) if row else None
+
+    def header(self, entry: LogbookEntry) -> Dive:
+        '''Decode the header of a dive, without its samples.'''
+        header: bytes = self._connection.execute('SELECT header FROM dives WHERE id = ?',
+                                                 (entry.id,)).fetchone()[0]
+        return decode_dive_header(header)
+
+    def column(self, entry: LogbookEntry, name: str) -> array[int]:
+        '''Read the raw (unscaled) DIVE_SAMPLE_LAYOUT column of a dive.'''
+        fmt = DIVE_SAMPLE_DECODER.formats[DIVE_SAMPLE_DECODER.names.index(name)]
+        data: bytes = self._connection.execute(
+            'SELECT data FROM samples WHERE dive = ? AND name = ?', (entry.id, name)).fetchone()[0]
+        return array(array_typecode(fmt), struct.unpack(f'<{entry.sample_count}{fmt}', data))
+
+    def dive(self, entry: LogbookEntry) -> Dive:
+        '''Decode a dive, with its samples as ColumnarSamples.'''
+        data = dict(self._connection.execute('SELECT name, data FROM samples WHERE dive = ?',
+                                             (entry.id,)))
+        columns = tuple(array(array_typecode(fmt),
+                              struct.unpack(f'<{entry.sample_count}{fmt}', data[name]))
+                        for name, fmt in zip(DIVE_SAMPLE_DECODER.names,
+                                             DIVE_SAMPLE_DECODER.formats))
+        return replace(self.header(entry), samples=ColumnarSamples.from_columns(columns))
+
+    def get(self, dive_id: int) -> Optional[Dive]:
+        '''Decode the most recently added dive with a device dive id.'''
+        entry = self.find(dive_id)
+        return self.dive(entry) if entry else None
@@ -0,0 +1,201 @@
+'''
+ratio_dumper - Ratio iX5M Log Dumper
+
+MIT License
+
+Copyright (c) 2021 Damian Zaremba
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+from __future__ import annotations
+
+import json
+import logging
+import os
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+from .driver import SerialDriver
+from .models import Dive
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = '.ratio-dumper-sync.json'
+
+
+@dataclass
+class ManifestEntry:
+    dive_id: Optional[int]
+    file_name: str
+    complete: bool
+
+
+class SyncManifest:
+    '''Record of the dives synced into a target directory, keyed by header fingerprint.
+
+    Dive ids are only trusted while the device id range keeps growing and the
+    highest synced dive still has the same fingerprint. Once the device wraps
+    around or renumbers its dives every id is verified against its header again.
+    '''
+    VERSION = 1
+
+    path: Path
+    dive_range: Optional[Tuple[int, int]]
+    entries: Dict[str, ManifestEntry]
+    is_new: bool
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.dive_range = None
+        self.entries = {}
+        self.is_new = True
+
+    @classmethod
+    def load(cls, directory: Union[str, Path]) -> SyncManifest:
+        '''Load the manifest for a directory, starting an empty one if none exists.'''
+        manifest = cls(Path(directory) / MANIFEST_NAME)
+        if not manifest.path.is_file():
+            return manifest
+
+        with manifest.path.open('r') as fh:
+            data = json.load(fh)
+
+        if data.get('version') != cls.VERSION:
+            logger.warning(f'Ignoring sync manifest with unknown version: {manifest.path}')
+            return manifest
+
+        manifest.is_new = False
+        manifest.dive_range = (data['range'][0], data['range'][1]) if data['range'] else None
+        manifest.entries = {fingerprint: ManifestEntry(**entry)
+                            for fingerprint, entry in data['dives'].items()}
+        return manifest
+
+    def save(self) -> None:
+        '''Atomically write the manifest.'''
+        data = {
+            'version': self.VERSION,
+            'range': list(self.dive_range) if self.dive_range else None,
+            'dives': {fingerprint: asdict(entry) for fingerprint, entry in self.entries.items()},
+        }
+
+        temporary_path = self.path.with_name(f'.{self.path.name}.{os.getpid()}.tmp')
+        with temporary_path.open('w') as fh:
+            json.dump(data, fh, indent=2, sort_keys=True)
+        os.replace(temporary_path, self.path)
+        self.is_new = False
+
+    @staticmethod
+    def fingerprint(dive: Dive) -> str:
+        '''Identify a dive by its header, independent of the device dive id.'''
+        return f'{dive.utc_starting_time}-{dive.monotonic_time}-{dive.dive_sample_count}'
+
+    def _completed_dive_ids(self) -> Dict[int, str]:
+        return {entry.dive_id: fingerprint
+                for fingerprint, entry in self.entries.items()
+                if entry.complete and entry.dive_id is not None}
+
+    def detect_wraparound(self, dive_ids: Set[int]) -> bool:
+        '''Check if the device id range moved backwards since the last sync.'''
+        if self.dive_range is None or not dive_ids:
+            return False
+
+        previous_first, previous_last = self.dive_range
+        return min(dive_ids) < previous_first or max(dive_ids) < previous_last
+
+    def plan(self, driver: SerialDriver, dive_ids: Set[int]) -> Optional[List[int]]:
+        '''Work out which dives need downloading, fetching as few headers as possible.'''
+        completed_dive_ids = self._completed_dive_ids()
+        verify_all = self.detect_wraparound(dive_ids)
+
+        # The highest synced dive anchors the numbering, if it changed the ids can't be trusted
+        anchor_ids = [dive_id for dive_id in completed_dive_ids if dive_id in dive_ids]
+        if not verify_all and anchor_ids:
+            anchor_id = max(anchor_ids)
+            header = driver.get_dive_header(anchor_id)
+            if header is None:
+                return None
+            verify_all = self.fingerprint(header) != completed_dive_ids[anchor_id]
+
+        if verify_all:
+            logger.warning('Device dive numbering changed, verifying every dive header')
+            for stale_entry in self.entries.values():
+                stale_entry.dive_id = None
+
+        pending_dive_ids = []
+        for dive_id in sorted(dive_ids):
+            if not verify_all and dive_id in completed_dive_ids:
+                continue
+
+            header = driver.get_dive_header(dive_id)
+            if header is None:
+                return None
+
+            fingerprint = self.fingerprint(header)
+            entry = self.entries.get(fingerprint)
+            if entry is not None and entry.complete:
+                entry.dive_id = dive_id
+                continue
+
+            # Directories synced before the manifest existed only have <id>.xml files
+            legacy_file_name = f'{dive_id}.xml'
+            if (self.is_new and
+                    entry is None and
+                    (self.path.parent / legacy_file_name).is_file()):
+                self.entries[fingerprint] = ManifestEntry(dive_id, legacy_file_name, True)
+                continue
+
+            pending_dive_ids.append(dive_id)
+
+        self.save()
+        return pending_dive_ids
+
+    def _file_name_for(self, dive_id: int, fingerprint: str) -> str:
+        '''Pick <id>.xml, unless that name already belongs to another dive.'''
+        file_name = f'{dive_id}.xml'
+        claimed_file_names = {entry.file_name
+                              for entry_fingerprint, entry in self.entries.items()
+                              if entry_fingerprint != fingerprint}
+        if file_name in claimed_file_names or (self.path.parent / file_name).exists():
+            return f'{dive_id}-{fingerprint}.xml'
+        return file_name
+
+    def start(self, dive_id: int, dive: Dive) -> Path:
+        '''Record a dive as in progress, returning the path it should be written to.'''
+        fingerprint = self.fingerprint(dive)
+        if fingerprint not in self.entries:
+            self.entries[fingerprint] = ManifestEntry(dive_id,
+                                                      self._file_name_for(dive_id, fingerprint),
+                                                      False)
+
+        entry = self.entries[fingerprint]
+        entry.dive_id, entry.complete = dive_id, False
+        self.save()
+        return self.path.parent / entry.file_name
+
+    def complete(self, dive: Dive) -> None:
+        '''Record a dive as completely written.'''
+        self.entries[self.fingerprint(dive)].complete = True
+        self.save()
+
+    def finish(self, dive_ids: Set[int]) -> None:
+        '''Record the device id range after a successful sync.'''
+        if dive_ids:
+            self.dive_range = (min(dive_ids), max(dive_ids))
+        self.save()
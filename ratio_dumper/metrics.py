@@ -0,0 +1,249 @@
+'''
+ratio_dumper - Ratio iX5M Log Dumper
+
+MIT License
+
+Copyright (c) 2021 Damian Zaremba
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from enum import Enum
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Protocol, Tuple, Union
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+COMMAND_NAMES = {120: 'dive_ids', 121: 'dive_header', 122: 'dive_sample'}
+
+# Upper bounds of the reply latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class EventKind(Enum):
+    REQUEST = 'request'
+    REPLY = 'reply'
+    NAK = 'nak'
+    CRC_ERROR = 'crc_error'
+    TIMEOUT = 'timeout'
+    RETRY = 'retry'
+
+
+@dataclass(frozen=True)
+class TransferEvent:
+    kind: EventKind
+    command: int
+    size: int = 0
+    latency: Optional[float] = None
+    timestamp: float = 0.0
+
+
+class MetricsSink(Protocol):
+    def record(self, event: TransferEvent) -> None:
+        ...
+
+    def close(self) -> None:
+        ...
+
+
+@dataclass
+class CommandMetrics:
+    requests: int = 0
+    replies: int = 0
+    naks: int = 0
+    crc_errors: int = 0
+    timeouts: int = 0
+    retries: int = 0
+    bytes_out: int = 0
+    bytes_in: int = 0
+    latency_buckets: List[int] = field(default_factory=lambda: [0] * len(LATENCY_BUCKETS))
+    latency_sum: float = 0.0
+    latency_count: int = 0
+
+
+_EVENT_COUNTERS = {
+    EventKind.REQUEST: 'requests',
+    EventKind.REPLY: 'replies',
+    EventKind.NAK: 'naks',
+    EventKind.CRC_ERROR: 'crc_errors',
+    EventKind.TIMEOUT: 'timeouts',
+    EventKind.RETRY: 'retries',
+}
+
+
+class TransferMetrics:
+    '''Sink aggregating transfer events into counters and latency histograms per command.'''
+    commands: Dict[int, CommandMetrics]
+    first_timestamp: Optional[float]
+    last_timestamp: Optional[float]
+    _lock: threading.Lock
+
+    def __init__(self) -> None:
+        self.commands = {}
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self._lock = threading.Lock()
+
+    def record(self, event: TransferEvent) -> None:
+        with self._lock:
+            metrics = self.commands.get(event.command)
+            if metrics is None:
+                metrics = self.commands[event.command] = CommandMetrics()
+
+            counter = _EVENT_COUNTERS[event.kind]
+            setattr(metrics, counter, getattr(metrics, counter) + 1)
+            if event.kind is EventKind.REQUEST:
+                metrics.bytes_out += event.size
+            else:
+                metrics.bytes_in += event.size
+
+            if event.latency is not None:
+                metrics.latency_sum += event.latency
+                metrics.latency_count += 1
+                bucket = bisect_left(LATENCY_BUCKETS, event.latency)
+                if bucket < len(LATENCY_BUCKETS):
+                    metrics.latency_buckets[bucket] += 1
+
+            if self.first_timestamp is None:
+                self.first_timestamp = event.timestamp
+            self.last_timestamp = event.timestamp
+
+    def close(self) -> None:
+        pass
+
+    def frames_per_second(self) -> float:
+        '''Reply frames per second between the first and the last event.'''
+        if self.first_timestamp is None or self.last_timestamp is None:
+            return 0.0
+        elapsed = self.last_timestamp - self.first_timestamp
+        replies = sum(metrics.replies + metrics.naks for metrics in self.commands.values())
+        return replies / elapsed if elapsed > 0 else 0.0
+
+
+class CallbackSink:
+    '''Sink passing every transfer event to a callback.'''
+    _callback: Callable[[TransferEvent], None]
+
+    def __init__(self, callback: Callable[[TransferEvent], None]) -> None:
+        self._callback = callback
+
+    def record(self, event: TransferEvent) -> None:
+        self._callback(event)
+
+    def close(self) -> None:
+        pass
+
+
+class PrometheusTextfileSink(TransferMetrics):
+    '''Sink writing the aggregated metrics in the Prometheus text format.
+
+    The file is replaced atomically at most every `interval` seconds and when the
+    sink is closed, for collection by the node_exporter textfile collector. One
+    sink may be shared by the drivers of several devices, each on its own thread.
+    '''
+    path: Path
+    labels: Dict[str, str]
+    interval: float
+    _written_at: float
+    _write_lock: threading.Lock
+
+    def __init__(self,
+                 path: Union[str, Path],
+                 labels: Optional[Dict[str, str]] = None,
+                 interval: float = 10.0) -> None:
+        super().__init__()
+        self.path = Path(path)
+        self.labels = labels or {}
+        self.interval = interval
+        self._written_at = time.monotonic()
+        # Separate from _lock, which render() takes, so recording never waits on the file
+        self._write_lock = threading.Lock()
+
+    def record(self, event: TransferEvent) -> None:
+        super().record(event)
+        if time.monotonic() - self._written_at < self.interval:
+            return
+
+        with self._write_lock:
+            # Another thread may have written the file while this one waited
+            if time.monotonic() - self._written_at >= self.interval:
+                self._write()
+
+    def close(self) -> None:
+        self.write()
+
+    def write(self) -> None:
+        with self._write_lock:
+            self._write()
+
+    def _write(self) -> None:
+        self._written_at = time.monotonic()
+        temporary_path = self.path.with_name(
+            f'.{self.path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        temporary_path.write_text(self.render())
+        os.replace(temporary_path, self.path)
+
+    def render(self) -> str:
+        '''Render every metric in the Prometheus text exposition format.'''
+        counters: Tuple[Tuple[str, str, str], ...] = (
+            ('requests', 'requests_total', 'Requests sent to the device.'),
+            ('replies', 'replies_total', 'Acknowledged replies received.'),
+            ('naks', 'naks_total', 'NAK replies received.'),
+            ('crc_errors', 'crc_errors_total', 'Replies dropped for a CRC mismatch.'),
+            ('timeouts', 'timeouts_total', 'Replies that did not arrive in time.'),
+            ('retries', 'retries_total', 'Requests retried after a failure.'),
+            ('bytes_out', 'sent_bytes_total', 'Bytes sent to the device.'),
+            ('bytes_in', 'received_bytes_total', 'Bytes received in reply frames.'),
+        )
+
+        with self._lock:
+            lines = []
+            for attribute, name, description in counters:
+                lines.append(f'# HELP ratio_dumper_{name} {description}')
+                lines.append(f'# TYPE ratio_dumper_{name} counter')
+                for command, metrics in sorted(self.commands.items()):
+                    lines.append(f'ratio_dumper_{name}{self._labels(command)} '
+                                 f'{getattr(metrics, attribute)}')
+
+            name = 'ratio_dumper_reply_latency_seconds'
+            lines.append(f'# HELP {name} Time from sending a request to its reply.')
+            lines.append(f'# TYPE {name} histogram')
+            for command, metrics in sorted(self.commands.items()):
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, metrics.latency_buckets):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{self._labels(command, le=str(bound))} '
+                                 f'{cumulative}')
+                lines.append(f'{name}_bucket{self._labels(command, le="+Inf")} '
+                             f'{metrics.latency_count}')
+                lines.append(f'{name}_sum{self._labels(command)} {metrics.latency_sum}')
+                lines.append(f'{name}_count{self._labels(command)} {metrics.latency_count}')
+
+        return '\n'.join(lines) + '\n'
+
+    def _labels(self, command: int, **extra: str) -> str:
+        labels = {**self.labels,
+                  'command': COMMAND_NAMES.get(command, str(command)),
+                  **extra}
+        return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
@@ -23,11 +23,37 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
+from datetime import datetime, timedelta, timezone
 from enum import Enum
-from typing import List
+from typing import Any, Dict, MutableSequence, Tuple
 
 from dataclasses import dataclass
 
+# Device timestamps count seconds since 2000-01-01 UTC (as in libdivecomputer)
+DEVICE_EPOCH = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+
+def device_time_to_datetime(device_time: int) -> datetime:
+    '''Convert a device timestamp into an aware datetime.'''
+    return DEVICE_EPOCH + timedelta(seconds=device_time)
+
+
+def datetime_to_device_time(value: datetime) -> int:
+    '''Convert an aware datetime into a device timestamp.'''
+    return int((value - DEVICE_EPOCH).total_seconds())
+
+
+class _FrozenSlots:
+    '''Pickling for frozen dataclasses with __slots__, which cannot be restored by assignment.'''
+    __slots__: Tuple[str, ...] = ()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
 
 class DiveMode(Enum):
     OC = 0
@@ -43,6 +69,8 @@ class DecompressionAlgorithm(Enum):
 
 
 class SoftwareVersion:
+    __slots__ = ('version', 'major', 'minor', 'patch', 'build')
+
     version: int
     major: str
     minor: str
@@ -66,7 +94,9 @@ class SoftwareVersion:
 
 
 @dataclass(frozen=True)
-class GasMix:
+class GasMix(_FrozenSlots):
+    __slots__ = ('o2_percentage', 'he_percentage')
+
     o2_percentage: int
     he_percentage: int
 
@@ -76,24 +106,38 @@ class GasMix:
 
 
 @dataclass(frozen=True)
-class DecompressionAlgorithmVpmSettings:
+class DecompressionAlgorithmVpmSettings(_FrozenSlots):
+    __slots__ = ('r0',)
+
     r0: int
 
 
 @dataclass(frozen=True)
-class DecompressionAlgorithmBuhlmannSettings:
+class DecompressionAlgorithmBuhlmannSettings(_FrozenSlots):
+    __slots__ = ('gradient_factor_low', 'gradient_factor_high')
+
     gradient_factor_low: int
     gradient_factor_high: int
 
 
 @dataclass(frozen=True)
-class DecompressionAlgorithmSettings:
+class DecompressionAlgorithmSettings(_FrozenSlots):
+    __slots__ = ('buhlmann', 'vpm')
+
     buhlmann: DecompressionAlgorithmBuhlmannSettings
     vpm: DecompressionAlgorithmVpmSettings
 
 
 @dataclass(frozen=True)
-class DiveDecompressionSettings:
+class DiveDecompressionSettings(_FrozenSlots):
+    __slots__ = (
+        'decostop_depth_1',
+        'decostop_depth_2',
+        'decostop_step_1',
+        'decostop_step_2',
+        'decostop_step_3',
+    )
+
     decostop_depth_1: float
     decostop_depth_2: float
     decostop_step_1: int
@@ -102,7 +146,46 @@ class DiveDecompressionSettings:
 
 
 @dataclass(frozen=True)
-class DiveSample:
+class DiveSample(_FrozenSlots):
+    __slots__ = (
+        'battery_voltage',
+        'runtime_seconds',
+        'depth',
+        'temperature',
+        'active_mix',
+        'suggested_mix',
+        'active_algorithm',
+        'algorithm_settings',
+        'mode_oc_scr_ccr_gauge',
+        'max_ppo2_or_setpoint',
+        'first_stop_depth',
+        'first_stop_time',
+        'ndl_or_tts',
+        'otu',
+        'cns',
+        'tissue_group1_percent',
+        'tissue_group2_percent',
+        'tissue_group3_percent',
+        'tissue_group4_percent',
+        'tissue_group5_percent',
+        'tissue_group6_percent',
+        'tissue_group7_percent',
+        'tissue_group8_percent',
+        'tissue_group9_percent',
+        'tissue_group10_percent',
+        'tissue_group11_percent',
+        'tissue_group12_percent',
+        'tissue_group13_percent',
+        'tissue_group14_percent',
+        'tissue_group15_percent',
+        'tissue_group16_percent',
+        'enabled_mix_sensors',
+        'set_point_mode',
+        'tank_pressure',
+        'compass_log',
+        'reserved_2',
+    )
+
     battery_voltage: float
     runtime_seconds: int
     depth: float
@@ -142,7 +225,38 @@ class DiveSample:
 
 
 @dataclass(frozen=True)
-class Dive:
+class Dive(_FrozenSlots):
+    __slots__ = (
+        'active_user',
+        'dive_sample_count',
+        'monotonic_time',
+        'utc_starting_time',
+        'surface_pressure',
+        'last_surface_time',
+        'desaturation_time',
+        'depth_max',
+        'decompression_settings',
+        'deep_stop_algorithm',
+        'safety_stop_depth',
+        'safety_stop_time',
+        'dive_mode',
+        'water',
+        'alarms_general',
+        'alarm_time',
+        'alarm_depth',
+        'backlight_level',
+        'backlight_mode',
+        'software_version',
+        'alert_flag',
+        'free_user_settings',
+        'timezone_id',
+        'avg_depth',
+        'dum_6',
+        'dum_7',
+        'dum_8',
+        'samples',
+    )
+
     active_user: int
     dive_sample_count: int
     monotonic_time: int
@@ -170,4 +284,8 @@ class Dive:
     dum_6: int
     dum_7: int
     dum_8: int
-    samples: List[DiveSample]
+    samples: MutableSequence[DiveSample]
+
+    @property
+    def starting_time(self) -> datetime:
+        return device_time_to_datetime(self.utc_starting_time)
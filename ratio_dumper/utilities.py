@@ -23,23 +23,78 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
+import importlib
 import logging
-from xml.dom import minidom
-from xml.etree import ElementTree
-from xml.etree.cElementTree import Element, SubElement
+from io import StringIO
+from functools import cached_property
+from itertools import chain
+from types import ModuleType
+from typing import Callable, Iterable, List, Optional, TextIO, Tuple, Union
 
-from crcmod.predefined import mkCrcFun  # type: ignore
-
-from .models import Dive
+from .models import Dive, DiveSample
 
 logger: logging.Logger = logging.getLogger(__name__)
 
 
+CrcFunction = Callable[[Union[bytes, bytearray, memoryview], int], int]
+
+
+class CrcEngine:
+    '''A CRC function, built on first use and reused for every frame.'''
+    crc_name: str
+
+    def __init__(self, crc_name: str = 'crc-ccitt-false') -> None:
+        self.crc_name = crc_name
+
+    # crcmod is only imported once a CRC is needed, cached_property then stores
+    # the results as plain instance attributes
+    @cached_property
+    def _crc_function(self) -> CrcFunction:
+        from crcmod.predefined import mkCrcFun  # type: ignore
+        crc_function: CrcFunction = mkCrcFun(self.crc_name)
+        return crc_function
+
+    @cached_property
+    def initial(self) -> int:
+        from crcmod.predefined import PredefinedCrc
+        return int(PredefinedCrc(self.crc_name).initCrc)
+
+    def calculate(self,
+                  data: Union[bytes, bytearray, memoryview],
+                  crc: Optional[int] = None) -> int:
+        '''Calculate the CRC for data, continuing from a previous CRC if provided.'''
+        return int(self._crc_function(data, self.initial if crc is None else crc))
+
+    def verify(self, frame: Union[bytes, bytearray, memoryview]) -> bool:
+        '''Verify a frame that ends with its 2 byte CRC.'''
+        if len(frame) < 2:
+            return False
+        return self.calculate(frame[:-2]) == CrcHelper.decode(frame[-2], frame[-1])
+
+    def verify_frames(self, frames: Iterable[Union[bytes, bytearray, memoryview]]) -> List[bool]:
+        '''Verify many frames, each ending with its 2 byte CRC.'''
+        crc_function, initial = self._crc_function, self.initial
+        return [len(frame) >= 2 and
+                crc_function(frame[:-2], initial) == ((frame[-2] << 8) | frame[-1])
+                for frame in frames]
+
+
+CRC_ENGINE = CrcEngine()
+
+
+def import_optional(name: str, extra: str) -> ModuleType:
+    '''Import an optional dependency, explaining which extra provides it when missing.'''
+    try:
+        return importlib.import_module(name)
+    except ImportError as e:
+        raise ImportError(f'{name} is required for this, install ratio_dumper[{extra}]') from e
+
+
 class CrcHelper:
     @staticmethod
     def calculate(payload: bytes) -> int:
         '''Calculate the CRC for a payload in bytes.'''
-        return int(mkCrcFun('crc-ccitt-false')(payload))
+        return CRC_ENGINE.calculate(payload)
 
     @staticmethod
     def encode(crc: int) -> str:
@@ -102,119 +157,138 @@ class ByteConverter:
                 (data[0] & 255))
 
 
-def convert_to_xml(dive: Dive) -> str:
-    diveSegment = Element("diveSegment", version="1.1")
-
-    segmentHeader = SubElement(diveSegment, "segmentHeader")
-    SubElement(segmentHeader, 'equipmentType').text = '100'
-    SubElement(segmentHeader, 'activeUser').text = str(dive.active_user)
-    SubElement(segmentHeader, 'diveSamples').text = str(dive.dive_sample_count)
-    SubElement(segmentHeader, 'monotonicTimeS').text = str(dive.monotonic_time)
-    SubElement(segmentHeader, 'UTCStartingTimeS').text = str(dive.utc_starting_time)
-    SubElement(segmentHeader, 'surfacePressureMbar').text = str(dive.surface_pressure)
-    SubElement(segmentHeader, 'lastSurfaceTimeS').text = str(
-        dive.last_surface_time
-        if dive.last_surface_time < dive.utc_starting_time else
-        -1
-    )
-    SubElement(segmentHeader, 'desaturationTimeS').text = str(dive.desaturation_time)
-    SubElement(segmentHeader, 'depthMax').text = str(int(dive.depth_max * 100))
-    SubElement(segmentHeader, 'decostopDepth1Dm').text = str(
-        int(dive.decompression_settings.decostop_depth_1 * 100)
-    )
-    SubElement(segmentHeader, 'decostopDepth2Dm').text = str(
-        int(dive.decompression_settings.decostop_depth_2 * 100)
-    )
-    SubElement(segmentHeader, 'decostopStep1Dm').text = str(
-        dive.decompression_settings.decostop_step_1
-    )
-    SubElement(segmentHeader, 'decostopStep2Dm').text = str(
-        dive.decompression_settings.decostop_step_2
-    )
-    SubElement(segmentHeader, 'decostopStep3Dm').text = str(
-        dive.decompression_settings.decostop_step_3
-    )
-    SubElement(segmentHeader, 'deepStopAlg').text = str(dive.deep_stop_algorithm)
-    SubElement(segmentHeader, 'safetyStopDepthDm').text = str(int(dive.safety_stop_depth * 100))
-    SubElement(segmentHeader, 'safetyStopMin').text = str(dive.safety_stop_time)
-    SubElement(segmentHeader, 'diveMode').text = str(dive.dive_mode.value)
-    SubElement(segmentHeader, 'water').text = str(dive.water.value)
-    SubElement(segmentHeader, 'alarmsGeneral').text = str(dive.alarms_general)
-    SubElement(segmentHeader, 'alarmTime').text = str(dive.alarm_time)
-    SubElement(segmentHeader, 'alarmDepth').text = str(int(dive.alarm_depth * 100))
-    SubElement(segmentHeader, 'backlightLevel').text = str(dive.backlight_level)
-    SubElement(segmentHeader, 'backlightMode').text = str(dive.backlight_mode)
-    SubElement(segmentHeader, 'softwareVersion').text = str(dive.software_version.as_numeric)
-    SubElement(segmentHeader, 'alertFlag').text = str(dive.alert_flag)
-    SubElement(segmentHeader, 'freeUserSettings').text = str(dive.free_user_settings)
-    SubElement(segmentHeader, 'timezoneIdx').text = str(dive.timezone_id)
-    SubElement(segmentHeader, 'avgDepth').text = str(int(dive.avg_depth * 100))
-    SubElement(segmentHeader, 'dum6').text = str(dive.dum_6)
-    SubElement(segmentHeader, 'dum7').text = str(dive.dum_7)
-    SubElement(segmentHeader, 'dum8').text = str(dive.dum_8)
-
-    samples = SubElement(diveSegment, "samples")
-
-    for sample in dive.samples:
-        diveSample = SubElement(samples, "sample")
-        SubElement(diveSample, 'vbatCV').text = str(int(sample.battery_voltage * 100))
-        SubElement(diveSample, 'runtimeS').text = str(sample.runtime_seconds)
-        SubElement(diveSample, 'depthDm').text = str(int(sample.depth * 10))
-        SubElement(diveSample, 'temperatureDc').text = str(int(sample.temperature * 10))
-        SubElement(diveSample, 'activeMixO2Percent').text = str(
-            sample.active_mix.o2_percentage
-        )
-        SubElement(diveSample, 'activeMixHePercent').text = str(
-            sample.active_mix.he_percentage
-        )
-        SubElement(diveSample, 'suggestedMixO2Percent').text = str(
-            sample.suggested_mix.o2_percentage
-        )
-        SubElement(diveSample, 'suggestedMixHePercent').text = str(
-            sample.suggested_mix.he_percentage
-        )
-        SubElement(diveSample, 'activeAlgorithm').text = str(sample.active_algorithm.value)
-        SubElement(diveSample, 'buhlGfHigh').text = str(
-            sample.algorithm_settings.buhlmann.gradient_factor_high
-        )
-        SubElement(diveSample, 'buhlGfLow').text = str(
-            sample.algorithm_settings.buhlmann.gradient_factor_low
-        )
-        SubElement(diveSample, 'vpmR0').text = str(sample.algorithm_settings.vpm.r0)
-        SubElement(diveSample, 'modeOCSCRCCRGauge').text = str(sample.mode_oc_scr_ccr_gauge)
-        SubElement(diveSample, 'maxPPO2OrSetpoint').text = str(
-            int(sample.max_ppo2_or_setpoint * 1000)
-        )
-        SubElement(diveSample, 'firstStopDepth').text = str(int(sample.first_stop_depth * 10))
-        SubElement(diveSample, 'firstStopTime').text = str(sample.first_stop_time)
-        SubElement(diveSample, 'NDLOrTTS').text = str(sample.ndl_or_tts)
-        SubElement(diveSample, 'OTU').text = str(sample.otu)
-        SubElement(diveSample, 'CNS').text = str(sample.cns)
-        SubElement(diveSample, 'tissueGroup1Percent').text = str(sample.tissue_group1_percent)
-        SubElement(diveSample, 'tissueGroup2Percent').text = str(sample.tissue_group2_percent)
-        SubElement(diveSample, 'tissueGroup3Percent').text = str(sample.tissue_group3_percent)
-        SubElement(diveSample, 'tissueGroup4Percent').text = str(sample.tissue_group4_percent)
-        SubElement(diveSample, 'tissueGroup5Percent').text = str(sample.tissue_group5_percent)
-        SubElement(diveSample, 'tissueGroup6Percent').text = str(sample.tissue_group6_percent)
-        SubElement(diveSample, 'tissueGroup7Percent').text = str(sample.tissue_group7_percent)
-        SubElement(diveSample, 'tissueGroup8Percent').text = str(sample.tissue_group8_percent)
-        SubElement(diveSample, 'tissueGroup9Percent').text = str(sample.tissue_group9_percent)
-        SubElement(diveSample, 'tissueGroup10Percent').text = str(sample.tissue_group10_percent)
-        SubElement(diveSample, 'tissueGroup11Percent').text = str(sample.tissue_group11_percent)
-        SubElement(diveSample, 'tissueGroup12Percent').text = str(sample.tissue_group12_percent)
-        SubElement(diveSample, 'tissueGroup13Percent').text = str(sample.tissue_group13_percent)
-        SubElement(diveSample, 'tissueGroup14Percent').text = str(sample.tissue_group14_percent)
-        SubElement(diveSample, 'tissueGroup15Percent').text = str(sample.tissue_group15_percent)
-        SubElement(diveSample, 'tissueGroup16Percent').text = str(sample.tissue_group16_percent)
-        SubElement(diveSample, 'enabledMixSensors').text = str(sample.enabled_mix_sensors)
-        SubElement(diveSample, 'setPointMode').text = str(sample.set_point_mode)
-        SubElement(diveSample, 'tankPressure').text = str(sample.tank_pressure)
-        SubElement(diveSample, 'compassLog').text = str(sample.compass_log)
-        SubElement(diveSample, 'reserved2').text = str(sample.reserved_2)
-
-    # Export out the tree as a string
-    xmlString = ElementTree.tostring(diveSegment, encoding='utf-8')
-
-    # Re-format our string to be pretty
-    return str(minidom.parseString(xmlString).toprettyxml(encoding='UTF-8',
-                                                          indent='    ').decode().strip())
+# XML elements in document order, with the (scaled integer) value written for each
+DIVE_XML_FIELDS: Tuple[Tuple[str, Callable[[Dive], int]], ...] = (
+    ('equipmentType', lambda dive: 100),
+    ('activeUser', lambda dive: dive.active_user),
+    ('diveSamples', lambda dive: dive.dive_sample_count),
+    ('monotonicTimeS', lambda dive: dive.monotonic_time),
+    ('UTCStartingTimeS', lambda dive: dive.utc_starting_time),
+    ('surfacePressureMbar', lambda dive: dive.surface_pressure),
+    ('lastSurfaceTimeS', lambda dive: (dive.last_surface_time
+                                       if dive.last_surface_time < dive.utc_starting_time else
+                                       -1)),
+    ('desaturationTimeS', lambda dive: dive.desaturation_time),
+    ('depthMax', lambda dive: int(dive.depth_max * 100)),
+    ('decostopDepth1Dm', lambda dive: int(dive.decompression_settings.decostop_depth_1 * 100)),
+    ('decostopDepth2Dm', lambda dive: int(dive.decompression_settings.decostop_depth_2 * 100)),
+    ('decostopStep1Dm', lambda dive: dive.decompression_settings.decostop_step_1),
+    ('decostopStep2Dm', lambda dive: dive.decompression_settings.decostop_step_2),
+    ('decostopStep3Dm', lambda dive: dive.decompression_settings.decostop_step_3),
+    ('deepStopAlg', lambda dive: dive.deep_stop_algorithm),
+    ('safetyStopDepthDm', lambda dive: int(dive.safety_stop_depth * 100)),
+    ('safetyStopMin', lambda dive: dive.safety_stop_time),
+    ('diveMode', lambda dive: dive.dive_mode.value),
+    ('water', lambda dive: dive.water.value),
+    ('alarmsGeneral', lambda dive: dive.alarms_general),
+    ('alarmTime', lambda dive: dive.alarm_time),
+    ('alarmDepth', lambda dive: int(dive.alarm_depth * 100)),
+    ('backlightLevel', lambda dive: dive.backlight_level),
+    ('backlightMode', lambda dive: dive.backlight_mode),
+    ('softwareVersion', lambda dive: dive.software_version.as_numeric),
+    ('alertFlag', lambda dive: dive.alert_flag),
+    ('freeUserSettings', lambda dive: dive.free_user_settings),
+    ('timezoneIdx', lambda dive: dive.timezone_id),
+    ('avgDepth', lambda dive: int(dive.avg_depth * 100)),
+    ('dum6', lambda dive: dive.dum_6),
+    ('dum7', lambda dive: dive.dum_7),
+    ('dum8', lambda dive: dive.dum_8),
+)
+
+SAMPLE_XML_FIELDS: Tuple[Tuple[str, Callable[[DiveSample], int]], ...] = (
+    ('vbatCV', lambda sample: int(sample.battery_voltage * 100)),
+    ('runtimeS', lambda sample: sample.runtime_seconds),
+    ('depthDm', lambda sample: int(sample.depth * 10)),
+    ('temperatureDc', lambda sample: int(sample.temperature * 10)),
+    ('activeMixO2Percent', lambda sample: sample.active_mix.o2_percentage),
+    ('activeMixHePercent', lambda sample: sample.active_mix.he_percentage),
+    ('suggestedMixO2Percent', lambda sample: sample.suggested_mix.o2_percentage),
+    ('suggestedMixHePercent', lambda sample: sample.suggested_mix.he_percentage),
+    ('activeAlgorithm', lambda sample: sample.active_algorithm.value),
+    ('buhlGfHigh', lambda sample: sample.algorithm_settings.buhlmann.gradient_factor_high),
+    ('buhlGfLow', lambda sample: sample.algorithm_settings.buhlmann.gradient_factor_low),
+    ('vpmR0', lambda sample: sample.algorithm_settings.vpm.r0),
+    ('modeOCSCRCCRGauge', lambda sample: sample.mode_oc_scr_ccr_gauge),
+    ('maxPPO2OrSetpoint', lambda sample: int(sample.max_ppo2_or_setpoint * 1000)),
+    ('firstStopDepth', lambda sample: int(sample.first_stop_depth * 10)),
+    ('firstStopTime', lambda sample: sample.first_stop_time),
+    ('NDLOrTTS', lambda sample: sample.ndl_or_tts),
+    ('OTU', lambda sample: sample.otu),
+    ('CNS', lambda sample: sample.cns),
+    ('tissueGroup1Percent', lambda sample: sample.tissue_group1_percent),
+    ('tissueGroup2Percent', lambda sample: sample.tissue_group2_percent),
+    ('tissueGroup3Percent', lambda sample: sample.tissue_group3_percent),
+    ('tissueGroup4Percent', lambda sample: sample.tissue_group4_percent),
+    ('tissueGroup5Percent', lambda sample: sample.tissue_group5_percent),
+    ('tissueGroup6Percent', lambda sample: sample.tissue_group6_percent),
+    ('tissueGroup7Percent', lambda sample: sample.tissue_group7_percent),
+    ('tissueGroup8Percent', lambda sample: sample.tissue_group8_percent),
+    ('tissueGroup9Percent', lambda sample: sample.tissue_group9_percent),
+    ('tissueGroup10Percent', lambda sample: sample.tissue_group10_percent),
+    ('tissueGroup11Percent', lambda sample: sample.tissue_group11_percent),
+    ('tissueGroup12Percent', lambda sample: sample.tissue_group12_percent),
+    ('tissueGroup13Percent', lambda sample: sample.tissue_group13_percent),
+    ('tissueGroup14Percent', lambda sample: sample.tissue_group14_percent),
+    ('tissueGroup15Percent', lambda sample: sample.tissue_group15_percent),
+    ('tissueGroup16Percent', lambda sample: sample.tissue_group16_percent),
+    ('enabledMixSensors', lambda sample: sample.enabled_mix_sensors),
+    ('setPointMode', lambda sample: sample.set_point_mode),
+    ('tankPressure', lambda sample: sample.tank_pressure),
+    ('compassLog', lambda sample: sample.compass_log),
+    ('reserved2', lambda sample: sample.reserved_2),
+)
+
+
+def _xml_template(tag: str, field_tags: Iterable[str], indent: str, depth: int) -> str:
+    '''Build a str.format template for an element holding one child element per field.'''
+    newline = '\n' if indent else ''
+    children = ''.join(f'{indent * (depth + 1)}<{field_tag}>{{}}</{field_tag}>{newline}'
+                       for field_tag in field_tags)
+    return f'{indent * depth}<{tag}>{newline}{children}{indent * depth}</{tag}>{newline}'
+
+
+def write_xml(dive: Dive,
+              fh: TextIO,
+              indent: Optional[str] = '    ',
+              samples: Optional[Iterable[DiveSample]] = None) -> None:
+    '''Stream a dive as a diveSegment document to a text file in a single pass.
+
+    With the default indent the output matches the (stripped) minidom pretty
+    printed form, passing None writes the document without any whitespace.
+    Samples are taken from `samples` instead of the dive when given, e.g. from
+    SerialDriver.iter_dive_samples, and written as they are produced.
+    '''
+    indent = indent or ''
+    newline = '\n' if indent else ''
+
+    header_template = _xml_template('segmentHeader', (tag for tag, _ in DIVE_XML_FIELDS),
+                                    indent, 1)
+    sample_template = _xml_template('sample', (tag for tag, _ in SAMPLE_XML_FIELDS),
+                                    indent, 2)
+    sample_getters = tuple(getter for _, getter in SAMPLE_XML_FIELDS)
+
+    fh.write(f'<?xml version="1.0" encoding="UTF-8"?>{newline}')
+    fh.write(f'<diveSegment version="1.1">{newline}')
+    fh.write(header_template.format(*(getter(dive) for _, getter in DIVE_XML_FIELDS)))
+
+    # Look at the first sample up front, an empty dive is written as a single element
+    sample_iterator = iter(dive.samples if samples is None else samples)
+    first_sample = next(sample_iterator, None)
+    if first_sample is None:
+        fh.write(f'{indent}<samples/>{newline}')
+    else:
+        fh.write(f'{indent}<samples>{newline}')
+        for sample in chain((first_sample,), sample_iterator):
+            fh.write(sample_template.format(*[getter(sample) for getter in sample_getters]))
+        fh.write(f'{indent}</samples>{newline}')
+
+    fh.write('</diveSegment>')
+
+
+def convert_to_xml(dive: Dive,
+                   indent: Optional[str] = '    ',
+                   samples: Optional[Iterable[DiveSample]] = None) -> str:
+    '''Convert a dive into a diveSegment document.'''
+    output = StringIO()
+    write_xml(dive, output, indent, samples)
+    return output.getvalue()
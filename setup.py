@@ -48,9 +48,14 @@ setup(
     test_suite='tests',
     platforms='any',
     install_requires=install_requires,
+    extras_require={
+        'numpy': ['numpy'],
+        'arrow': ['pyarrow'],
+    },
     entry_points={
         'console_scripts': [
-            'ratio-dumper=ratio_dumper.cli:cli'
+            'ratio-dumper=ratio_dumper.cli:cli',
+            'ratio-dumper-emulator=ratio_dumper.emulator:main',
         ],
     },
     classifiers=[
@@ -0,0 +1,82 @@
+'''
+ratio_dumper - Ratio iX5M Log Dumper
+
+MIT License
+
+Copyright (c) 2021 Damian Zaremba
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import json
+from dataclasses import replace
+from pathlib import Path
+
+import pytest
+
+from ratio_dumper import SerialDriver
+from tests.utilities import MockSerialIO
+
+pytest.importorskip('numpy')
+
+from ratio_dumper.analytics import analyse_dive, analyse_dives  # noqa: E402
+
+
+def _load_dive(dive_id: int):
+    with (Path(__file__).parent / 'data' / f'dive_{dive_id}.json').open('r') as fh:
+        sd = SerialDriver(None)
+        sd._serial = MockSerialIO(json.loads(fh.read()))
+        return sd.get_dive(dive_id)
+
+
+def test_analyse_dives_matches_samples():
+    dive_1, dive_4 = _load_dive(1), _load_dive(4)
+    empty_dive = replace(dive_1, samples=[])
+
+    statistics = analyse_dives([(1, dive_1), (2, empty_dive), (4, dive_4)])
+    assert [dive.dive_id for dive in statistics] == [1, 2, 4]
+    assert statistics[1].sample_count == 0
+
+    dive = statistics[2]
+    samples = dive_4.samples
+    assert dive.duration == samples[-1].runtime_seconds
+    assert dive.max_depth == max(sample.depth for sample in samples)
+    assert dive.min_temperature == min(sample.temperature for sample in samples)
+    assert dive.max_ascent_rate == pytest.approx(max(
+        (previous.depth - sample.depth) * 60 / (sample.runtime_seconds - previous.runtime_seconds)
+        for previous, sample in zip(samples, samples[1:])))
+    assert sum(dive.time_at_depth) == samples[-1].runtime_seconds
+    assert dive.tissue_group_maxima[15] == max(sample.tissue_group16_percent for sample in samples)
+    assert dive.header_consistent()
+
+
+def test_header_mismatch_is_reported():
+    dive = _load_dive(1)
+    assert analyse_dive(dive).header_consistent()
+    assert not analyse_dive(replace(dive, depth_max=dive.depth_max + 5)).header_consistent()
+
+
+def test_dives_with_few_samples_have_consistent_statistics():
+    dive_1 = _load_dive(1)
+    reference = analyse_dive(dive_1)
+
+    for samples in ([], dive_1.samples[:1]):
+        dive = analyse_dive(replace(dive_1, samples=samples))
+        assert len(dive.tissue_group_maxima) == len(reference.tissue_group_maxima)
+        assert all(isinstance(seconds, float) for seconds in dive.time_at_depth)
+        assert str(dive.max_ascent_rate) == str(dive.max_descent_rate) == '0.0'
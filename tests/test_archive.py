@@ -0,0 +1,89 @@
+'''
+ratio_dumper - Ratio iX5M Log Dumper
+
+MIT License
+
+Copyright (c) 2021 Damian Zaremba
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import json
+from pathlib import Path
+
+from ratio_dumper import SerialDriver
+from ratio_dumper.archive import DiveArchive
+from ratio_dumper.decoders import dive_header_to_values
+from tests.utilities import MockSerialIO
+
+
+def _load_dive(name: str, dive_id: int):
+    with (Path(__file__).parent / 'data' / name).open('r') as fh:
+        sd = SerialDriver(None)
+        sd._serial = MockSerialIO(json.loads(fh.read()))
+        return sd.get_dive(dive_id)
+
+
+def test_archive_round_trip(tmp_path):
+    dive_1, dive_4 = _load_dive('dive_1.json', 1), _load_dive('dive_4.json', 4)
+
+    with DiveArchive(tmp_path / 'logbook.rda') as archive:
+        assert archive.extend([(1, dive_1), (4, dive_4)]) == 2
+
+    with DiveArchive(tmp_path / 'logbook.rda', readonly=True) as archive:
+        assert [entry.dive_id for entry in archive] == [1, 4]
+        assert dive_1 in archive
+
+        archived_dive = archive.get(4)
+        assert dive_header_to_values(archived_dive) == dive_header_to_values(dive_4)
+        assert archived_dive.samples == dive_4.samples
+
+        depths = {entry.dive_id: column for entry, column in archive.iter_column('depth')}
+        assert list(depths[1]) == [round(sample.depth * 10) for sample in dive_1.samples]
+
+
+def test_archive_appends_without_rewriting(tmp_path):
+    dive_1, dive_4 = _load_dive('dive_1.json', 1), _load_dive('dive_4.json', 4)
+
+    with DiveArchive(tmp_path / 'logbook.rda') as archive:
+        archive.append(1, dive_1)
+    first_record = (tmp_path / 'logbook.rda').read_bytes()[:archive.entries[0].offset + 1024]
+
+    with DiveArchive(tmp_path / 'logbook.rda') as archive:
+        assert not archive.append(1, dive_1)
+        assert archive.append(4, dive_4)
+    assert (tmp_path / 'logbook.rda').read_bytes().startswith(first_record)
+
+
+def test_archive_recovers_a_damaged_index(tmp_path):
+    dive_1, dive_4 = _load_dive('dive_1.json', 1), _load_dive('dive_4.json', 4)
+
+    with DiveArchive(tmp_path / 'logbook.rda') as archive:
+        archive.append(1, dive_1)
+
+    # An append interrupted before the index was written
+    data = (tmp_path / 'logbook.rda').read_bytes()
+    (tmp_path / 'logbook.rda').write_bytes(data[:-7])
+
+    with DiveArchive(tmp_path / 'logbook.rda') as archive:
+        assert [entry.dive_id for entry in archive] == [1]
+        assert archive.append(4, dive_4)
+
+    with DiveArchive(tmp_path / 'logbook.rda') as archive:
+        assert [entry.dive_id for entry in archive] == [1, 4]
+        assert archive.get(1).samples == dive_1.samples
@@ -0,0 +1,178 @@
+'''
+ratio_dumper - Ratio iX5M Log Dumper
+
+MIT License
+
+Copyright (c) 2021 Damian Zaremba
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import asyncio
+import json
+import time
+from pathlib import Path
+
+import pytest
+
+from ratio_dumper import AsyncSerialDriver, SerialDriver
+from ratio_dumper.cache import FrameCache
+from ratio_dumper.utilities import CrcHelper
+from tests.utilities import FlakySerialIO, LatencySerialIO, MockSerialIO
+
+
+def _load_mock_responses(name: str) -> dict:
+    with (Path(__file__).parent / 'data' / name).open('r') as fh:
+        return json.loads(fh.read())
+
+
+def test_async_get_dive():
+    mock_responses = _load_mock_responses('dive_1.json')
+    sd = SerialDriver(None)
+    sd._serial = MockSerialIO(mock_responses)
+    dive = sd.get_dive(1)
+
+    async def fetch():
+        async with AsyncSerialDriver(None, pipeline_window=4) as ad:
+            ad._driver._serial = MockSerialIO(mock_responses)
+            samples = [sample async for sample in ad.iter_dive_samples(1)]
+            return samples, await ad.get_dive(1)
+
+    samples, async_dive = asyncio.run(fetch())
+    assert samples == dive.samples
+    assert async_dive.samples == dive.samples
+
+
+def test_async_request_timeout():
+    mock_responses = _load_mock_responses('dive_1.json')
+
+    async def fetch():
+        ad = AsyncSerialDriver(None, timeout=0.05)
+        ad._driver._serial = LatencySerialIO(mock_responses, latency=0.2)
+        try:
+            await ad.get_dive(1)
+        finally:
+            await ad.close()
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(fetch())
+
+
+def test_async_transfer_retries_and_resumes(tmp_path):
+    mock_responses = _load_mock_responses('dive_1.json')
+    frame_cache = FrameCache(tmp_path)
+    nak_frame = bytes.fromhex('55037a0115')
+    nak_frame += bytes.fromhex(CrcHelper.encode(CrcHelper.calculate(nak_frame)))
+    failed_request = SerialDriver(None)._encode_sample_request(5).hex()
+
+    async def fetch(serial, sample_retries=0):
+        async with AsyncSerialDriver(None, frame_cache=frame_cache,
+                                     sample_retries=sample_retries) as ad:
+            ad._driver._serial = serial
+            return await ad.get_dive(1)
+
+    # A failed transfer leaves a checkpoint, the next one only requests the missing samples
+    failing_serial = MockSerialIO({**mock_responses, failed_request: nak_frame.hex()})
+    assert asyncio.run(fetch(failing_serial)) is None
+    assert [path.name.endswith('.partial.frames') for path in tmp_path.glob('*.frames')] == [True]
+    serial = MockSerialIO(mock_responses)
+    dive = asyncio.run(fetch(serial))
+    assert serial.requests[1] == failed_request
+    assert len(serial.requests) == 1 + dive.dive_sample_count - 4
+
+    # A retried sample succeeds on the second attempt
+    for path in tmp_path.glob('*.frames'):
+        path.unlink()
+    retried_dive = asyncio.run(fetch(FlakySerialIO(mock_responses,
+                                                   {failed_request: nak_frame.hex()}), 1))
+    assert retried_dive.samples == dive.samples
+
+
+def test_async_retry_backoff_is_not_a_timeout():
+    mock_responses = _load_mock_responses('dive_1.json')
+    nak_frame = bytes.fromhex('55037a0115')
+    nak_frame += bytes.fromhex(CrcHelper.encode(CrcHelper.calculate(nak_frame)))
+    failed_request = SerialDriver(None)._encode_sample_request(5).hex()
+
+    async def fetch():
+        # The backoff before the retry takes longer than any single reply may
+        async with AsyncSerialDriver(None, timeout=0.05, sample_retries=1,
+                                     retry_delay=0.2) as ad:
+            ad._driver._serial = FlakySerialIO(mock_responses, {failed_request: nak_frame.hex()})
+            return await ad.get_dive(1)
+
+    dive = asyncio.run(fetch())
+    assert dive is not None
+    assert len(dive.samples) == dive.dive_sample_count
+
+
+class SlowSampleSerialIO(MockSerialIO):
+    '''MockSerialIO that answers headers at once and sample requests after a delay.'''
+
+    def __init__(self, mock_responses, delay):
+        super().__init__(mock_responses)
+        self.delay = delay
+
+    def read(self, size=1):
+        if self.requests and self.requests[-1][4:6] == '7a':
+            time.sleep(self.delay)
+        return super().read(size)
+
+
+def test_async_sample_request_timeout():
+    mock_responses = _load_mock_responses('dive_1.json')
+
+    async def fetch():
+        ad = AsyncSerialDriver(None, timeout=0.05)
+        ad._driver._serial = SlowSampleSerialIO(mock_responses, delay=0.2)
+        try:
+            await ad.get_dive(1)
+        finally:
+            await ad.close()
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(fetch())
+
+
+def test_async_drivers_run_concurrently():
+    mock_responses = _load_mock_responses('dive_1.json')
+
+    async def fetch():
+        ad = AsyncSerialDriver(None)
+        ad._driver._serial = LatencySerialIO(mock_responses, latency=0.01)
+        async with ad:
+            return await ad.get_dive_header(1)
+
+    async def fetch_all():
+        # The event loop keeps running while both devices wait on their links
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.001)
+
+        ticker_task = asyncio.create_task(ticker())
+        headers = await asyncio.gather(fetch(), fetch())
+        ticker_task.cancel()
+        return headers, ticks
+
+    headers, ticks = asyncio.run(fetch_all())
+    assert [header.dive_sample_count for header in headers] == [29, 29]
+    assert ticks > 5
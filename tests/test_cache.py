@@ -0,0 +1,151 @@
+'''
+ratio_dumper - Ratio iX5M Log Dumper
+
+MIT License
+
+Copyright (c) 2021 Damian Zaremba
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import json
+import os
+from pathlib import Path
+
+from ratio_dumper import SerialDriver
+from ratio_dumper.cache import FrameCache
+from ratio_dumper.utilities import CrcHelper
+from tests.utilities import MockSerialIO
+
+
+def _load_mock_responses(name: str) -> dict:
+    with (Path(__file__).parent / 'data' / name).open('r') as fh:
+        return json.loads(fh.read())
+
+
+def test_cached_dive_decodes_from_header_only(tmp_path):
+    mock_responses = _load_mock_responses('dive_1.json')
+    frame_cache = FrameCache(tmp_path)
+
+    sd = SerialDriver(None, frame_cache=frame_cache)
+    sd._serial = MockSerialIO(mock_responses)
+    dive = sd.get_dive(1)
+    assert len(list(tmp_path.glob('*.frames'))) == 1
+
+    # Only the header request is answered, every sample has to come from the cache
+    sd = SerialDriver(None, frame_cache=frame_cache)
+    sd._serial = MockSerialIO({'5503790100c91d': mock_responses['5503790100c91d']})
+    cached_dive = sd.get_dive(1)
+
+    assert cached_dive is not None
+    assert cached_dive.samples == dive.samples
+
+
+def test_corrupt_cache_entry_is_discarded(tmp_path):
+    mock_responses = _load_mock_responses('dive_1.json')
+    frame_cache = FrameCache(tmp_path)
+
+    sd = SerialDriver(None, frame_cache=frame_cache)
+    sd._serial = MockSerialIO(mock_responses)
+    dive = sd.get_dive(1)
+
+    cache_entry = next(tmp_path.glob('*.frames'))
+    data = bytearray(cache_entry.read_bytes())
+    data[100] ^= 0xff
+    cache_entry.write_bytes(bytes(data))
+
+    assert frame_cache.load(1, dive.monotonic_time, dive.utc_starting_time) is None
+    assert not cache_entry.exists()
+
+
+def test_entry_evicted_while_loading_is_a_miss(tmp_path, monkeypatch):
+    mock_responses = _load_mock_responses('dive_1.json')
+    frame_cache = FrameCache(tmp_path)
+    sd = SerialDriver(None, frame_cache=frame_cache)
+    sd._serial = MockSerialIO(mock_responses)
+    dive = sd.get_dive(1)
+
+    # Another process evicts the entry between reading it and marking it as used
+    utime = os.utime
+
+    def evict_then_utime(path, *args, **kwargs):
+        os.unlink(path)
+        return utime(path, *args, **kwargs)
+
+    monkeypatch.setattr(os, 'utime', evict_then_utime)
+    assert frame_cache.load(1, dive.monotonic_time, dive.utc_starting_time) is None
+
+
+def test_cache_eviction(tmp_path):
+    frame_cache = FrameCache(tmp_path, max_bytes=10000)
+    for dive_id, fixture in ((1, 'dive_1.json'), (4, 'dive_4.json')):
+        sd = SerialDriver(None, frame_cache=frame_cache)
+        sd._serial = MockSerialIO(_load_mock_responses(fixture))
+        assert sd.get_dive(dive_id) is not None
+
+    # Both entries exceed the budget, only the most recent one is kept
+    assert [path.name.split('-')[1] for path in tmp_path.glob('*.frames')] == ['4']
+
+
+def test_failed_transfer_resumes_from_checkpoint(tmp_path):
+    mock_responses = _load_mock_responses('dive_1.json')
+    frame_cache = FrameCache(tmp_path)
+
+    sd = SerialDriver(None, frame_cache=frame_cache)
+    nak_frame = bytes.fromhex('55037a0115')
+    nak_frame += bytes.fromhex(CrcHelper.encode(CrcHelper.calculate(nak_frame)))
+    failed_request = sd._encode_sample_request(5).hex()
+    sd._serial = MockSerialIO({**mock_responses, failed_request: nak_frame.hex()})
+    assert sd.get_dive(1) is None
+    assert [path.name.endswith('.partial.frames') for path in tmp_path.glob('*.frames')] == [True]
+
+    # The next session only requests the header and the samples after the checkpoint
+    sd = SerialDriver(None, frame_cache=frame_cache)
+    sd._serial = MockSerialIO(mock_responses)
+    dive = sd.get_dive(1)
+    assert dive is not None
+    assert sd._serial.requests[1] == failed_request
+    assert len(sd._serial.requests) == 1 + dive.dive_sample_count - 4
+
+    reference = SerialDriver(None)
+    reference._serial = MockSerialIO(mock_responses)
+    assert dive.samples == reference.get_dive(1).samples
+    assert [path.name.endswith('.partial.frames') for path in tmp_path.glob('*.frames')] == [False]
+
+
+def test_abandoned_sample_stream_is_checkpointed(tmp_path):
+    mock_responses = _load_mock_responses('dive_1.json')
+    frame_cache = FrameCache(tmp_path)
+
+    sd = SerialDriver(None, frame_cache=frame_cache)
+    sd._serial = MockSerialIO(mock_responses)
+    samples = sd.iter_dive_samples(1)
+    first_samples = [next(samples) for _ in range(10)]
+    samples.close()
+    assert [path.name.endswith('.partial.frames') for path in tmp_path.glob('*.frames')] == [True]
+
+    # Streaming the dive again only requests the samples that were not streamed yet
+    sd = SerialDriver(None, frame_cache=frame_cache)
+    sd._serial = MockSerialIO(mock_responses)
+    streamed_samples = list(sd.iter_dive_samples(1))
+    assert len(sd._serial.requests) == 1 + len(streamed_samples) - 10
+    assert streamed_samples[:10] == first_samples
+
+    reference = SerialDriver(None)
+    reference._serial = MockSerialIO(mock_responses)
+    assert streamed_samples == list(reference.get_dive(1).samples)
@@ -0,0 +1,93 @@
+'''
+ratio_dumper - Ratio iX5M Log Dumper
+
+MIT License
+
+Copyright (c) 2021 Damian Zaremba
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import json
+import time
+from pathlib import Path
+
+from ratio_dumper import SerialDriver
+from ratio_dumper.capture import RECEIVED, SENT, ReplaySerialIO, read_capture
+from tests.utilities import FlakySerialIO, LatencySerialIO, MockSerialIO
+
+DATA_PATH = Path(__file__).parent / 'data'
+
+
+def test_capture_and_replay(tmp_path):
+    with (DATA_PATH / 'dive_1.json').open('r') as fh:
+        mock_responses = json.loads(fh.read())
+
+    sd = SerialDriver(None)
+    sd._serial = MockSerialIO(mock_responses)
+    sd.start_capture(tmp_path / 'session.rdcp')
+    with sd:
+        dive = sd.get_dive(1)
+
+    records = list(read_capture(tmp_path / 'session.rdcp'))
+    assert [record.direction for record in records[:2]] == [SENT, RECEIVED]
+    assert records[0].data.hex() == sd._encode_payload(121, [1, 0]).hex()
+    capture_size = (tmp_path / 'session.rdcp').stat().st_size
+    assert capture_size < (DATA_PATH / 'dive_1.json').stat().st_size
+
+    # The session decodes to the same dive without the device
+    with SerialDriver(None, transport=ReplaySerialIO(tmp_path / 'session.rdcp')) as sd:
+        replayed_dive = sd.get_dive(1)
+    assert replayed_dive is not None
+    assert replayed_dive.samples == dive.samples
+
+
+def test_replay_of_a_retried_transfer(tmp_path, caplog):
+    with (DATA_PATH / 'dive_1.json').open('r') as fh:
+        mock_responses = json.loads(fh.read())
+
+    # Sample 5 is not answered the first time, the reply to the retry follows it in the capture
+    for pipeline_window in (1, 4):
+        sd = SerialDriver(None, pipeline_window=pipeline_window, sample_retries=1, retry_delay=0)
+        sd._serial = FlakySerialIO(mock_responses, {sd._encode_sample_request(5).hex(): ''})
+        capture_path = tmp_path / f'session-{pipeline_window}.rdcp'
+        sd.start_capture(capture_path)
+        with sd:
+            dive = sd.get_dive(1)
+
+        # The reply is not released before its request is replayed, the replay times out too
+        with SerialDriver(None, pipeline_window=pipeline_window, sample_retries=1, retry_delay=0,
+                          transport=ReplaySerialIO(capture_path)) as sd:
+            replayed_dive = sd.get_dive(1)
+        assert replayed_dive is not None
+        assert replayed_dive.samples == dive.samples
+        assert 'Replay expected request' not in caplog.text
+
+
+def test_replay_with_original_timing(tmp_path):
+    sd = SerialDriver(None)
+    sd._serial = LatencySerialIO({'5502788de20b': '55067801000400064d48'}, latency=0.05)
+    sd.start_capture(tmp_path / 'session.rdcp')
+    assert sd.get_dive_ids() == {1, 2, 3, 4}
+    sd._serial.close()
+
+    for realtime, minimum, maximum in ((False, 0.0, 0.05), (True, 0.1, 1.0)):
+        sd = SerialDriver(None, transport=ReplaySerialIO(tmp_path / 'session.rdcp', realtime))
+        started = time.monotonic()
+        assert sd.get_dive_ids() == {1, 2, 3, 4}
+        assert minimum <= time.monotonic() - started < maximum
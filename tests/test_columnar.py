@@ -0,0 +1,67 @@
+'''
+ratio_dumper - Ratio iX5M Log Dumper
+
+MIT License
+
+Copyright (c) 2021 Damian Zaremba
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import json
+from pathlib import Path
+
+from ratio_dumper import SerialDriver
+from ratio_dumper.columnar import ColumnarSamples
+from tests.utilities import MockSerialIO
+
+
+def test_get_dive_4_columnar():
+    with (Path(__file__).parent / 'data' / 'dive_4.json').open('r') as fh:
+        mock_responses = json.loads(fh.read())
+
+    sd = SerialDriver(None)
+    sd._serial = MockSerialIO(mock_responses)
+    dive = sd.get_dive(4)
+
+    sd = SerialDriver(None, columnar=True)
+    sd._serial = MockSerialIO(mock_responses)
+    columnar_dive = sd.get_dive(4)
+
+    assert isinstance(columnar_dive.samples, ColumnarSamples)
+    assert len(columnar_dive.samples) == 151
+    assert columnar_dive.samples == dive.samples
+    assert columnar_dive.samples[75] == dive.samples[75]
+    assert columnar_dive.samples[-1].battery_voltage == 3.61
+    assert list(columnar_dive.samples.column('depth')[:3]) == [20, 29, 34]
+
+
+def test_columnar_samples_mutation():
+    with (Path(__file__).parent / 'data' / 'dive_1.json').open('r') as fh:
+        sd = SerialDriver(None)
+        sd._serial = MockSerialIO(json.loads(fh.read()))
+    samples = sd.get_dive(1).samples
+
+    columnar_samples = ColumnarSamples(samples)
+    assert columnar_samples == samples
+
+    columnar_samples[0] = samples[1]
+    del columnar_samples[1]
+    columnar_samples.insert(1, samples[2])
+    assert columnar_samples[:2] == [samples[1], samples[2]]
+    assert len(columnar_samples) == len(samples)
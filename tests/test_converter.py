@@ -24,9 +24,11 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
 import json
+from io import StringIO
 from pathlib import Path
+from xml.etree import ElementTree
 
-from ratio_dumper import SerialDriver, convert_to_xml
+from ratio_dumper import SerialDriver, convert_to_xml, write_xml
 from tests.utilities import MockSerialIO
 
 
@@ -42,3 +44,44 @@ def test_sample_dive():
         expected_xml = fh.read().strip()
 
     assert generated_xml == expected_xml
+
+
+def test_write_xml_compact():
+    sd = SerialDriver(None)
+    with (Path(__file__).parent / 'data' / 'dive_1.json').open('r') as fh:
+        sd._serial = MockSerialIO(json.loads(fh.read()))
+
+    dive = sd.get_dive(1)
+
+    pretty_output, compact_output = StringIO(), StringIO()
+    write_xml(dive, pretty_output)
+    write_xml(dive, compact_output, indent=None)
+    assert pretty_output.getvalue() == convert_to_xml(dive)
+    assert '\n' not in compact_output.getvalue()
+
+    def flatten(document: str) -> list:
+        root = ElementTree.fromstring(document.encode())
+        return [(element.tag, (element.text or '').strip()) for element in root.iter()]
+
+    assert flatten(compact_output.getvalue()) == flatten(pretty_output.getvalue())
+
+
+def test_write_xml_streams_samples():
+    with (Path(__file__).parent / 'data' / 'dive_1.json').open('r') as fh:
+        mock_responses = json.loads(fh.read())
+
+    sd = SerialDriver(None)
+    sd._serial = MockSerialIO(mock_responses)
+    dive = sd.get_dive(1)
+
+    # No samples are requested before the document is being written
+    sd = SerialDriver(None)
+    sd._serial = MockSerialIO(mock_responses)
+    header = sd.get_dive_header(1)
+    samples = sd.iter_dive_samples(1, header)
+    assert len(sd._serial.requests) == 1
+
+    output = StringIO()
+    write_xml(header, output, samples=samples)
+    assert not header.samples
+    assert output.getvalue() == convert_to_xml(dive)
@@ -24,11 +24,18 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
 import json
+from dataclasses import fields
+from io import BytesIO
 from pathlib import Path
 
 from ratio_dumper import SerialDriver
+from ratio_dumper.decoders import (decode_dive_header,
+                                   decode_dive_sample,
+                                   reference_decode_dive_header,
+                                   reference_decode_dive_sample)
 from ratio_dumper.models import DiveMode, WaterType, DecompressionAlgorithm
-from tests.utilities import MockSerialIO
+from ratio_dumper.utilities import CrcHelper
+from tests.utilities import FlakySerialIO, MockSerialIO, QuietSerialIO
 
 
 def test_get_dive_ids():
@@ -121,3 +128,110 @@ def test_get_dive_4():
     assert dive.samples[-1].ndl_or_tts == 32767
     assert dive.samples[-1].battery_voltage == 3.61
     assert dive.samples[-1].max_ppo2_or_setpoint == 1.4
+
+
+def test_get_dive_4_pipelined():
+    with (Path(__file__).parent / 'data' / 'dive_4.json').open('r') as fh:
+        mock_responses = json.loads(fh.read())
+
+    sd = SerialDriver(None)
+    sd._serial = MockSerialIO(mock_responses)
+    lock_step_dive = sd.get_dive(4)
+
+    sd = SerialDriver(None, pipeline_window=8)
+    sd._serial = MockSerialIO(mock_responses)
+    pipelined_dive = sd.get_dive(4)
+
+    assert pipelined_dive is not None
+    assert len(pipelined_dive.samples) == 151
+    assert pipelined_dive.samples == lock_step_dive.samples
+
+
+def test_get_dive_4_resyncs_without_bytes_waiting():
+    with (Path(__file__).parent / 'data' / 'dive_4.json').open('r') as fh:
+        mock_responses = json.loads(fh.read())
+
+    sd = SerialDriver(None)
+    sd._serial = MockSerialIO(mock_responses)
+    reference_dive = sd.get_dive(4)
+
+    # Stray bytes ahead of some replies, including one that looks like a start marker
+    sample_requests = [sd._encode_sample_request(sample_id).hex() for sample_id in (3, 50, 120)]
+    for request, stray in zip(sample_requests, ('00', 'ff00', '55')):
+        mock_responses[request] = stray + mock_responses[request]
+
+    for pipeline_window in (1, 8):
+        sd = SerialDriver(None, pipeline_window=pipeline_window)
+        sd._serial = QuietSerialIO(mock_responses)
+        dive = sd.get_dive(4)
+
+        assert dive is not None
+        assert dive.samples == reference_dive.samples
+        assert (sd.frame_reader.resyncs, sd.frame_reader.skipped_bytes) == (3, 4)
+        assert sd.frame_reader.crc_errors == 0
+
+
+def test_get_dive_1_pipelined_nak():
+    with (Path(__file__).parent / 'data' / 'dive_1.json').open('r') as fh:
+        mock_responses = json.loads(fh.read())
+
+    request = bytes.fromhex('55037a0500')
+    request += bytes.fromhex(CrcHelper.encode(CrcHelper.calculate(request)))
+    nak_frame = bytes.fromhex('55037a0115')
+    nak_frame += bytes.fromhex(CrcHelper.encode(CrcHelper.calculate(nak_frame)))
+    mock_responses[request.hex()] = nak_frame.hex()
+
+    sd = SerialDriver(None, pipeline_window=4)
+    sd._serial = MockSerialIO(mock_responses)
+    assert sd.get_dive(1) is None
+
+    # Every in-flight reply is drained, leaving the stream aligned for the next command
+    assert len(sd._serial.response_payload) == 0
+
+
+def test_get_dive_1_retries_failed_sample():
+    with (Path(__file__).parent / 'data' / 'dive_1.json').open('r') as fh:
+        mock_responses = json.loads(fh.read())
+
+    request = bytes.fromhex('55037a0500')
+    request += bytes.fromhex(CrcHelper.encode(CrcHelper.calculate(request)))
+    nak_frame = bytes.fromhex('55037a0115')
+    nak_frame += bytes.fromhex(CrcHelper.encode(CrcHelper.calculate(nak_frame)))
+
+    reference = SerialDriver(None)
+    reference._serial = MockSerialIO(mock_responses)
+    reference_dive = reference.get_dive(1)
+
+    for pipeline_window in (1, 4):
+        sd = SerialDriver(None, pipeline_window=pipeline_window, sample_retries=2, retry_delay=0)
+        sd._serial = FlakySerialIO(mock_responses, {request.hex(): nak_frame.hex()})
+        dive = sd.get_dive(1)
+
+        # Only the failed sample and those after it are requested again
+        assert dive is not None
+        assert dive.samples == reference_dive.samples
+        assert sd._serial.requests.count(sd._encode_sample_request(4).hex()) == 1
+        assert sd._serial.requests.count(request.hex()) == 2
+
+
+def test_struct_decoders_match_reference():
+    for fixture in ('dive_1.json', 'dive_4.json'):
+        with (Path(__file__).parent / 'data' / fixture).open('r') as fh:
+            mock_responses = json.loads(fh.read())
+
+        for response in mock_responses.values():
+            frame = bytes.fromhex(response)
+            payload = frame[3:-3]
+
+            if frame[2] == 121:
+                dive = decode_dive_header(payload)
+                reference_dive = reference_decode_dive_header(BytesIO(payload))
+                assert dive.software_version.as_numeric == \
+                    reference_dive.software_version.as_numeric
+                assert [getattr(dive, field.name) for field in fields(dive)
+                        if field.name != 'software_version'] == \
+                    [getattr(reference_dive, field.name) for field in fields(reference_dive)
+                     if field.name != 'software_version']
+            else:
+                assert decode_dive_sample(payload) == \
+                    reference_decode_dive_sample(BytesIO(payload))
@@ -0,0 +1,105 @@
+'''
+ratio_dumper - Ratio iX5M Log Dumper
+
+MIT License
+
+Copyright (c) 2021 Damian Zaremba
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from pathlib import Path
+
+from ratio_dumper import SerialDriver, download
+from ratio_dumper.download import DownloadProgress, _WritePipeline, download_dives
+from ratio_dumper.manifest import SyncManifest
+from ratio_dumper.utilities import CrcHelper
+from tests.utilities import MockSerialIO
+
+
+def _frame(body):
+    payload = bytes([0x55, len(body)]) + body
+    return (payload.hex() + CrcHelper.encode(CrcHelper.calculate(payload))).lower()
+
+
+def _mock_driver(dive_ids_body):
+    with (Path(__file__).parent / 'data' / 'dive_4.json').open('r') as fh:
+        mock_responses = json.loads(fh.read())
+    mock_responses['5502788de20b'] = _frame(dive_ids_body)
+
+    sd = SerialDriver(None)
+    sd._serial = MockSerialIO(mock_responses)
+    return sd
+
+
+def test_download_devices_in_parallel(tmp_path):
+    lines = []
+    progress = DownloadProgress(lines.append, show_totals=True)
+    devices = {
+        'ttyUSB0': _mock_driver(bytes([0x78, 4, 0, 4, 0, 6])),
+        'ttyUSB1': _mock_driver(bytes([0x78, 1, 21])),
+    }
+    with ThreadPoolExecutor(max_workers=len(devices)) as executor:
+        results = {}
+        for device, sd in devices.items():
+            (tmp_path / device).mkdir()
+            results[device] = executor.submit(download_dives, sd, tmp_path / device,
+                                              progress, device)
+
+    # The failing device does not stop the other from completing its download
+    assert {device: result.result() for device, result in results.items()} == \
+        {'ttyUSB0': True, 'ttyUSB1': False}
+    assert [path.name for path in (tmp_path / 'ttyUSB0').glob('*.xml')] == ['4.xml']
+    assert '[ttyUSB0]  - 4 (1/1)' in lines
+    assert any(line.startswith('[ttyUSB1] Failed to read dive logs') for line in lines)
+
+
+def test_write_pipeline_reports_in_order(tmp_path, monkeypatch):
+    dives = [_mock_driver(bytes([0x78, 4, 0, 4, 0, 6])).get_dive(4)]
+    dives.append(replace(dives[0], monotonic_time=1))
+    dives.append(replace(dives[0], monotonic_time=2))
+
+    def slow_write(dive, target_file):
+        if dive.monotonic_time == 2:
+            raise OSError('disk full')
+        if dive is dives[0]:
+            time.sleep(0.05)
+        target_file.write_text('')
+
+    monkeypatch.setattr(download, '_write_dive', slow_write)
+    lines = []
+    manifest = SyncManifest.load(tmp_path)
+    pipeline = _WritePipeline(manifest, DownloadProgress(lines.append), '', writers=2)
+    try:
+        pipeline.submit(4, dives[0])
+        pipeline.submit(5, dives[1])
+        pipeline.skip(6)
+        pipeline.submit(7, dives[2])
+        pipeline.drain()
+    finally:
+        pipeline.close()
+
+    # The slow first write is still reported first, and the failed write is not recorded
+    assert lines == [' - 4', ' - 5', ' - 6 [skipping]', ' - 7 [failed]', 'Failed to write dive']
+    assert pipeline.failed
+    assert sorted(entry.complete for entry in SyncManifest.load(tmp_path).entries.values()) == \
+        [False, True, True]
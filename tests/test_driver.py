@@ -26,6 +26,8 @@ SOFTWARE.
 from io import BytesIO
 
 from ratio_dumper import SerialDriver
+from ratio_dumper.framing import FrameReader
+from ratio_dumper.utilities import CRC_ENGINE, CrcHelper
 
 
 def test_payload_encoder():
@@ -38,4 +40,51 @@ def test_payload_decoder():
     sd._serial = BytesIO(bytes.fromhex('55067801000400064d48'))
     payload, error = sd._decode_payload(120)
     assert error is None
-    assert payload.read().hex() == '01000400'
+    assert payload.hex() == '01000400'
+
+
+def test_payload_decoder_resyncs_after_garbage():
+    sd = SerialDriver(None)
+    sd._serial = BytesIO(bytes.fromhex('00ff55' '55067801000400064d48'))
+    payload, error = sd._decode_payload(120)
+    assert error is None
+    assert payload.hex() == '01000400'
+    assert (sd.frame_reader.resyncs, sd.frame_reader.skipped_bytes) == (1, 3)
+
+
+def test_frame_reader_keeps_alignment_after_corrupt_frame():
+    good_frame = bytes.fromhex('55067801000400064d48')
+    bad_frame = bytes.fromhex('55067801000500064d48')
+    stream = BytesIO(bad_frame + good_frame + good_frame[:6])
+
+    # Bytes already buffered are searched for the next valid frame
+    reader = FrameReader()
+    reader._buffer += stream.read(len(bad_frame + good_frame))
+    assert reader.read_frame(stream) == good_frame
+    assert (reader.resyncs, reader.crc_errors) == (1, 0)
+
+    # Otherwise the damaged frame is dropped as a whole, keeping the next one aligned
+    stream.seek(0)
+    reader = FrameReader()
+    assert reader.read_frame(stream) is None
+    assert (reader.resyncs, reader.crc_errors) == (0, 1)
+    assert reader.read_frame(stream) == good_frame
+
+    # A partial frame left by a timeout is dropped rather than blocking the next read
+    assert reader.read_frame(stream) is None
+    assert reader.read_frame(BytesIO(good_frame)) == good_frame
+
+
+def test_crc_engine_incremental():
+    frame = bytes.fromhex('55067801000400064d48')
+    crc = CRC_ENGINE.calculate(frame[:1])
+    crc = CRC_ENGINE.calculate(frame[1:2], crc)
+    crc = CRC_ENGINE.calculate(frame[2:-2], crc)
+    assert crc == CrcHelper.calculate(frame[:-2]) == CrcHelper.decode(frame[-2], frame[-1])
+
+
+def test_crc_engine_verify_frames():
+    good_frame = bytes.fromhex('55067801000400064d48')
+    bad_frame = bytes.fromhex('55067801000500064d48')
+    assert CRC_ENGINE.verify(good_frame)
+    assert CRC_ENGINE.verify_frames([good_frame, bad_frame, b'']) == [True, False, False]
@@ -0,0 +1,97 @@
+'''
+ratio_dumper - Ratio iX5M Log Dumper
+
+MIT License
+
+Copyright (c) 2021 Damian Zaremba
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import json
+import time
+from pathlib import Path
+
+from serial import Serial
+
+from ratio_dumper import SerialDriver
+from ratio_dumper.decoders import decode_dive_header
+from ratio_dumper.emulator import DeviceEmulator, load_fixture, synthetic_dive
+
+DATA_PATH = Path(__file__).parent / 'data'
+
+
+def test_emulator_replays_fixture_frames():
+    emulator = DeviceEmulator(load_fixture(DATA_PATH / 'dive_4.json'))
+    with (DATA_PATH / 'dive_4.json').open('r') as fh:
+        for request, response in json.loads(fh.read()).items():
+            assert emulator.respond(bytes.fromhex(request)).hex() == response
+
+
+def test_synthetic_dive_header():
+    dive = decode_dive_header(synthetic_dive(7, sample_count=30, max_depth=18.0).header)
+    assert dive.dive_sample_count == 30
+    assert dive.depth_max == 18.0
+
+
+def test_driver_over_pty():
+    dives = {**load_fixture(DATA_PATH / 'dive_1.json'), 2: synthetic_dive(2, sample_count=40)}
+    with DeviceEmulator(dives, baudrate=None) as emulator:
+        with SerialDriver(emulator.port, pipeline_window=4) as sd:
+            assert sd.get_dive_ids() == {1, 2}
+            reference_dive = sd.get_dive(2)
+            assert reference_dive is not None
+            assert len(reference_dive.samples) == 40
+
+    # NAKs and corrupted replies are retried until the dive matches the clean transfer
+    with DeviceEmulator(dives, baudrate=None, nak_rate=0.05, corruption_rate=0.0005,
+                        seed=1) as emulator:
+        with SerialDriver(emulator.port, pipeline_window=4, sample_retries=5,
+                          retry_delay=0) as sd:
+            dive = sd.get_dive(2)
+
+    assert emulator.stats.naks > 0 and emulator.stats.corrupted_bytes > 0
+    assert dive is not None
+    assert dive.samples == reference_dive.samples
+
+
+def test_replies_are_paced_at_the_baud_rate():
+    dives = load_fixture(DATA_PATH / 'dive_1.json')
+    with DeviceEmulator(dives, baudrate=115200) as emulator:
+        with Serial(emulator.port, timeout=1) as serial:
+            request = SerialDriver(None, transport=serial)._encode_payload(121, [1, 0])
+            response = emulator.respond(request)
+            started = time.monotonic()
+            serial.write(request)
+
+            # The reply trickles in, a reader sees it in parts
+            waiting = set()
+            while serial.in_waiting < len(response) and time.monotonic() - started < 1:
+                waiting.add(serial.in_waiting)
+                time.sleep(0.0005)
+            elapsed = time.monotonic() - started
+            assert serial.read(len(response)) == response
+
+        assert waiting - {0}
+        assert elapsed >= 0.8 * len(response) * 10 / 115200
+
+        # The driver reassembles frames read in parts
+        with SerialDriver(emulator.port, pipeline_window=4) as sd:
+            dive = sd.get_dive(1)
+        assert dive is not None
+        assert len(dive.samples) == dive.dive_sample_count
@@ -0,0 +1,94 @@
+'''
+ratio_dumper - Ratio iX5M Log Dumper
+
+MIT License
+
+Copyright (c) 2021 Damian Zaremba
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import csv
+import json
+from pathlib import Path
+
+import pytest
+
+from ratio_dumper import SerialDriver
+from ratio_dumper.export import SAMPLE_COLUMNS, export_samples
+from ratio_dumper.utilities import SAMPLE_XML_FIELDS
+from tests.utilities import MockSerialIO
+
+
+def _load_dives():
+    dives = []
+    for dive_id in (1, 4):
+        with (Path(__file__).parent / 'data' / f'dive_{dive_id}.json').open('r') as fh:
+            sd = SerialDriver(None, columnar=(dive_id == 4))
+            sd._serial = MockSerialIO(json.loads(fh.read()))
+            dives.append((dive_id, sd.get_dive(dive_id)))
+    return dives
+
+
+def test_csv_export_matches_xml_units(tmp_path):
+    dives = _load_dives()
+    assert len(SAMPLE_COLUMNS) == len(SAMPLE_XML_FIELDS)
+
+    rows = export_samples(dives, tmp_path / 'samples.csv')
+    assert rows == sum(len(dive.samples) for _, dive in dives)
+
+    with (tmp_path / 'samples.csv').open('r', newline='') as fh:
+        exported = list(csv.DictReader(fh))
+    assert len(exported) == rows
+
+    sample = dives[1][1].samples[10]
+    row = exported[len(dives[0][1].samples) + 10]
+    assert row['diveId'] == '4'
+    assert {tag: int(row[tag]) for tag, _ in SAMPLE_XML_FIELDS} == {
+        tag: getter(sample) for tag, getter in SAMPLE_XML_FIELDS}
+
+
+def test_npz_export(tmp_path):
+    numpy = pytest.importorskip('numpy')
+    dives = _load_dives()
+
+    export_samples(dives, tmp_path / 'samples.npz')
+    with numpy.load(tmp_path / 'samples.npz') as columns:
+        assert columns['depthDm'].dtype == numpy.uint16
+        assert list(columns['depthDm'][:3]) == [int(sample.depth * 10)
+                                                for sample in dives[0][1].samples[:3]]
+
+
+def test_arrow_export(tmp_path):
+    pytest.importorskip('pyarrow')
+    from pyarrow import feather, parquet
+    dives = _load_dives()
+
+    for path, read_table in ((tmp_path / 'samples.arrow', feather.read_table),
+                             (tmp_path / 'samples.parquet', parquet.read_table)):
+        export_samples(dives, path)
+        table = read_table(path)
+        assert table.num_rows == sum(len(dive.samples) for _, dive in dives)
+        assert str(table.schema.field('depthDm').type) == 'uint16'
+        assert table.column('depthDm').to_pylist()[:3] == [
+            int(sample.depth * 10) for sample in dives[0][1].samples[:3]]
+
+
+def test_unknown_export_format(tmp_path):
+    with pytest.raises(ValueError):
+        export_samples(_load_dives(), tmp_path / 'samples.xlsx')
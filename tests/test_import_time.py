@@ -0,0 +1,63 @@
+'''
+ratio_dumper - Ratio iX5M Log Dumper
+
+MIT License
+
+Copyright (c) 2021 Damian Zaremba
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+# Imported only by the commands that need them, never just to start the CLI
+DEFERRED_MODULES = ('asyncio', 'concurrent.futures', 'crcmod', 'numpy', 'pyarrow', 'serial',
+                    'sqlite3', 'xml', 'ratio_dumper.async_driver', 'ratio_dumper.decoders',
+                    'ratio_dumper.driver')
+
+
+def _imported_modules(statement: str):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                            cwd=Path(__file__).parent.parent, capture_output=True, text=True,
+                            check=True)
+    # Lines look like "import time:  self [us] | cumulative | imported package"
+    return {line.rsplit('|', 1)[1].strip() for line in result.stderr.splitlines()
+            if line.startswith('import time:') and line.count('|') == 2}
+
+
+@pytest.mark.parametrize('statement', ['import ratio_dumper', 'import ratio_dumper.cli'])
+def test_startup_defers_heavy_imports(statement):
+    imported = _imported_modules(statement)
+    assert 'ratio_dumper' in imported
+    assert not {module for module in imported
+                for deferred in DEFERRED_MODULES
+                if module == deferred or module.startswith(f'{deferred}.')}
+
+
+def test_lazy_exports():
+    import ratio_dumper
+    from ratio_dumper.driver import SerialDriver
+
+    assert ratio_dumper.SerialDriver is SerialDriver
+    assert 'write_xml' in dir(ratio_dumper)
+    with pytest.raises(AttributeError):
+        ratio_dumper.missing
@@ -0,0 +1,75 @@
+'''
+ratio_dumper - Ratio iX5M Log Dumper
+
+MIT License
+
+Copyright (c) 2021 Damian Zaremba
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import json
+from datetime import datetime, timezone
+from pathlib import Path
+
+from ratio_dumper import SerialDriver
+from ratio_dumper.index import DiveIndex
+from tests.utilities import MockSerialIO
+
+
+def _mock_driver():
+    mock_responses = {'5502788de20b': '55067801000400064d48'}
+    for fixture in ('dive_1.json', 'dive_4.json'):
+        with (Path(__file__).parent / 'data' / fixture).open('r') as fh:
+            mock_responses.update(json.loads(fh.read()))
+
+    sd = SerialDriver(None)
+    sd._serial = MockSerialIO(mock_responses)
+    return sd
+
+
+def test_build_index_from_headers():
+    sd = _mock_driver()
+    index = DiveIndex()
+    assert index.refresh(sd, {1, 4})
+
+    # Only headers are requested, no samples
+    assert all(request[4:6] == '79' for request in sd._serial.requests)
+
+    assert [entry.dive_id for entry in index] == [1, 4]
+    assert index.entries[4].depth_max == 10.97
+    assert index.entries[4].avg_depth == 7.19
+    assert index.entries[4].dive_sample_count == 151
+    assert index.entries[1].software_release == '4.1.26/016'
+
+    assert [entry.dive_id for entry in index.select(min_depth=10)] == [4]
+    assert [entry.dive_id for entry in index.select(
+        until=datetime(2013, 1, 1, tzinfo=timezone.utc))] == [1]
+
+
+def test_cached_index_refresh(tmp_path):
+    index = DiveIndex()
+    assert index.refresh(_mock_driver(), {1, 4})
+    index.save(tmp_path / 'index.json')
+
+    # Only the highest indexed dive is checked for renumbering
+    sd = _mock_driver()
+    cached_index = DiveIndex.load(tmp_path / 'index.json')
+    assert cached_index.refresh(sd, {1, 4})
+    assert sd._serial.requests == [sd._encode_payload(121, [4, 0]).hex()]
+    assert list(cached_index) == list(index)
@@ -0,0 +1,97 @@
+'''
+ratio_dumper - Ratio iX5M Log Dumper
+
+MIT License
+
+Copyright (c) 2021 Damian Zaremba
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import json
+from dataclasses import replace
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+
+from ratio_dumper import SerialDriver
+from ratio_dumper.decoders import dive_header_to_values
+from ratio_dumper.logbook import DiveLogbook
+from ratio_dumper.models import DiveMode, WaterType
+from tests.utilities import MockSerialIO
+
+
+def _load_dive(name: str, dive_id: int):
+    with (Path(__file__).parent / 'data' / name).open('r') as fh:
+        sd = SerialDriver(None)
+        sd._serial = MockSerialIO(json.loads(fh.read()))
+        return sd.get_dive(dive_id)
+
+
+def test_logbook_round_trip(tmp_path):
+    dive_1, dive_4 = _load_dive('dive_1.json', 1), _load_dive('dive_4.json', 4)
+
+    with DiveLogbook(tmp_path / 'logbook.db') as logbook:
+        assert logbook.ingest([(1, dive_1), (4, dive_4)]) == 2
+
+    with DiveLogbook(tmp_path / 'logbook.db') as logbook:
+        assert not logbook.add(1, dive_1)
+        assert len(logbook) == 2
+        assert dive_4 in logbook
+
+        logged_dive = logbook.get(4)
+        assert dive_header_to_values(logged_dive) == dive_header_to_values(dive_4)
+        assert logged_dive.samples == dive_4.samples
+        assert list(logbook.column(logbook.find(1), 'depth')) == [
+            round(sample.depth * 10) for sample in dive_1.samples]
+
+
+def test_logbook_keeps_dives_added_before_a_failure(tmp_path):
+    dive_1, dive_4 = _load_dive('dive_1.json', 1), _load_dive('dive_4.json', 4)
+
+    def device_dives():
+        # The device fails while the second dive is being read
+        yield 1, dive_1
+        raise IOError('Failed to read dive 4')
+
+    with DiveLogbook(tmp_path / 'logbook.db') as logbook:
+        with pytest.raises(IOError):
+            logbook.ingest(device_dives())
+
+    with DiveLogbook(tmp_path / 'logbook.db') as logbook:
+        assert len(logbook) == 1
+        assert logbook.get(1).samples == dive_1.samples
+        assert logbook.ingest([(1, dive_1), (4, dive_4)]) == 1
+
+
+def test_logbook_select(tmp_path):
+    dive_1, dive_4 = _load_dive('dive_1.json', 1), _load_dive('dive_4.json', 4)
+    salt_dive = replace(dive_4, water=WaterType.Salt, monotonic_time=dive_4.monotonic_time + 1)
+
+    with DiveLogbook(tmp_path / 'logbook.db') as logbook:
+        assert logbook.ingest([(1, dive_1), (4, dive_4), (5, salt_dive)]) == 3
+
+        assert [entry.dive_id for entry in logbook.select(water=WaterType.Salt)] == [5]
+        assert [entry.dive_id for entry in logbook.select(dive_mode=DiveMode.OC,
+                                                          water=WaterType.Fresh)] == [1, 4]
+        assert [entry.dive_id for entry in logbook.select(min_depth=10)] == [4, 5]
+        assert [entry.dive_id for entry in logbook.select(max_depth=10)] == [1]
+        assert [entry.dive_id for entry in logbook.select(
+            since=datetime(2013, 1, 1, tzinfo=timezone.utc),
+            until=datetime(2013, 2, 1, tzinfo=timezone.utc))] == [4, 5]
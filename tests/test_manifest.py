@@ -0,0 +1,86 @@
+'''
+ratio_dumper - Ratio iX5M Log Dumper
+
+MIT License
+
+Copyright (c) 2021 Damian Zaremba
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import json
+from pathlib import Path
+
+from ratio_dumper import SerialDriver
+from ratio_dumper.manifest import SyncManifest
+from tests.utilities import MockSerialIO
+
+
+def _mock_driver(header_dive_ids=None):
+    '''A driver serving dive 1 and dive 4, optionally re-numbering their headers.'''
+    mock_responses = {}
+    for fixture in ('dive_1.json', 'dive_4.json'):
+        with (Path(__file__).parent / 'data' / fixture).open('r') as fh:
+            mock_responses.update(json.loads(fh.read()))
+
+    sd = SerialDriver(None)
+    for device_dive_id, fixture_dive_id in (header_dive_ids or {}).items():
+        fixture_request = sd._encode_payload(121, [fixture_dive_id, 0]).hex()
+        device_request = sd._encode_payload(121, [device_dive_id, 0]).hex()
+        mock_responses[device_request] = mock_responses[fixture_request]
+
+    sd._serial = MockSerialIO(mock_responses)
+    return sd
+
+
+def _sync(manifest, sd, dive_ids):
+    pending_dive_ids = manifest.plan(sd, dive_ids)
+    for dive_id in pending_dive_ids:
+        dive = sd.get_dive(dive_id)
+        manifest.start(dive_id, dive).write_text('')
+        manifest.complete(dive)
+    manifest.finish(dive_ids)
+    return pending_dive_ids
+
+
+def test_incremental_sync(tmp_path):
+    assert _sync(SyncManifest.load(tmp_path), _mock_driver(), {1, 4}) == [1, 4]
+    assert sorted(path.name for path in tmp_path.glob('*.xml')) == ['1.xml', '4.xml']
+
+    # Known dives are skipped after checking only the header of the highest synced dive
+    sd = _mock_driver()
+    assert _sync(SyncManifest.load(tmp_path), sd, {1, 4}) == []
+    assert sd._serial.requests == [sd._encode_payload(121, [4, 0]).hex()]
+
+
+def test_sync_survives_renumbering(tmp_path):
+    _sync(SyncManifest.load(tmp_path), _mock_driver(), {1, 4})
+
+    # The device now numbers the same two dives 1 and 2, the range moved backwards
+    manifest = SyncManifest.load(tmp_path)
+    assert manifest.detect_wraparound({1, 2})
+    assert _sync(manifest, _mock_driver({2: 4}), {1, 2}) == []
+
+    entries = SyncManifest.load(tmp_path).entries.values()
+    assert sorted((entry.dive_id, entry.file_name) for entry in entries) == \
+        [(1, '1.xml'), (2, '4.xml')]
+
+
+def test_sync_adopts_existing_files(tmp_path):
+    (tmp_path / '1.xml').write_text('')
+    assert _sync(SyncManifest.load(tmp_path), _mock_driver(), {1, 4}) == [4]
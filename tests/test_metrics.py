@@ -0,0 +1,97 @@
+'''
+ratio_dumper - Ratio iX5M Log Dumper
+
+MIT License
+
+Copyright (c) 2021 Damian Zaremba
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import json
+import threading
+from pathlib import Path
+
+from ratio_dumper import SerialDriver
+from ratio_dumper.metrics import (CallbackSink,
+                                  EventKind,
+                                  PrometheusTextfileSink,
+                                  TransferEvent,
+                                  TransferMetrics)
+from ratio_dumper.utilities import CrcHelper
+from tests.utilities import FlakySerialIO
+
+
+def test_transfer_metrics(tmp_path):
+    with (Path(__file__).parent / 'data' / 'dive_1.json').open('r') as fh:
+        mock_responses = json.loads(fh.read())
+
+    nak_frame = bytes.fromhex('55037a0115')
+    nak_frame += bytes.fromhex(CrcHelper.encode(CrcHelper.calculate(nak_frame)))
+
+    events = []
+    metrics = TransferMetrics()
+    textfile = PrometheusTextfileSink(tmp_path / 'ratio_dumper.prom', labels={'port': 'test'})
+    with SerialDriver(None, sample_retries=1, retry_delay=0,
+                      metrics_sinks=[metrics, CallbackSink(events.append)]) as sd:
+        sd.add_metrics_sink(textfile)
+        sd._serial = FlakySerialIO(mock_responses,
+                                   {sd._encode_sample_request(5).hex(): nak_frame.hex()})
+        dive = sd.get_dive(1)
+
+    samples = metrics.commands[122]
+    assert (samples.requests, samples.replies, samples.naks, samples.retries) == \
+        (dive.dive_sample_count + 1, dive.dive_sample_count, 1, 1)
+    assert samples.bytes_out == 7 * samples.requests
+    assert samples.latency_count == samples.replies + samples.naks
+    assert sum(samples.latency_buckets) == samples.latency_count
+    assert metrics.frames_per_second() > 0
+    assert [event.kind for event in events[:2]] == [EventKind.REQUEST, EventKind.REPLY]
+
+    # The driver leaves closing its sinks to whoever created them
+    assert not (tmp_path / 'ratio_dumper.prom').exists()
+    textfile.close()
+    prometheus = (tmp_path / 'ratio_dumper.prom').read_text()
+    assert 'ratio_dumper_naks_total{port="test",command="dive_sample"} 1\n' in prometheus
+    assert (f'ratio_dumper_reply_latency_seconds_count{{port="test",command="dive_sample"}} '
+            f'{samples.latency_count}\n') in prometheus
+
+
+def test_textfile_sink_shared_between_threads(tmp_path):
+    # As with one --metrics-file for a download from several devices
+    textfile = PrometheusTextfileSink(tmp_path / 'ratio_dumper.prom', interval=0)
+    errors = []
+
+    def record():
+        try:
+            for _ in range(200):
+                textfile.record(TransferEvent(EventKind.REQUEST, 122, size=7))
+        except Exception as e:  # pylint: disable=broad-except
+            errors.append(e)
+
+    threads = [threading.Thread(target=record) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    textfile.close()
+
+    assert errors == []
+    assert list(tmp_path.glob('.*.tmp')) == []
+    assert 'ratio_dumper_requests_total{command="dive_sample"} 400\n' in \
+        (tmp_path / 'ratio_dumper.prom').read_text()
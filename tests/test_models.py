@@ -23,7 +23,14 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
+import copy
+import json
+import pickle
+from pathlib import Path
+
+from ratio_dumper import SerialDriver
 from ratio_dumper.models import SoftwareVersion
+from tests.utilities import MockSerialIO
 
 
 def test_software_version():
@@ -33,3 +40,29 @@ def test_software_version():
     assert sv.patch == "26"
     assert sv.build == "016"
     assert sv.as_release == "4.1.26/016"
+
+
+def test_models_are_slotted_and_picklable():
+    sd = SerialDriver(None)
+    with (Path(__file__).parent / 'data' / 'dive_1.json').open('r') as fh:
+        sd._serial = MockSerialIO(json.loads(fh.read()))
+    dive = sd.get_dive(1)
+
+    for model in (dive, dive.samples[0], dive.samples[0].active_mix, dive.software_version):
+        assert not hasattr(model, '__dict__')
+
+    # Frozen slotted dataclasses need their own state handling to unpickle
+    unpickled_dive = pickle.loads(pickle.dumps(dive))
+    assert unpickled_dive.samples == dive.samples
+    assert unpickled_dive.software_version.as_release == dive.software_version.as_release
+    assert copy.deepcopy(dive.samples[0]) == dive.samples[0]
+
+
+def test_sample_sub_objects_are_shared():
+    sd = SerialDriver(None)
+    with (Path(__file__).parent / 'data' / 'dive_1.json').open('r') as fh:
+        sd._serial = MockSerialIO(json.loads(fh.read()))
+    samples = sd.get_dive(1).samples
+
+    assert samples[0].active_mix is samples[-1].active_mix
+    assert samples[0].algorithm_settings is samples[-1].algorithm_settings
@@ -23,20 +23,98 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
-from io import BytesIO
+import time
+from collections import deque
+from typing import Deque, Dict, List, Tuple
 
 
 class MockSerialIO:
-    def __init__(self, mock_responses):
+    def __init__(self, mock_responses: Dict[str, str]) -> None:
         self.mock_responses = mock_responses
-        self.response_payload = BytesIO()
+        self.response_payload = bytearray()
+        self.requests: List[str] = []
 
-    def write(self, raw_payload):
+    def write(self, raw_payload: bytes) -> None:
         payload = raw_payload.hex()
         assert payload in self.mock_responses
+        self.requests.append(payload)
 
-        expected_response = self.mock_responses[payload]
-        self.response_payload = BytesIO(bytes.fromhex(expected_response))
+        # Responses queue up behind each other, like a real device handling pipelined requests
+        self.response_payload += bytes.fromhex(self.mock_responses[payload])
 
-    def read(self, *args, **kwargs):
-        return self.response_payload.read(*args, **kwargs)
+    @property
+    def in_waiting(self) -> int:
+        return len(self.response_payload)
+
+    def read(self, size: int = 1) -> bytes:
+        data = bytes(self.response_payload[:size])
+        del self.response_payload[:size]
+        return data
+
+    def close(self) -> None:
+        pass
+
+
+class FlakySerialIO(MockSerialIO):
+    '''MockSerialIO that answers some requests with a different reply the first time.'''
+
+    def __init__(self, mock_responses: Dict[str, str], first_responses: Dict[str, str]) -> None:
+        super().__init__(mock_responses)
+        self.first_responses = dict(first_responses)
+
+    def write(self, raw_payload: bytes) -> None:
+        payload = raw_payload.hex()
+        if payload not in self.first_responses:
+            super().write(raw_payload)
+            return
+
+        self.requests.append(payload)
+        self.response_payload += bytes.fromhex(self.first_responses.pop(payload))
+
+    def reset_input_buffer(self) -> None:
+        self.response_payload.clear()
+
+
+class QuietSerialIO(MockSerialIO):
+    '''MockSerialIO that never reports bytes waiting, like a real port between reads.'''
+
+    @property
+    def in_waiting(self) -> int:
+        return 0
+
+
+class LatencySerialIO(MockSerialIO):
+    '''MockSerialIO that simulates link latency and transfer time.
+
+    Each request reaches the device after `latency` seconds, the device answers
+    one request at a time and every response byte costs 10 bits on the wire.
+    '''
+
+    def __init__(self,
+                 mock_responses: Dict[str, str],
+                 latency: float = 0.008,
+                 baudrate: int = 115200) -> None:
+        super().__init__(mock_responses)
+        self.latency = latency
+        self.byte_time = 10.0 / baudrate
+        self.pending: Deque[Tuple[float, bytes]] = deque()
+        self.device_free_at = 0.0
+
+    def write(self, raw_payload: bytes) -> None:
+        payload = raw_payload.hex()
+        assert payload in self.mock_responses
+
+        response = bytes.fromhex(self.mock_responses[payload])
+        arrived_at = time.monotonic() + (len(raw_payload) * self.byte_time) + self.latency
+        started_at = max(arrived_at, self.device_free_at)
+        self.device_free_at = started_at + (len(response) * self.byte_time)
+        self.pending.append((self.device_free_at + self.latency, response))
+
+    def read(self, size: int = 1) -> bytes:
+        while len(self.response_payload) < size and self.pending:
+            ready_at, response = self.pending.popleft()
+            delay = ready_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.response_payload += response
+        return super().read(size)